@@ -0,0 +1,213 @@
+"""
+Benchmark for the fake Sentry servers.
+
+Starts the Flask app (with the threaded werkzeug server, and under uwsgi when it is
+installed) and the asyncio server in separate processes and measures how many (gzipped)
+envelopes per second they accept from `--connections` keep-alive connections.
+
+The load is generated by an asyncio client in this process (on a single core the client
+and the server compete for the CPU, the results are only comparable with each other).
+
+Usage:
+
+    python -m benchmarks.fake_sentry [--duration SECONDS] [--connections N]
+        [--pipeline N] [--servers flask,uwsgi,asyncio]
+        [--inspection none|headers|sampled|full]
+"""
+import argparse
+import asyncio
+import gzip
+import importlib.util
+import logging
+import multiprocessing
+import shutil
+import socket
+import time
+
+from sentry_sdk.envelope import Envelope
+
+from fake_sentry.inspection import INSPECTION_LEVELS
+
+_HOST = "127.0.0.1"
+
+
+def _envelope_request(project_id: int = 42) -> bytes:
+    envelope = Envelope(headers={"event_id": "a" * 32})
+    envelope.add_event(
+        {
+            "event_id": "a" * 32,
+            "level": "error",
+            "message": "a benchmark event",
+            "breadcrumbs": [{"message": "crumb %d" % idx} for idx in range(20)],
+        }
+    )
+    body = gzip.compress(envelope.serialize())
+    return (
+        b"POST /api/%d/envelope/ HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Content-Type: application/x-sentry-envelope\r\n"
+        b"Content-Encoding: gzip\r\n"
+        b"Content-Length: %d\r\n\r\n%s" % (project_id, _HOST.encode(), len(body), body)
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((_HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _run_flask(port, inspection):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from fake_sentry.fake_sentry import config, configure_app
+
+    app = configure_app({**config, "port": port, "envelope_inspection": inspection})
+
+    # don't measure the (per request) debug logging
+    logging.getLogger("fake_sentry.fake_sentry").setLevel(logging.WARNING)
+    # keep-alive connections
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    make_server(_HOST, port, app, threaded=True).serve_forever()
+
+
+def _run_uwsgi(port, inspection):
+    import mywsgi
+
+    # runs the app module as configured by `make fake-sentry` (the inspection
+    # level is read from the configuration file)
+    mywsgi.run("fake_sentry.fake_sentry:app", f"{_HOST}:{port}", disable_logging=True)
+
+
+def _run_asyncio(port, inspection):
+    from fake_sentry.asyncio_server import run_asyncio_server
+    from fake_sentry.inspection import EnvelopeInspector
+    from fake_sentry.stats import SharedStats
+
+    stats = SharedStats()
+    inspector = EnvelopeInspector(inspection, stats=stats)
+    run_asyncio_server(_HOST, port, inspector=inspector, stats=stats)
+
+
+_SERVERS = {
+    "flask": _run_flask,
+    "uwsgi": _run_uwsgi,
+    "asyncio": _run_asyncio,
+}
+
+
+def _uwsgi_installed() -> bool:
+    # mywsgi runs pyuwsgi (or the uwsgi executable)
+    return (
+        importlib.util.find_spec("pyuwsgi") is not None
+        or shutil.which("uwsgi") is not None
+    )
+
+
+def _wait_for_server(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((_HOST, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+async def _connection_load(port, request, pipeline, deadline, counters):
+    batch = request * pipeline
+    while time.monotonic() < deadline:
+        reader, writer = await asyncio.open_connection(_HOST, port)
+        try:
+            while time.monotonic() < deadline:
+                writer.write(batch)
+                if not await _read_responses(reader, pipeline, counters):
+                    # the server closed the connection (the unanswered requests are lost)
+                    counters["reconnects"] += 1
+                    break
+        finally:
+            writer.close()
+
+
+async def _read_responses(reader, count, counters) -> bool:
+    for _ in range(count):
+        status_line = await reader.readline()
+        if not status_line:
+            return False
+        content_length = 0
+        close = False
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            name = name.lower()
+            if name == b"content-length":
+                content_length = int(value)
+            elif name == b"connection":
+                close = value.strip().lower() == b"close"
+        await reader.readexactly(content_length)
+        if status_line.split(b" ", 2)[1] == b"200":
+            counters["ok"] += 1
+        else:
+            counters["failed"] += 1
+        if close:
+            return False
+    return True
+
+
+async def _load(port, request, connections, pipeline, duration):
+    counters = {"ok": 0, "failed": 0, "reconnects": 0}
+    deadline = time.monotonic() + duration
+    await asyncio.gather(
+        *(
+            _connection_load(port, request, pipeline, deadline, counters)
+            for _ in range(connections)
+        )
+    )
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument(
+        "--pipeline", type=int, default=1, help="requests sent at once per connection"
+    )
+    parser.add_argument("--servers", default="flask,uwsgi,asyncio")
+    parser.add_argument("--inspection", default="headers", choices=INSPECTION_LEVELS)
+    args = parser.parse_args()
+
+    request = _envelope_request()
+    context = multiprocessing.get_context("spawn")
+
+    for name in args.servers.split(","):
+        if name == "uwsgi" and not _uwsgi_installed():
+            print(f"{name:<8} skipped (uwsgi is not installed)")
+            continue
+
+        port = _free_port()
+        server = context.Process(
+            target=_SERVERS[name], args=(port, args.inspection), daemon=True
+        )
+        server.start()
+        try:
+            _wait_for_server(port)
+            counters = asyncio.run(
+                _load(port, request, args.connections, args.pipeline, args.duration)
+            )
+        finally:
+            server.terminate()
+            server.join()
+
+        print(
+            f"{name:<8} {counters['ok'] / args.duration:>10.1f} envelopes/sec "
+            f"({counters['failed']} failed, {counters['reconnects']} reconnects)"
+        )
+
+
+if __name__ == "__main__":
+    main()
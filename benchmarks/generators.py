@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for the payload generators.
+
+Measures how many events/sec a single core can generate for the default
+`RandomEvents` and `TransactionEvents` configurations (as found in
+`default_config/simple.test.yml`).
+
+Usage:
+
+    python -m benchmarks.generators [--duration SECONDS]
+"""
+import argparse
+import time
+from copy import deepcopy
+
+from yaml import load
+
+try:
+    from yaml import CFullLoader as FullLoader
+except ImportError:
+    from yaml import FullLoader
+
+from infrastructure import full_path_from_module_relative_path
+from infrastructure.generators.event import base_event_generator
+from tasks.event_tasks import transaction_generator, get_transaction_event_params
+
+
+def _task_params(user_name, task_name):
+    config_path = full_path_from_module_relative_path(
+        __file__, "..", "default_config", "simple.test.yml"
+    )
+    with open(config_path, "r") as f:
+        config = load(f, Loader=FullLoader)
+    params = deepcopy(config["users"][user_name]["tasks"][task_name])
+    params.pop("weight", None)
+    return params
+
+
+def _bench_generators():
+    return {
+        "RandomEvents.random_event_task_factory": base_event_generator(
+            **_task_params("RandomEvents", "random_event_task_factory")
+        ),
+        "RandomEvents.random_envelope_event_task_factory": base_event_generator(
+            **_task_params("RandomEvents", "random_envelope_event_task_factory")
+        ),
+        "TransactionEvents.transaction_event_task_factory": transaction_generator(
+            **get_transaction_event_params(
+                _task_params("TransactionEvents", "transaction_event_task_factory")
+            )
+        ),
+    }
+
+
+def measure(generator, duration):
+    """
+    Calls the generator repeatedly for (at least) `duration` seconds and
+    returns the number of generated events per second
+    """
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(100):
+            generator()
+        count += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    for name, generator in _bench_generators().items():
+        rate = measure(generator, args.duration)
+        print(f"{name:<50} {rate:>10.0f} events/sec")
+
+
+if __name__ == "__main__":
+    main()
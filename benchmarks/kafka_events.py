@@ -0,0 +1,101 @@
+"""
+Micro-benchmark for the kafka event send path.
+
+Measures the CPU cost of `random_kafka_event_task_factory` (generate, normalize and
+encode an event plus the accepted outcome) for the default `Events` configuration
+(as found in `default_config/kafka_consumers.test.yml`), with and without an event pool
+of pre-normalized events.
+
+The messages are handed to a producer that drops them, no kafka broker is needed.
+
+Usage:
+
+    python -m benchmarks.kafka_events [--duration SECONDS] [--pool-size N] [--encoder-processes N]
+"""
+import argparse
+from copy import deepcopy
+
+from locust import events
+from yaml import load
+
+try:
+    from yaml import CFullLoader as FullLoader
+except ImportError:
+    from yaml import FullLoader
+
+from benchmarks.generators import measure
+from infrastructure import full_path_from_module_relative_path
+from infrastructure.config import create_project_table
+from infrastructure.kafka import KafkaProducerMixin
+from tasks.kafka_tasks import random_kafka_event_task_factory
+
+
+class _NullProducer:
+    def produce(self, topic, value, key=None):
+        return True
+
+
+class _BenchUser(KafkaProducerMixin):
+    def __init__(self, num_projects):
+        self.config = {}
+        self.producer = _NullProducer()
+        self.project_table = create_project_table(num_projects)
+
+
+def _task_params():
+    config_path = full_path_from_module_relative_path(
+        __file__, "..", "default_config", "kafka_consumers.test.yml"
+    )
+    with open(config_path, "r") as f:
+        config = load(f, Loader=FullLoader)
+    user_config = config["users"]["Events"]
+    params = deepcopy(user_config["tasks"]["random_kafka_event_task_factory"])
+    params.pop("weight", None)
+    return params, user_config.get("num_projects", 1)
+
+
+def _bench_tasks(pool_size, encoder_processes):
+    params, num_projects = _task_params()
+    pooled = {**params, "event_pool_size": pool_size}
+    tasks = {
+        "random_kafka_event_task_factory": random_kafka_event_task_factory(
+            deepcopy(params)
+        ),
+        f"  pool {pool_size}": random_kafka_event_task_factory(deepcopy(pooled)),
+        f"  pool {pool_size}, prenormalize": random_kafka_event_task_factory(
+            {**deepcopy(pooled), "prenormalize": True}
+        ),
+    }
+    if encoder_processes:
+        # measures the cost for the user, the events are encoded in other processes
+        tasks[
+            f"  {encoder_processes} encoder processes"
+        ] = random_kafka_event_task_factory(
+            {**deepcopy(params), "encoder_processes": encoder_processes}
+        )
+    return num_projects, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--pool-size", type=int, default=1000)
+    parser.add_argument(
+        "--encoder-processes",
+        type=int,
+        default=0,
+        help="also measure sending events encoded in this many separate processes",
+    )
+    args = parser.parse_args()
+
+    num_projects, tasks = _bench_tasks(args.pool_size, args.encoder_processes)
+    user = _BenchUser(num_projects)
+    for name, task in tasks.items():
+        task(user)  # warm up (e.g. start the encoder processes)
+        rate = measure(lambda: task(user), args.duration)
+        print(f"{name:<50} {rate:>10.0f} events/sec ({1e6 / rate:.0f} us/event)")
+    events.quitting.fire(environment=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark for the project config responses of the fake Sentry.
+
+Measures the projectconfigs responses (for 1, 10, 100 and 1000 project keys) assembled
+from the cached fragments and rendered from the templates for every request
+(as the fake Sentry used to do).
+
+Usage:
+
+    python -m benchmarks.project_configs [--duration SECONDS]
+"""
+import argparse
+import json
+
+from benchmarks.generators import measure
+from fake_sentry.projects import ProjectConfigs
+
+KEY_COUNTS = (1, 10, 100, 1000)
+
+
+def _rendered(project_configs, keys):
+    return lambda: json.dumps(
+        {"configs": {key: project_configs.render(key) for key in keys}}
+    ).encode()
+
+
+def _cached(project_configs, keys):
+    return lambda: project_configs.response(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    project_configs = ProjectConfigs()
+    for num_keys in KEY_COUNTS:
+        keys = ["%032x" % idx for idx in range(1, num_keys + 1)]
+        for name, response in (
+            ("rendered", _rendered(project_configs, keys)),
+            ("cached", _cached(project_configs, keys)),
+        ):
+            rate = measure(response, args.duration)
+            print(
+                f"{num_keys:>5} keys {name:<10} {rate:>10.0f} responses/sec "
+                f"{rate * num_keys:>12.0f} configs/sec"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Micro-benchmark for the span tree generation of transactions.
+
+Measures `create_spans` for trees of 10, 100, 1000 and 10000 spans, with NumPy
+(when installed) and with the pure python fallback.
+
+Usage:
+
+    python -m benchmarks.spans [--duration SECONDS]
+"""
+import argparse
+import time
+
+from benchmarks.generators import measure
+from infrastructure.generators import transaction
+from infrastructure.generators.transaction import create_spans
+
+SPAN_COUNTS = (10, 100, 1000, 10000)
+
+
+def _create_spans(num_spans):
+    now = time.time()
+    return lambda: create_spans(
+        min_spans=num_spans,
+        max_spans=num_spans,
+        transaction_id="a" * 16,
+        trace_id="b" * 32,
+        transaction_start=now - 10,
+        timestamp=now,
+        operations_generator=lambda: "db",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    numpy = transaction.numpy
+    variants = [("numpy", numpy)] if numpy is not None else []
+    variants.append(("python", None))
+
+    for name, module in variants:
+        transaction.numpy = module
+        for num_spans in SPAN_COUNTS:
+            rate = measure(_create_spans(num_spans), args.duration)
+            print(
+                f"{name:<8} {num_spans:>6} spans {rate:>10.1f} trees/sec "
+                f"({1e6 / (rate * num_spans):.2f} us/span)"
+            )
+    transaction.numpy = numpy
+
+
+if __name__ == "__main__":
+    main()
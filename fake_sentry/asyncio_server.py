@@ -0,0 +1,527 @@
+"""
+The fake Sentry routes on a plain asyncio HTTP/1.1 server.
+
+The Flask app (see fake_sentry.py) decompresses and deserializes every envelope it
+receives, when load testing Relay it often saturates before Relay does. This server
+serves the same routes from an `asyncio.Protocol`:
+
+* requests are parsed with a few bytes operations (keep-alive, pipelined requests,
+  chunked bodies and `Expect: 100-continue` are supported)
+* events are accepted without looking at their body, envelopes are inspected as
+  configured (see `fake_sentry.inspection`)
+* the relay registration and project config routes parse their (small) JSON bodies
+* `GET /stats` returns the counters of all the processes (see `fake_sentry.stats`)
+* latency, errors, rate limits and slow-drip responses are injected as configured
+  (see `fake_sentry.faults`), delayed responses are sent by tasks (in order) without
+  blocking the event loop
+
+uvloop is used when installed.
+
+NOTE: like the Flask app under uwsgi, with more than one process every process keeps
+its own registered relays, Relay must be restarted if the fake Sentry is restarted.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from typing import Callable, Dict, Mapping, NamedTuple, Optional, Tuple
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from fake_sentry.faults import DRIP_INTERVAL, Fault, FaultInjector, drip_chunks
+from fake_sentry.inspection import EnvelopeInspector
+from fake_sentry.projects import ProjectConfigs
+from fake_sentry.stats import SharedStats
+
+_log = logging.getLogger(__name__)
+
+_MAX_HEAD_SIZE = 64 * 1024
+
+_REASONS = {
+    200: b"OK",
+    400: b"Bad Request",
+    405: b"Method Not Allowed",
+    429: b"Too Many Requests",
+    500: b"Internal Server Error",
+    502: b"Bad Gateway",
+    503: b"Service Unavailable",
+    504: b"Gateway Timeout",
+}
+
+_JSON = b"application/json"
+_HTML = b"text/html; charset=utf-8"
+_CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+_ROOT_PAGE = b"<h1>Fake Sentry</h1><div>This is the root url</div>"
+_CATCH_ALL_PAGE = (
+    "<h1>Fake Sentry</h1>"
+    + "<div>You have called fake-sentry on: <nbsp/>"
+    + "<span style='font-family:monospace; background-color:#e8e8e8;'>{}</span></div>"
+    + "<h3><b>Note:</b> This is probably the wrong url to call !!!<h3/>"
+)
+
+# (status, content type, body)
+Response = Tuple[int, bytes, bytes]
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class RequestHead(NamedTuple):
+    method: str
+    path: str
+    query: str
+    headers: Mapping[str, str]  # lower case names
+    content_length: int
+    chunked: bool
+    keep_alive: bool
+
+
+def encode_response(
+    status: int,
+    content_type: bytes,
+    body: bytes,
+    keep_alive=True,
+    headers: bytes = b"",
+):
+    """
+    Encodes a response, `headers` are extra (encoded) header lines
+    """
+    return b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s%s\r\n%s" % (
+        status,
+        _REASONS.get(status, b"Error"),
+        content_type,
+        len(body),
+        headers,
+        b"" if keep_alive else b"Connection: close\r\n",
+        body,
+    )
+
+
+def _encode_headers(headers) -> bytes:
+    return b"".join(b"%s: %s\r\n" % (n.encode(), v.encode()) for n, v in headers)
+
+
+def _json_response(value) -> Response:
+    return 200, _JSON, json.dumps(value, separators=(",", ":")).encode()
+
+
+def _event_id_response() -> Response:
+    return 200, _JSON, b'{"event_id":"%s"}' % os.urandom(16).hex().encode()
+
+
+def _error_response(message: str, status: int = 400) -> Response:
+    return status, _HTML, message.encode()
+
+
+class FakeSentryApp:
+    """
+    The routes of the fake Sentry (the same as the Flask app)
+    """
+
+    def __init__(
+        self,
+        inspector: Optional[EnvelopeInspector] = None,
+        project_configs: Optional[ProjectConfigs] = None,
+        stats: Optional[SharedStats] = None,
+        stats_log_interval: Optional[float] = None,
+        faults: Optional[FaultInjector] = None,
+    ):
+        self.stats = stats or SharedStats()
+        self.inspector = inspector or EnvelopeInspector(level="none", stats=self.stats)
+        self.project_configs = project_configs or ProjectConfigs()
+        self.stats_log_interval = stats_log_interval
+        self.faults = faults or FaultInjector()
+        self.authenticated_relays: Dict[str, str] = {}
+        self._relay_routes: Dict[str, Callable[[RequestHead, bytes], Response]] = {
+            "/api/0/relays/register/challenge/": self.get_challenge,
+            "/api/0/relays/register/response/": self.check_challenge,
+            "/api/0/relays/projectconfigs/": self.get_project_config,
+            "/api/0/relays/publickeys/": self.public_keys,
+        }
+
+    def handle(
+        self, request: RequestHead, body: bytes, fault: Optional[Fault] = None
+    ) -> Response:
+        """
+        Returns the response of a request, the error of the `fault` (if any) replaces
+        the response
+        """
+        self.stats.add(requests=1, request_bytes=len(body))
+        try:
+            if fault is not None and fault.status is not None:
+                if fault.status == 429:
+                    self.stats.add(rate_limited=1)
+                else:
+                    self.stats.add(injected_errors=1)
+                return fault.status, _JSON, fault.body()
+            return self._route(request, body)
+        except Exception as e:
+            _log.error("Fake sentry error generated error:\n{}".format(e))
+            self.stats.add(errors=1)
+            return _error_response("Bad Request")
+        finally:
+            self.stats.maybe_log(self.stats_log_interval)
+
+    def _route(self, request: RequestHead, body: bytes) -> Response:
+        path = request.path
+        if path.startswith("/api/"):
+            # /api/<project_id>/<endpoint>/
+            parts = path.split("/")
+            if len(parts) == 5 and parts[4] == "":
+                endpoint = parts[3]
+                if endpoint == "envelope":
+                    if request.method != "POST":
+                        return _error_response("Method Not Allowed", 405)
+                    return self.store_envelope(request, body)
+                if endpoint == "store":
+                    self.stats.add(events=1)
+                    return _event_id_response()
+
+            route = self._relay_routes.get(path)
+            if route is not None:
+                if request.method != "POST":
+                    return _error_response("Method Not Allowed", 405)
+                return route(request, body)
+
+        if path == "/":
+            return 200, _HTML, _ROOT_PAGE
+        if path == "/stats":
+            return _json_response(self.stats.report())
+        if path == "/faults":
+            return self.admin_faults(request, body)
+        return 200, _HTML, _CATCH_ALL_PAGE.format(path[1:]).encode()
+
+    def store_envelope(self, request: RequestHead, body: bytes) -> Response:
+        headers = request.headers
+        if headers.get("content-encoding", "") != "gzip":
+            raise ValueError("Relay should always compress store requests")
+        if headers.get("content-type") != "application/x-sentry-envelope":
+            raise ValueError("Relay sent us non-envelope data to store")
+        self.inspector.inspect(body)
+        return _event_id_response()
+
+    def get_challenge(self, request: RequestHead, body: bytes) -> Response:
+        data = json.loads(body)
+        relay_id = data["relay_id"]
+        self.authenticated_relays[relay_id] = data["public_key"]
+        if relay_id != request.headers.get("x-sentry-relay-id"):
+            raise ValueError("Relay id mismatch")
+        return _json_response({"token": "123", "relay_id": relay_id})
+
+    def check_challenge(self, request: RequestHead, body: bytes) -> Response:
+        relay_id = json.loads(body)["relay_id"]
+        if relay_id != request.headers.get("x-sentry-relay-id"):
+            raise ValueError("Relay id mismatch")
+        return _json_response({"relay_id": relay_id})
+
+    def get_project_config(self, request: RequestHead, body: bytes) -> Response:
+        if _query_param(request.query, "version") not in {"2", "3"}:
+            raise ValueError("Unsupported project config version")
+        project_keys = json.loads(body)["publicKeys"]
+        self.stats.add(project_configs=len(project_keys))
+        return 200, _JSON, self.project_configs.response(project_keys)
+
+    def admin_faults(self, request: RequestHead, body: bytes) -> Response:
+        try:
+            if request.method == "DELETE":
+                settings = self.faults.clear()
+            elif request.method in ("POST", "PUT"):
+                settings = self.faults.update(json.loads(body))
+            else:
+                settings = self.faults.settings()
+        except ValueError as e:
+            return _error_response(str(e))
+        return _json_response(settings)
+
+    def public_keys(self, request: RequestHead, body: bytes) -> Response:
+        relay_ids = json.loads(body)["relay_ids"]
+        return _json_response(
+            {"public_keys": {id: self.authenticated_relays[id] for id in relay_ids}}
+        )
+
+
+def _query_param(query: str, name: str) -> Optional[str]:
+    for param in query.split("&"):
+        key, _, value = param.partition("=")
+        if key == name:
+            return value
+    return None
+
+
+def parse_head(head: bytes) -> RequestHead:
+    """
+    Parses the request line and the headers of a request (without the final empty line)
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise _BadRequest("Invalid request line")
+
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise _BadRequest("Invalid header line")
+        headers[name.lower()] = value.strip()
+
+    chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+    try:
+        content_length = 0 if chunked else int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest("Invalid content length")
+
+    path, _, query = target.partition("?")
+    return RequestHead(
+        method=method,
+        path=path,
+        query=query,
+        headers=headers,
+        content_length=content_length,
+        chunked=chunked,
+        # HTTP/1.0 connections are always closed (no keep-alive negotiation)
+        keep_alive=version == "HTTP/1.1"
+        and headers.get("connection", "").lower() != "close",
+    )
+
+
+def parse_chunked(buffer: bytearray) -> Optional[Tuple[bytes, int]]:
+    """
+    Parses a chunked body at the start of the buffer, returns the body and the number of
+    bytes it takes in the buffer (None if the body is not complete yet)
+    """
+    chunks = []
+    pos = 0
+    while True:
+        line_end = buffer.find(b"\r\n", pos)
+        if line_end < 0:
+            return None
+        try:
+            size = int(bytes(buffer[pos:line_end]).split(b";", 1)[0], 16)
+        except ValueError:
+            raise _BadRequest("Invalid chunk size")
+        pos = line_end + 2
+
+        if size == 0:
+            # skip the (optional) trailers, they end with an empty line
+            while True:
+                line_end = buffer.find(b"\r\n", pos)
+                if line_end < 0:
+                    return None
+                if line_end == pos:
+                    return b"".join(chunks), pos + 2
+                pos = line_end + 2
+
+        if len(buffer) < pos + size + 2:
+            return None
+        chunks.append(bytes(buffer[pos : pos + size]))
+        pos += size + 2
+
+
+class HttpProtocol(asyncio.Protocol):
+    """
+    A minimal HTTP/1.1 server connection, requests are handled (in order) by `app`
+    """
+
+    def __init__(self, app: FakeSentryApp):
+        self.app = app
+        self.transport = None
+        self.buffer = bytearray()
+        # the head of the request waiting for its body
+        self.request: Optional[RequestHead] = None
+        # the task sending the last delayed response (the next responses wait for it)
+        self.sending: Optional[asyncio.Task] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.sending is not None:
+            # (cancels the tasks of all the delayed responses, they wait for each other)
+            self.sending.cancel()
+
+    def data_received(self, data):
+        self.buffer += data
+        try:
+            while self.transport is not None and self._handle_request():
+                pass
+        except _BadRequest as e:
+            self.app.stats.add(errors=1)
+            self.transport.write(
+                encode_response(400, _HTML, str(e).encode(), keep_alive=False)
+            )
+            self.transport.close()
+
+    def _handle_request(self) -> bool:
+        """
+        Handles the next request in the buffer, returns False if the request
+        is not complete (or the connection was closed)
+        """
+        buffer = self.buffer
+        if self.request is None:
+            end = buffer.find(b"\r\n\r\n")
+            if end < 0:
+                if len(buffer) > _MAX_HEAD_SIZE:
+                    raise _BadRequest("Request head too large")
+                return False
+            self.request = parse_head(bytes(buffer[:end]))
+            del buffer[: end + 4]
+            if self.request.headers.get("expect", "").lower() == "100-continue":
+                self.transport.write(_CONTINUE)
+
+        request = self.request
+        if request.chunked:
+            parsed = parse_chunked(buffer)
+            if parsed is None:
+                return False
+            body, size = parsed
+        else:
+            size = request.content_length
+            if len(buffer) < size:
+                return False
+            body = bytes(buffer[:size])
+        del buffer[:size]
+        self.request = None
+
+        fault = self.app.faults.plan(request.path)
+        status, content_type, response_body = self.app.handle(request, body, fault)
+        if fault is None and self.sending is None:
+            self.transport.write(
+                encode_response(status, content_type, response_body, request.keep_alive)
+            )
+            if not request.keep_alive:
+                self.transport.close()
+                return False
+            return True
+
+        response = encode_response(
+            status,
+            content_type,
+            response_body,
+            request.keep_alive,
+            _encode_headers(fault.headers) if fault is not None else b"",
+        )
+        body_start = len(response) - len(response_body)
+        self.sending = asyncio.ensure_future(
+            self._send_later(
+                self.sending, response, body_start, fault, request.keep_alive
+            )
+        )
+        if not request.keep_alive:
+            self.transport.pause_reading()
+            return False
+        return True
+
+    async def _send_later(
+        self,
+        previous: Optional[asyncio.Task],
+        response: bytes,
+        body_start: int,
+        fault: Optional[Fault],
+        keep_alive: bool,
+    ):
+        """
+        Sends a response after the previous (delayed) responses, after its delay and
+        dripping its body when its fault says so
+        """
+        if previous is not None:
+            await previous
+        if fault is not None and fault.delay > 0:
+            await asyncio.sleep(fault.delay)
+        if self.transport is None:
+            return
+
+        if fault is not None and fault.drip_rate is not None:
+            self.transport.write(response[:body_start])
+            chunks = drip_chunks(response[body_start:], fault.drip_rate)
+            for idx, chunk in enumerate(chunks):
+                if idx > 0:
+                    await asyncio.sleep(DRIP_INTERVAL)
+                    if self.transport is None:
+                        return
+                self.transport.write(chunk)
+        else:
+            self.transport.write(response)
+
+        if not keep_alive:
+            self.transport.close()
+        if self.sending is asyncio.current_task():
+            self.sending = None
+
+
+def run_asyncio_server(
+    host: str,
+    port: int,
+    processes: int = 1,
+    backlog: int = 1024,
+    inspector: Optional[EnvelopeInspector] = None,
+    project_configs: Optional[ProjectConfigs] = None,
+    stats: Optional[SharedStats] = None,
+    stats_log_interval: Optional[float] = None,
+    faults: Optional[FaultInjector] = None,
+):
+    """
+    Runs the server (this is a blocking call), the listening socket is shared by
+    `processes` processes, each with its own event loop, the processes count in the
+    same (shared) `stats`
+    """
+    stats = stats or SharedStats()
+    inspector = inspector or EnvelopeInspector(level="none", stats=stats)
+    project_configs = project_configs or ProjectConfigs()
+    app = FakeSentryApp(inspector, project_configs, stats, stats_log_interval, faults)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+
+    # the processes inherit the listening socket
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_serve, args=(sock, backlog, app), daemon=True)
+        for _ in range(max(1, processes) - 1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    _log.info(
+        "Fake sentry (asyncio%s) listening on %s:%d with %d process(es)",
+        ", uvloop" if uvloop is not None else "",
+        host,
+        port,
+        len(workers) + 1,
+    )
+    try:
+        _serve(sock, backlog, app)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        _log.info(f"Received: {stats.totals()}")
+
+
+def _serve(sock: socket.socket, backlog: int, app: FakeSentryApp):
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        loop.create_server(lambda: HttpProtocol(app), sock=sock, backlog=backlog)
+    )
+    # stop cleanly (and stop the other processes) when terminated
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.close()
@@ -1,6 +1,4 @@
-import datetime
-import gzip
-import json
+import atexit
 import logging
 import os
 import resource
@@ -9,12 +7,11 @@ import time
 import uuid
 from logging.config import dictConfig
 from pprint import pformat
-from queue import Queue
 
 import mywsgi
 from flask import Flask, abort, jsonify
 from flask import request as flask_request
-from sentry_sdk.envelope import Envelope
+from werkzeug.exceptions import InternalServerError
 from yaml import load
 
 try:
@@ -22,7 +19,11 @@ try:
 except ImportError:
     from yaml import FullLoader
 
-from infrastructure.util import full_path_from_module_relative_path
+from fake_sentry.asyncio_server import run_asyncio_server
+from fake_sentry.faults import FaultInjector
+from fake_sentry.inspection import EnvelopeInspector
+from fake_sentry.projects import ProjectConfigs
+from fake_sentry.stats import SharedStats
 
 _log = logging.getLogger(__name__)
 
@@ -30,15 +31,13 @@ _log = logging.getLogger(__name__)
 class Sentry(object):
     _healthcheck_passed = False
 
-    def __init__(self, server_address, dns_public_key, app):
+    def __init__(self, server_address, dns_public_key, app, project_configs=None):
         self.server_address = server_address
         self.app = app
-        self.project_configs = {}
-        self.captured_events = Queue()
+        self.project_configs = project_configs or ProjectConfigs()
         self.test_failures = []
         self.upstream = None
         self.dsn_public_key = dns_public_key
-        self._metrics = {}
 
     @property
     def url(self):
@@ -68,7 +67,7 @@ class Sentry(object):
 
     @property
     def dsn(self):
-        """DSN for which you will find the events in self.captured_events"""
+        """DSN of the fake Sentry (the received events are only counted)"""
         # bogus, we never check the DSN
         return "http://{}@{}:{}/42".format(self.dsn_public_key, *self.server_address)
 
@@ -86,25 +85,7 @@ class Sentry(object):
                 yield from self.upstream.iter_public_keys()
 
     def full_project_config(self, project_key):
-        project_id = _project_id_form_project_key(project_key)
-
-        base_project_config = load_proj_config(project_key)
-
-        ret_val = {
-            **base_project_config,
-            "publicKeys": [
-                {
-                    **base_project_config["publicKeys"][0],
-                    "publicKey": project_key,
-                    "numericId": project_id,
-                }
-            ],
-            "projectId": project_id,
-            "lastFetch": datetime.datetime.utcnow().isoformat() + "Z",
-            "lastChange": datetime.datetime.utcnow().isoformat() + "Z",
-        }
-
-        return ret_val
+        return self.project_configs.render(project_key)
 
     @property
     def internal_error_dsn(self):
@@ -131,8 +112,25 @@ def run_blocking_fake_sentry(config):
     """
     host = config.get("host")
     port = config.get("port")
-
-    if config.get("use_uwsgi", True):
+    # the counters of the previous runs
+    stats = SharedStats.from_config(config, reset=True)
+    # the faults set through the admin endpoint in the previous runs
+    faults = FaultInjector.from_config(config, reset=True)
+
+    if config.get("server", "flask") == "asyncio":
+        run_asyncio_server(
+            host or "127.0.0.1",
+            port or 8000,
+            processes=config.get("asyncio_processes", 1),
+            inspector=EnvelopeInspector.from_config(config, stats),
+            project_configs=ProjectConfigs(
+                reload_interval=config.get("project_configs_reload_interval")
+            ),
+            stats=stats,
+            stats_log_interval=config.get("stats_log_interval"),
+            faults=faults,
+        )
+    elif config.get("use_uwsgi", True):
         # Exec uwsgi with some default parameters.
         # Parameters can be tweaked by setting certain environment variables.
         # For example, to change the number of uwsgi workers, set UWSGI_PROCESSES=<N> (1 by default)
@@ -146,11 +144,6 @@ def run_blocking_fake_sentry(config):
         app.run(host=host, port=port)
 
 
-_metrics_stats = {
-    "buckets_collected": 0,
-}
-
-
 def configure_app(config):
     # Raise the max number of open files
     current_limits = resource.getrlimit(resource.RLIMIT_NOFILE)
@@ -164,7 +157,17 @@ def configure_app(config):
     host = config.get("host")
     port = config.get("port")
     dns_public_key = config.get("key")
-    sentry = Sentry((host, port), dns_public_key, app)
+    project_configs = ProjectConfigs(
+        reload_interval=config.get("project_configs_reload_interval")
+    )
+    sentry = Sentry((host, port), dns_public_key, app, project_configs)
+    # with uwsgi every worker process loads the app (`lazy_apps`), they share the
+    # counters through the stats file
+    stats = SharedStats.from_config(config)
+    stats_log_interval = config.get("stats_log_interval")
+    inspector = EnvelopeInspector.from_config(config, stats)
+    atexit.register(_log_stats, stats)
+    faults = FaultInjector.from_config(config)
 
     authenticated_relays = {}
 
@@ -172,7 +175,31 @@ def configure_app(config):
     def consume_body():
         # Consume POST body even if we don't like this request
         # to no clobber the socket and buffers
-        _ = flask_request.data
+        data = flask_request.get_data()
+        stats.add(requests=1, request_bytes=len(data))
+
+    @app.before_request
+    def inject_fault():
+        # (the latency and drip_rate faults are rejected unless `server: asyncio`, in
+        # which case this app is not served)
+        fault = faults.plan(flask_request.path)
+        if fault is None or fault.status is None:
+            return None
+        if fault.status == 429:
+            stats.add(rate_limited=1)
+        else:
+            stats.add(injected_errors=1)
+        return app.response_class(
+            fault.body(),
+            status=fault.status,
+            headers=list(fault.headers),
+            mimetype="application/json",
+        )
+
+    @app.after_request
+    def log_throughput(response):
+        stats.maybe_log(stats_log_interval)
+        return response
 
     @app.route("/api/0/relays/register/challenge/", methods=["POST"])
     def get_challenge():
@@ -192,16 +219,13 @@ def configure_app(config):
     @app.route("/api/0/relays/projectconfigs/", methods=["POST"])
     def get_project_config():
         assert flask_request.args.get("version") in {"2", "3"}
-        rv = {}
         _log.debug(f"f project configs request:\n{pformat(flask_request.json)}")
-        for public_key in flask_request.json["publicKeys"]:
-            app.logger.debug("getting project config for: {}".format(public_key))
-            rv[public_key] = sentry.full_project_config(public_key)
-            rv[public_key]["publicKeys"][0][
-                "publicKey"
-            ] = public_key  # RaduW NOT sure why this was here
-        _log.debug(f"f project configs returning:\n{pformat(rv,indent=4)}")
-        return jsonify(configs=rv)
+        project_keys = flask_request.json["publicKeys"]
+        stats.add(project_configs=len(project_keys))
+        return app.response_class(
+            sentry.project_configs.response(project_keys),
+            mimetype="application/json",
+        )
 
     @app.route("/api/0/relays/publickeys/", methods=["POST"])
     def public_keys():
@@ -214,6 +238,7 @@ def configure_app(config):
     @app.route("/api/<project_id>/store/", methods=["POST", "GET"])
     def store_all(project_id):
         _log.debug(f"In store: '{flask_request.full_path}'")
+        stats.add(events=1)
         return jsonify({"event_id": str(uuid.uuid4().hex)})
 
     @app.route("/api/<project_id>/envelope/", methods=["POST"])
@@ -222,13 +247,11 @@ def configure_app(config):
         assert (
             flask_request.headers.get("Content-Encoding", "") == "gzip"
         ), "Relay should always compress store requests"
-        data = gzip.decompress(flask_request.data)
         assert (
             flask_request.headers.get("Content-Type") == "application/x-sentry-envelope"
         ), "Relay sent us non-envelope data to store"
 
-        envelope = Envelope.deserialize(data)
-        _parse_metrics(envelope)
+        inspector.inspect(flask_request.data)
         return jsonify({"event_id": str(uuid.uuid4().hex)})
 
     @app.route("/<path:u_path>", methods=["POST", "GET"])
@@ -242,6 +265,23 @@ def configure_app(config):
             + "<h3><b>Note:</b> This is probably the wrong url to call !!!<h3/>"
         )
 
+    @app.route("/stats", methods=["GET"])
+    def get_stats():
+        return jsonify(stats.report())
+
+    @app.route("/faults", methods=["GET", "POST", "PUT", "DELETE"])
+    def admin_faults():
+        try:
+            if flask_request.method == "DELETE":
+                settings = faults.clear()
+            elif flask_request.method in ("POST", "PUT"):
+                settings = faults.update(flask_request.get_json(force=True))
+            else:
+                settings = faults.settings()
+        except ValueError as e:
+            return str(e), 400
+        return jsonify(settings)
+
     @app.route("/", methods=["GET"])
     def root():
         return "<h1>Fake Sentry</h1><div>This is the root url</div>"
@@ -249,76 +289,18 @@ def configure_app(config):
     @app.errorhandler(Exception)
     def fail(e):
         app.logger.error("Fake sentry error generated error:\n{}".format(e))
+        # (the abort below calls this handler again with an internal server error)
+        if not isinstance(e, InternalServerError):
+            stats.add(errors=1)
         abort(400)
 
     return app
 
 
-def _parse_metrics(envelope):
-    for item in envelope:
-        if item.type == "metric_buckets":
-            content = item.payload.json
-            print(content)
-            _metrics_stats["buckets_collected"] += len(content)
-
-
-def _summarize_metrics():
-    print(_metrics_stats)
-
-
-def _project_id_form_project_key(project_key: str) -> int:
-    """
-    Recover the project id from a fake project key.
-
-    The project id is at the end of the string and
-    is preceded by at least one non numeric char.
-
-    >>> _project_id_form_project_key("abc1234")
-    1234
-    >>> _project_id_form_project_key("234")
-    234
-    >>> _project_id_form_project_key("")
-    0
-    >>> _project_id_form_project_key("")
-    0
-    >>> _project_id_form_project_key("abc")
-    0
-    >>> _project_id_form_project_key("123abc332def444")
-    444
-    """
-    for idx, ch in enumerate(project_key[::-1]):
-        if ch not in {"0", "1", "2", "3", "4", "5", "6", "7", "8", "9"}:
-            if idx == 0:
-                return 0
-            return int(project_key[-idx:])
-
-    if len(project_key) > 0:
-        return int(project_key)
-    else:
-        return 0
-
-
-def load_proj_config(project_key):
-    dir_path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)),
-        "..",
-        "config",
-        "../config/projects",
-    )
-
-    file_name = os.path.join(dir_path, f"{project_key}.json")
-
-    if os.path.exists(file_name):
-        try:
-            with open(file_name, "rt") as f:
-                return json.load(f)
-        except Exception:
-            pass
-
-    default_config_name = os.path.join(dir_path, "default.json")
-
-    with open(default_config_name, "rt") as f:
-        return json.load(f)
+def _log_stats(stats: SharedStats):
+    totals = stats.totals()
+    if totals["requests"] > 0:
+        _log.info(f"Received (all the processes): {totals}")
 
 
 def _get_config():
@@ -326,8 +308,13 @@ def _get_config():
     Returns the program settings located in the main directory (just above this file's directory)
     with the name config.yml
     """
-    file_name = full_path_from_module_relative_path(
-        __file__, "..", "config", "fake_sentry.config.yml"
+    # NOTE: not using infrastructure.util, importing the infrastructure package
+    # imports locust (which monkey patches the standard library with gevent)
+    file_name = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        "..",
+        "config",
+        "fake_sentry.config.yml",
     )
 
     try:
@@ -0,0 +1,349 @@
+"""
+Faults injected by the fake Sentry, to test Relay with a slow or failing upstream.
+
+The faults are configured per route (see `ROUTES`) under `faults` in
+`fake_sentry.config.yml`, a route can have:
+
+* latency: the response delay in ms, either fixed (a number) or log-normal
+  (`{p50: 20, p99: 500}`)
+* error_rate: the fraction of the requests answered with `error_status` (503 by default)
+* rate_limit_rate: the fraction of the requests answered with a 429, with the
+  `Retry-After` and `X-Sentry-Rate-Limits` headers (`retry_after` seconds,
+  `rate_limit_categories` e.g. "error;transaction", all the categories by default)
+* drip_rate: the rate (bytes/sec) at which the responses are sent
+
+`latency` and `drip_rate` need the asyncio server (`server: asyncio`), it delays the
+responses without blocking, the Flask app would block its (uwsgi) workers.
+
+The faults can be changed at runtime through the `/faults` admin endpoint (GET returns
+them, POST a JSON object with the routes to change, `null` removes the faults of a
+route, DELETE removes all the faults). They are kept in a file (`faults_file`) read by
+all the server processes (checked at most once per second, when a request is handled).
+"""
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+_log = logging.getLogger(__name__)
+
+ROUTES = ("envelope", "store", "projectconfigs", "relays")
+
+_OPTIONS = {
+    "latency",
+    "error_rate",
+    "error_status",
+    "rate_limit_rate",
+    "retry_after",
+    "rate_limit_categories",
+    "drip_rate",
+}
+
+# the interval between two chunks of a slow-drip response (in seconds)
+DRIP_INTERVAL = 0.1
+
+# the z-score of the 99th percentile of a normal distribution
+_Z_P99 = 2.326
+
+
+class Fault(NamedTuple):
+    delay: float  # seconds
+    status: Optional[int]  # the (error) status replacing the response
+    headers: Tuple[Tuple[str, str], ...]
+    drip_rate: Optional[float]  # bytes/sec
+
+    def body(self) -> bytes:
+        if self.status == 429:
+            return b'{"detail":"Rate limited by the fake Sentry"}'
+        return b'{"detail":"Error injected by the fake Sentry"}'
+
+
+class RouteFaults:
+    """
+    The faults of a route
+    """
+
+    def __init__(self, settings: Mapping[str, Any]):
+        if not isinstance(settings, Mapping):
+            raise ValueError(f"Invalid route faults {settings!r}, expected an object")
+        unknown = set(settings) - _OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown fault options: {', '.join(sorted(unknown))}")
+
+        self.latency = _latency_sampler(settings.get("latency"))
+        self.error_rate = _rate(settings, "error_rate")
+        self.error_status = int(settings.get("error_status") or 503)
+        if not 500 <= self.error_status <= 599:
+            raise ValueError(f"Invalid error_status {self.error_status}, expected 5xx")
+        self.rate_limit_rate = _rate(settings, "rate_limit_rate")
+        retry_after = int(settings.get("retry_after") or 60)
+        categories = settings.get("rate_limit_categories") or ""
+        self.rate_limit_headers = (
+            ("Retry-After", str(retry_after)),
+            ("X-Sentry-Rate-Limits", f"{retry_after}:{categories}:organization"),
+        )
+        drip_rate = settings.get("drip_rate")
+        self.drip_rate = float(drip_rate) if drip_rate else None
+
+    def plan(self, rng: random.Random) -> Optional[Fault]:
+        status = None
+        headers = ()
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            status = 429
+            headers = self.rate_limit_headers
+        elif draw < self.rate_limit_rate + self.error_rate:
+            status = self.error_status
+
+        delay = self.latency(rng) if self.latency is not None else 0.0
+        if status is None and delay <= 0 and self.drip_rate is None:
+            return None
+        return Fault(delay, status, headers, self.drip_rate)
+
+
+class FaultInjector:
+    """
+    Decides the faults of the requests, from the (shared) fault settings
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Mapping[str, Any]] = None,
+        path: Optional[str] = None,
+        check_interval: float = 1.0,
+        delays: bool = True,
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        # whether the latency and drip_rate faults are supported (by the server)
+        self.delays = delays
+        # seeded by every (forked) process, see `_process_rng`
+        self._rng = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._set(self._normalized(settings or {}))
+
+    @classmethod
+    def from_config(
+        cls, config: Mapping[str, Any], reset: bool = False
+    ) -> "FaultInjector":
+        """
+        Creates the injector of a server process, with `reset` the faults file is
+        (re)initialized with the configured faults, otherwise the faults changed
+        through the admin endpoint (if any) are used
+        """
+        path = config.get("faults_file") or default_faults_file(
+            config.get("port") or 8000
+        )
+        injector = cls(
+            config.get("faults"),
+            path,
+            delays=config.get("server", "flask") == "asyncio",
+        )
+        if reset:
+            injector._write()
+        else:
+            injector._maybe_reload()
+        return injector
+
+    def plan(self, path: str) -> Optional[Fault]:
+        """
+        Returns the fault of a request (None for a normal response)
+        """
+        self._maybe_reload()
+        if not self._routes:
+            return None
+        route = route_of(path)
+        if route is None:
+            return None
+        faults = self._routes.get(route)
+        if faults is None:
+            return None
+        return faults.plan(self._process_rng())
+
+    def settings(self) -> Dict[str, Any]:
+        return self._settings
+
+    def update(self, settings: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Changes the faults of the routes in `settings` (a route set to None has no
+        faults), raises ValueError for invalid settings
+        """
+        if not isinstance(settings, Mapping):
+            raise ValueError("Expected an object with the faults of the routes")
+        with self._lock:
+            merged = dict(self._settings)
+            for route, route_settings in settings.items():
+                if route_settings is None:
+                    merged.pop(route, None)
+                else:
+                    merged[route] = route_settings
+            self._set(self._normalized(merged))
+            self._write()
+        return self._settings
+
+    def clear(self) -> Dict[str, Any]:
+        with self._lock:
+            self._set({})
+            self._write()
+        return self._settings
+
+    def _process_rng(self) -> random.Random:
+        # the forked processes would otherwise make the same decisions
+        pid = os.getpid()
+        if self._pid != pid:
+            self._rng = random.Random()
+            self._pid = pid
+        return self._rng
+
+    def _normalized(self, settings: Mapping[str, Any]) -> Dict[str, Any]:
+        settings = _normalized(settings)
+        if not self.delays:
+            delays = [
+                f"{route}.{name}"
+                for route, route_settings in settings.items()
+                for name in ("latency", "drip_rate")
+                if route_settings.get(name)
+            ]
+            if delays:
+                raise ValueError(
+                    f"The {', '.join(delays)} faults need the asyncio server, set "
+                    "`server: asyncio` in fake_sentry.config.yml (the Flask app would "
+                    "block its workers)"
+                )
+        return settings
+
+    def _set(self, settings: Dict[str, Any]):
+        routes = {route: RouteFaults(value) for route, value in settings.items()}
+        # replaced (not modified) so that concurrent requests see a consistent state
+        self._settings = settings
+        self._routes = routes
+
+    def _write(self):
+        if self.path is None:
+            return
+        # replaced atomically, the other processes never read a partial file
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".faults")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._settings, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _maybe_reload(self):
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    with open(self.path, "rt") as f:
+                        self._set(self._normalized(json.load(f)))
+                except ValueError as err:
+                    # e.g. the faults left by a previous (asyncio) run, the invalid
+                    # settings are only rejected by the admin endpoint
+                    _log.warning(f"Ignoring the faults in {self.path}: {err}")
+                    self._set({})
+        finally:
+            self._lock.release()
+
+
+def default_faults_file(port: int) -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"fake_sentry_faults_{port}.json")
+
+
+def route_of(path: str) -> Optional[str]:
+    """
+    Returns the route (see `ROUTES`) of a request path, None for the routes
+    without faults (e.g. the stats and faults endpoints)
+
+    >>> route_of("/api/42/envelope/")
+    'envelope'
+    >>> route_of("/api/42/store/")
+    'store'
+    >>> route_of("/api/0/relays/projectconfigs/")
+    'projectconfigs'
+    >>> route_of("/api/0/relays/register/challenge/")
+    'relays'
+    >>> route_of("/stats") is None
+    True
+    """
+    if not path.startswith("/api/"):
+        return None
+    if path.startswith("/api/0/relays/"):
+        if path == "/api/0/relays/projectconfigs/":
+            return "projectconfigs"
+        return "relays"
+    parts = path.split("/")
+    if len(parts) == 5 and parts[3] in ("envelope", "store"):
+        return parts[3]
+    return None
+
+
+def drip_chunks(data: bytes, rate: float) -> List[bytes]:
+    """
+    Splits a response in the chunks sent every `DRIP_INTERVAL` seconds
+
+    >>> drip_chunks(b"abcdefgh", 30)
+    [b'abc', b'def', b'gh']
+    """
+    size = max(1, int(rate * DRIP_INTERVAL))
+    return [data[pos : pos + size] for pos in range(0, len(data), size)]
+
+
+def _normalized(settings: Mapping[str, Any]) -> Dict[str, Any]:
+    if not isinstance(settings, Mapping):
+        raise ValueError(f"Invalid faults {settings!r}, expected an object")
+    unknown = set(settings) - set(ROUTES)
+    if unknown:
+        raise ValueError(
+            f"Unknown routes {', '.join(sorted(unknown))}, "
+            f"expected some of {', '.join(ROUTES)}"
+        )
+    # (validates the settings)
+    for route_settings in settings.values():
+        RouteFaults(route_settings)
+    return {route: dict(value) for route, value in settings.items() if value}
+
+
+def _rate(settings: Mapping[str, Any], name: str) -> float:
+    rate = float(settings.get(name) or 0.0)
+    if not 0.0 <= rate <= 1.0:
+        raise ValueError(f"Invalid {name} {rate}, expected a fraction (0 to 1)")
+    return rate
+
+
+def _latency_sampler(latency):
+    """
+    Returns a function returning the delays (in seconds) of a latency setting (in ms)
+    """
+    if not latency:
+        return None
+    if isinstance(latency, (int, float)):
+        delay = latency / 1000
+        return lambda rng: delay
+    if not isinstance(latency, Mapping) or set(latency) != {"p50", "p99"}:
+        raise ValueError(f"Invalid latency {latency!r}, expected ms or {{p50, p99}}")
+    p50 = float(latency["p50"])
+    p99 = float(latency["p99"])
+    if not 0 < p50 <= p99:
+        raise ValueError(f"Invalid latency {latency!r}, expected 0 < p50 <= p99")
+    mu = math.log(p50 / 1000)
+    sigma = (math.log(p99) - math.log(p50)) / _Z_P99
+    return lambda rng: rng.lognormvariate(mu, sigma)
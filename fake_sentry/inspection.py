@@ -0,0 +1,213 @@
+"""
+Inspection of the envelopes received by the fake Sentry.
+
+Decompressing and parsing every envelope costs the fake Sentry more CPU than anything
+else it does, the inspection level configures how much of an envelope is looked at:
+
+* none: the envelopes are only counted
+* headers: the envelopes are decompressed (as a stream) and the item headers are
+  scanned to count the items by type, the item payloads are skipped (not decoded)
+* sampled: 1 in `sample_rate` envelopes is fully inspected, the others are only counted
+* full: the envelopes are deserialized and the metric bucket payloads are decoded
+  (to count the buckets)
+
+The counters are kept in the (shared) stats of the fake Sentry (see `fake_sentry.stats`).
+"""
+import itertools
+import logging
+import re
+import zlib
+from typing import Any, Callable, Mapping, Optional
+
+from sentry_sdk.envelope import Envelope
+
+from fake_sentry.stats import SharedStats
+
+_log = logging.getLogger(__name__)
+
+INSPECTION_LEVELS = ("none", "headers", "sampled", "full")
+
+# the size of the decompressed chunks fed to the scanner
+_CHUNK_SIZE = 64 * 1024
+
+_TYPE_RE = re.compile(rb'"type"\s*:\s*"([^"]*)"')
+_LENGTH_RE = re.compile(rb'"length"\s*:\s*(\d+)')
+
+# scanner states
+_ENVELOPE_HEADER = 0
+_ITEM_HEADER = 1
+_PAYLOAD_LINE = 2  # an item without length, the payload ends at the end of the line
+
+
+class ItemHeaderScanner:
+    """
+    Scans a serialized envelope, fed in chunks of any size, and calls `on_item(type, size)`
+    for every item.
+
+    Only the item header lines are looked at (with regular expressions, they are not
+    JSON decoded), the payloads are skipped: by length when the item header has one,
+    otherwise up to the end of the line.
+    """
+
+    def __init__(self, on_item: Callable[[str, int], None]):
+        self._on_item = on_item
+        self._state = _ENVELOPE_HEADER
+        self._line = bytearray()  # the start of a header line split between chunks
+        self._skip = 0  # payload bytes left to skip
+        self._item_type = None
+        self._item_size = 0  # the size of a payload without length (so far)
+
+    def feed(self, data: bytes):
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self._skip > 0:
+                skipped = min(self._skip, end - pos)
+                self._skip -= skipped
+                pos += skipped
+                continue
+
+            line_end = data.find(b"\n", pos)
+            if self._state == _PAYLOAD_LINE:
+                if line_end < 0:
+                    self._item_size += end - pos
+                    return
+                self._item_size += line_end - pos
+                self._on_item(self._item_type, self._item_size)
+                self._state = _ITEM_HEADER
+                pos = line_end + 1
+                continue
+
+            if line_end < 0:
+                self._line += data[pos:]
+                return
+            if self._line:
+                self._line += data[pos:line_end]
+                line = bytes(self._line)
+                self._line.clear()
+            else:
+                line = data[pos:line_end]
+            pos = line_end + 1
+            self._header_line(line)
+
+    def close(self):
+        """
+        Ends the envelope (a last payload without length may end without a newline)
+        """
+        if self._state == _PAYLOAD_LINE:
+            self._on_item(self._item_type, self._item_size)
+        elif self._line and self._state == _ITEM_HEADER:
+            line = bytes(self._line)
+            self._line.clear()
+            self._header_line(line)
+            if self._state == _PAYLOAD_LINE:
+                self._on_item(self._item_type, 0)
+        self._state = _ENVELOPE_HEADER
+
+    def _header_line(self, line: bytes):
+        if self._state == _ENVELOPE_HEADER:
+            self._state = _ITEM_HEADER
+            return
+        if not line.strip():
+            return  # the newline after a payload with length (or a blank line)
+
+        match = _TYPE_RE.search(line)
+        item_type = match.group(1).decode("utf-8", "replace") if match else "unknown"
+        match = _LENGTH_RE.search(line)
+        if match is not None:
+            self._skip = int(match.group(1))
+            self._on_item(item_type, self._skip)
+        else:
+            self._state = _PAYLOAD_LINE
+            self._item_type = item_type
+            self._item_size = 0
+
+
+class EnvelopeInspector:
+    """
+    Inspects the received envelopes (see the module documentation for the levels)
+    and counts them in `stats`
+    """
+
+    def __init__(
+        self,
+        level: str = "headers",
+        sample_rate: int = 100,
+        stats: Optional[SharedStats] = None,
+    ):
+        if level not in INSPECTION_LEVELS:
+            raise ValueError(
+                f"Invalid envelope inspection level {level!r}, "
+                f"expected one of {', '.join(INSPECTION_LEVELS)}"
+            )
+        self.level = level
+        self.sample_rate = max(1, int(sample_rate))
+        self.stats = stats or SharedStats()
+        # (per process, only used to sample the envelopes)
+        self._envelopes = itertools.count(1)
+
+    @classmethod
+    def from_config(
+        cls, config: Mapping[str, Any], stats: Optional[SharedStats] = None
+    ) -> "EnvelopeInspector":
+        return cls(
+            level=config.get("envelope_inspection", "headers"),
+            sample_rate=config.get("envelope_sample_rate", 100),
+            stats=stats,
+        )
+
+    def inspect(self, body: bytes, gzipped: bool = True):
+        self.stats.add(envelopes=1)
+        count = next(self._envelopes)
+        level = self.level
+        if level == "sampled":
+            level = "full" if count % self.sample_rate == 0 else "none"
+        if level == "none":
+            return
+
+        try:
+            if level == "headers":
+                self._scan_headers(body, gzipped)
+            else:
+                self._deserialize(body, gzipped)
+        except Exception as e:
+            _log.debug(f"Failed to inspect envelope: {e}")
+            self.stats.add(inspection_failures=1)
+
+    def _scan_headers(self, body: bytes, gzipped: bool):
+        items = []
+        scanner = ItemHeaderScanner(
+            lambda item_type, size: items.append((item_type, size))
+        )
+        if gzipped:
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            chunk = decompressor.decompress(body, _CHUNK_SIZE)
+            while chunk:
+                scanner.feed(chunk)
+                chunk = decompressor.decompress(
+                    decompressor.unconsumed_tail, _CHUNK_SIZE
+                )
+        else:
+            scanner.feed(body)
+        scanner.close()
+        self._count(items)
+
+    def _deserialize(self, body: bytes, gzipped: bool):
+        if gzipped:
+            body = zlib.decompress(body, wbits=16 + zlib.MAX_WBITS)
+        envelope = Envelope.deserialize(body)
+        items = []
+        metric_buckets = 0
+        for item in envelope:
+            # (the JSON payloads of some item types are parsed, `get_bytes` re-serializes them)
+            size = item.headers.get("length")
+            if size is None:
+                size = len(item.payload.get_bytes())
+            items.append((item.type or "unknown", size))
+            if item.type == "metric_buckets":
+                metric_buckets += len(item.payload.json)
+        self._count(items, metric_buckets)
+
+    def _count(self, items, metric_buckets: int = 0):
+        self.stats.add_items(items)
+        self.stats.add(inspected=1, metric_buckets=metric_buckets)
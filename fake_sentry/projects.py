@@ -0,0 +1,195 @@
+"""
+Canned project configurations served by the fake Sentry servers.
+
+The project config templates (`config/projects/<project key>.json`, `default.json` for
+all the other keys) are loaded once, when the first config is requested. The config of every requested key is rendered
+once, into a pre-encoded JSON fragment, and the projectconfigs responses are
+assembled by concatenating the fragments (only `lastFetch` is set per response).
+
+With a `reload_interval` the templates are reloaded when the files change (checked
+at most once per interval, when a config is requested).
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+_PROJECTS_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "config", "projects"
+)
+_DEFAULT_TEMPLATE = "default"
+
+# the rendered config of a key, split around the value of `lastFetch`
+Fragment = Tuple[bytes, bytes]
+
+
+class ProjectConfigs:
+    """
+    The project configs of the fake projects, rendered once per project key
+    """
+
+    def __init__(
+        self,
+        projects_dir: str = _PROJECTS_DIR,
+        reload_interval: Optional[float] = None,
+        max_cached_keys: int = 100000,
+    ):
+        self.projects_dir = projects_dir
+        self.reload_interval = reload_interval
+        self.max_cached_keys = max_cached_keys
+        self._reload_lock = threading.Lock()
+        self._next_reload_check = 0.0
+        # loaded by the first request (see `_ensure_loaded`)
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._reload_lock:
+            if not self._loaded:
+                self._load()
+
+    def _load(self):
+        # before reading the files, a file changed while loading is reloaded next time
+        mtimes = _template_mtimes(self.projects_dir)
+        templates = {}
+        for name, path in _template_files(self.projects_dir).items():
+            try:
+                with open(path, "rt") as f:
+                    templates[name] = json.load(f)
+            except Exception:
+                if name == _DEFAULT_TEMPLATE:
+                    raise
+        if _DEFAULT_TEMPLATE not in templates:
+            raise ValueError(f"Missing {_DEFAULT_TEMPLATE}.json in {self.projects_dir}")
+
+        # replaced (not modified) so that concurrent requests see a consistent state
+        self._templates: Dict[str, Any] = templates
+        self._mtimes = mtimes
+        self._loaded_at = _utc_timestamp()
+        self._fragments: Dict[str, Fragment] = {}
+        self._loaded = True
+
+    def render(self, project_key: str) -> Dict[str, Any]:
+        """
+        Returns the full project config for a (fake) project key, the project id is
+        recovered from the key (see `_project_id_form_project_key`)
+        """
+        self._ensure_loaded()
+        project_id = _project_id_form_project_key(project_key)
+
+        templates = self._templates
+        base_project_config = templates.get(project_key)
+        if base_project_config is None:
+            base_project_config = templates[_DEFAULT_TEMPLATE]
+
+        return {
+            **base_project_config,
+            "publicKeys": [
+                {
+                    **base_project_config["publicKeys"][0],
+                    "publicKey": project_key,
+                    "numericId": project_id,
+                }
+            ],
+            "projectId": project_id,
+            "lastFetch": _utc_timestamp(),
+            "lastChange": self._loaded_at,
+        }
+
+    def response(self, project_keys: Iterable[str]) -> bytes:
+        """
+        Returns the (JSON) body of a projectconfigs response for the keys
+        """
+        self._ensure_loaded()
+        self._maybe_reload()
+        fragments = self._fragments
+        if len(fragments) > self.max_cached_keys:
+            fragments.clear()
+
+        now = _utc_timestamp().encode()
+        parts = []
+        for project_key in project_keys:
+            fragment = fragments.get(project_key)
+            if fragment is None:
+                fragment = self._render_fragment(project_key)
+                fragments[project_key] = fragment
+            prefix, suffix = fragment
+            parts.append(prefix + now + suffix)
+        return b'{"configs":{' + b",".join(parts) + b"}}"
+
+    def _render_fragment(self, project_key: str) -> Fragment:
+        config = self.render(project_key)
+        del config["lastFetch"]
+        encoded = json.dumps(config, separators=(",", ":")).encode()
+        prefix = b'%s:%s,"lastFetch":"' % (
+            json.dumps(project_key).encode(),
+            encoded[:-1],
+        )
+        return prefix, b'"}'
+
+    def _maybe_reload(self):
+        if self.reload_interval is None:
+            return
+        now = time.monotonic()
+        if now < self._next_reload_check or not self._reload_lock.acquire(False):
+            return
+        try:
+            self._next_reload_check = now + self.reload_interval
+            if _template_mtimes(self.projects_dir) != self._mtimes:
+                self._load()
+        finally:
+            self._reload_lock.release()
+
+
+def _template_files(projects_dir: str) -> Dict[str, str]:
+    return {
+        entry.name[: -len(".json")]: entry.path
+        for entry in os.scandir(projects_dir)
+        if entry.name.endswith(".json") and entry.is_file()
+    }
+
+
+def _template_mtimes(projects_dir: str) -> Dict[str, float]:
+    return {
+        name: os.stat(path).st_mtime
+        for name, path in _template_files(projects_dir).items()
+    }
+
+
+def _utc_timestamp() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+def _project_id_form_project_key(project_key: str) -> int:
+    """
+    Recover the project id from a fake project key.
+
+    The project id is at the end of the string and
+    is preceded by at least one non numeric char.
+
+    >>> _project_id_form_project_key("abc1234")
+    1234
+    >>> _project_id_form_project_key("234")
+    234
+    >>> _project_id_form_project_key("")
+    0
+    >>> _project_id_form_project_key("")
+    0
+    >>> _project_id_form_project_key("abc")
+    0
+    >>> _project_id_form_project_key("123abc332def444")
+    444
+    """
+    for idx, ch in enumerate(project_key[::-1]):
+        if ch not in {"0", "1", "2", "3", "4", "5", "6", "7", "8", "9"}:
+            if idx == 0:
+                return 0
+            return int(project_key[-idx:])
+
+    if len(project_key) > 0:
+        return int(project_key)
+    else:
+        return 0
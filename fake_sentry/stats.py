@@ -0,0 +1,316 @@
+"""
+Counters of the fake Sentry, shared by all the server processes.
+
+uwsgi (with `UWSGI_PROCESSES` > 1) and the asyncio server (with `asyncio_processes` > 1)
+serve the requests from several processes. The counters are kept in a memory mapped
+file (`stats_file`) so that the totals of all the processes can be reported, on the
+`/stats` endpoint and in a periodic throughput log.
+
+Every process claims a slot (a row of 64 bit counters) and is the only process
+writing to it, the totals are the sums of the slots (they are read without locking,
+a total may miss the updates made while it is computed).
+
+The file layout (64 bit integers):
+
+* the start time and the time of the last throughput log (in ns)
+* the pids of the processes owning the slots (0 for a free slot)
+* the totals at the last throughput log
+* the slots
+"""
+import array
+import contextlib
+import fcntl
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+_log = logging.getLogger(__name__)
+
+COUNTERS = (
+    "requests",
+    "request_bytes",
+    "errors",
+    "events",  # store requests
+    "project_configs",  # project keys in the projectconfigs requests
+    "envelopes",
+    "inspected",
+    "inspection_failures",
+    "metric_buckets",
+    "rate_limited",  # injected 429 responses (see `fake_sentry.faults`)
+    "injected_errors",  # injected 5xx responses
+)
+
+# the envelope item types counted (the other types are counted as `other`)
+ITEM_TYPES = (
+    "event",
+    "transaction",
+    "attachment",
+    "session",
+    "sessions",
+    "client_report",
+    "user_report",
+    "metric_buckets",
+    "statsd",
+    "profile",
+    "replay_event",
+    "replay_recording",
+    "check_in",
+    "span",
+    "other",
+)
+
+_START = 0
+_LAST_LOG = 1
+_HEADER_SIZE = 2
+
+_NUM_COUNTERS = len(COUNTERS)
+_NUM_ITEM_TYPES = len(ITEM_TYPES)
+_ROW_SIZE = _NUM_COUNTERS + 2 * _NUM_ITEM_TYPES
+
+
+def default_stats_file(port: int) -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"fake_sentry_stats_{port}")
+
+
+class SharedStats:
+    """
+    Counters shared by the processes mapping the same file (or, without a file,
+    by the processes forked after the counters are created)
+    """
+
+    def __init__(self, path: Optional[str] = None, slots: int = 64, reset=False):
+        self.path = path
+        self.slots = slots
+        self._pids_at = _HEADER_SIZE
+        self._snapshot_at = self._pids_at + slots
+        self._slots_at = self._snapshot_at + _ROW_SIZE
+        size = 8 * (self._slots_at + slots * _ROW_SIZE)
+
+        if path is not None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        else:
+            # (kept open with the object, the file is deleted when it is closed)
+            self._file = tempfile.TemporaryFile()
+            fd = self._file.fileno()
+        self._fd = fd
+        with self._file_lock():
+            if reset or os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, bytes(size), 0)
+            self._mmap = mmap.mmap(fd, size)
+            self._values = memoryview(self._mmap).cast("q")
+            if self._values[_START] == 0:
+                self._values[_START] = time.time_ns()
+
+        self._index = {name: idx for idx, name in enumerate(COUNTERS)}
+        self._item_index = {
+            item_type: _NUM_COUNTERS + idx for idx, item_type in enumerate(ITEM_TYPES)
+        }
+        # the slot is claimed by the first update of every process (see `_slot_start`)
+        self._pid = None
+        self._slot_at = 0
+        # the processes serve requests from several threads
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._next_log_check = 0.0
+
+    @classmethod
+    def from_config(
+        cls, config: Mapping[str, Any], reset: bool = False
+    ) -> "SharedStats":
+        path = config.get("stats_file") or default_stats_file(
+            config.get("port") or 8000
+        )
+        return cls(path, reset=reset)
+
+    def add(self, **counts: int):
+        """
+        Adds to the counters (see `COUNTERS`) of this process
+        """
+        index = self._index
+        values = self._values
+        with self._lock:
+            slot_at = self._slot_start()
+            for name, value in counts.items():
+                values[slot_at + index[name]] += value
+
+    def add_items(self, items: Iterable[Tuple[str, int]]):
+        """
+        Counts the envelope items, `items` are (type, size) pairs
+        """
+        item_index = self._item_index
+        other = item_index["other"]
+        values = self._values
+        with self._lock:
+            slot_at = self._slot_start()
+            for item_type, size in items:
+                idx = slot_at + item_index.get(item_type, other)
+                values[idx] += 1
+                values[idx + _NUM_ITEM_TYPES] += size
+
+    def totals(self) -> Dict[str, Any]:
+        """
+        Returns the counters of all the processes
+        """
+        return _as_dict(self._sums())
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns the totals with the time (and uptime) at which they were taken,
+        the rates are the differences between two reports
+        """
+        now = time.time()
+        pids = self._values[self._pids_at : self._snapshot_at]
+        return {
+            "timestamp": now,
+            "uptime": now - self._values[_START] / 1e9,
+            # (the slots of the dead processes are kept, with their counts)
+            "processes": sum(1 for pid in pids if pid != 0 and _alive(pid)),
+            **self.totals(),
+        }
+
+    def maybe_log(self, interval: Optional[float]):
+        """
+        Logs the throughput of all the processes since the last log, if it was logged
+        more than `interval` seconds ago (by any process)
+        """
+        if not interval:
+            return
+        now = time.monotonic()
+        if now < self._next_log_check or not self._log_lock.acquire(False):
+            return
+        try:
+            self._next_log_check = now + interval
+            if not self._lock_file(blocking=False):
+                return  # another process is logging
+            try:
+                self._log_throughput(interval)
+            finally:
+                self._unlock_file()
+        finally:
+            self._log_lock.release()
+
+    def _log_throughput(self, interval: float):
+        values = self._values
+        now = time.time_ns()
+        elapsed = (now - (values[_LAST_LOG] or values[_START])) / 1e9
+        if elapsed < interval:
+            self._next_log_check = time.monotonic() + interval - elapsed
+            return
+
+        sums = self._sums()
+        snapshot = values[self._snapshot_at : self._slots_at]
+        previous = snapshot.tolist()
+        snapshot[:] = array.array("q", sums)
+        values[_LAST_LOG] = now
+        delta = _as_dict([total - last for total, last in zip(sums, previous)])
+        _log.info(_throughput_message(delta, elapsed))
+
+    def _sums(self) -> List[int]:
+        values = self._values
+        sums = [0] * _ROW_SIZE
+        for slot in range(self.slots):
+            if values[self._pids_at + slot] == 0:
+                continue
+            start = self._slots_at + slot * _ROW_SIZE
+            for idx, value in enumerate(values[start : start + _ROW_SIZE].tolist()):
+                sums[idx] += value
+        return sums
+
+    def _slot_start(self) -> int:
+        pid = os.getpid()
+        if self._pid != pid:
+            # first update of this process (or of a forked process)
+            self._slot_at = self._slots_at + self._claim_slot(pid) * _ROW_SIZE
+            self._pid = pid
+        return self._slot_at
+
+    def _claim_slot(self, pid: int) -> int:
+        values = self._values
+        pids_at = self._pids_at
+        with self._file_lock():
+            pids = values[pids_at : self._snapshot_at].tolist()
+            if 0 in pids:
+                slot = pids.index(0)
+            else:
+                # take over the slot of a dead process (its counts are kept)
+                dead = [slot for slot, owner in enumerate(pids) if not _alive(owner)]
+                if dead:
+                    slot = dead[0]
+                else:
+                    slot = pid % self.slots
+                    _log.warning(
+                        f"More than {self.slots} fake Sentry processes, "
+                        "some processes share their counters (updates may be lost)"
+                    )
+            values[pids_at + slot] = pid
+        return slot
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # POSIX record locks are owned by the process: they also exclude the
+        # processes forked after the file was opened (unlike flock)
+        self._lock_file()
+        try:
+            yield
+        finally:
+            self._unlock_file()
+
+    def _lock_file(self, blocking: bool = True) -> bool:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.lockf(self._fd, flags)
+        except OSError:
+            if blocking:
+                raise
+            return False
+        return True
+
+    def _unlock_file(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _as_dict(row: List[int]) -> Dict[str, Any]:
+    items = row[_NUM_COUNTERS : _NUM_COUNTERS + _NUM_ITEM_TYPES]
+    item_bytes = row[_NUM_COUNTERS + _NUM_ITEM_TYPES :]
+    return {
+        **dict(zip(COUNTERS, row)),
+        "items": {name: count for name, count in zip(ITEM_TYPES, items) if count},
+        "item_bytes": {
+            name: size for name, size in zip(ITEM_TYPES, item_bytes) if size
+        },
+    }
+
+
+def _throughput_message(delta: Dict[str, Any], elapsed: float) -> str:
+    def rate(value):
+        return value / elapsed
+
+    items = ", ".join(
+        f"{item_type} {rate(count):.1f}"
+        for item_type, count in sorted(delta["items"].items())
+    )
+    return (
+        f"Throughput over the last {elapsed:.1f}s: "
+        f"{rate(delta['requests']):.1f} requests/s "
+        f"({rate(delta['request_bytes']) / 1024:.1f} KB/s), "
+        f"{rate(delta['envelopes']):.1f} envelopes/s, "
+        f"{rate(delta['events']):.1f} events/s, "
+        f"{rate(delta['metric_buckets']):.1f} metric buckets/s, "
+        f"{delta['errors']} errors, items/s: {items or 'none'}"
+    )
@@ -1,8 +1,15 @@
 from .util import (
     memoize,
+    memoize_info,
     full_path_from_module_relative_path,
 )
-from .relay_util import send_message, send_envelope, send_session
+from .relay_util import (
+    send_message,
+    send_envelope,
+    send_session,
+    get_endpoint,
+    RelayEndpoint,
+)
 
 from .config import (
     relay_address,
@@ -15,3 +22,4 @@ from .configurable_user import (
 )
 
 from .influxdb_metric_sink import timed_operation
+from .payload_sizes import record_payload_size
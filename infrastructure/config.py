@@ -1,6 +1,7 @@
 from collections import namedtuple
 from math import floor
-from random import random
+import random
+from typing import Sequence
 
 from yaml import load
 
@@ -9,7 +10,12 @@ try:
 except ImportError:
     from yaml import Loader, Dumper, FullLoader
 
-from .util import full_path_from_module_relative_path, memoize
+from .util import (
+    full_path_from_module_relative_path,
+    memoize,
+    AliasSampler,
+    _auth_header,
+)
 
 
 def relay_address():
@@ -64,33 +70,87 @@ def locust_config():
         raise ValueError("Invalid configuration")
 
 
-ProjectInfo = namedtuple("ProjectInfo", "id, key")
+ProjectInfo = namedtuple(
+    "ProjectInfo",
+    "id, key, auth_header, store_url, envelope_url",
+    defaults=(None, None, None),
+)
 
 
-def generate_project_info(num_projects) -> ProjectInfo:
-    config = locust_config()
+def make_project_info(project_id, project_key) -> ProjectInfo:
+    """
+    Creates a ProjectInfo with the (per project) auth header and url paths already built
+    """
+    return ProjectInfo(
+        id=project_id,
+        key=project_key,
+        auth_header=_auth_header(project_key),
+        store_url="/api/{}/store/".format(project_id),
+        envelope_url="/api/{}/envelope/".format(project_id),
+    )
 
-    use_fake_projects = config["use_fake_projects"]
 
-    if not use_fake_projects:
-        projects = config["projects"]
-        num_available_projects = len(projects)
-        if num_projects > num_available_projects:
-            num_projects = num_available_projects
+class ProjectTable:
+    """
+    The projects used by a user class, built once, with O(1) selection of a project.
 
-    project_idx = 0
-    if num_projects > 1:
-        project_idx = floor(random() * num_projects)
+    The projects are selected according to the configured distribution:
+    * uniform: all projects are equally likely
+    * zipf: the project with index i (starting at 1) is selected with probability
+      proportional to 1/i**zipf_exponent (a few hot projects and a long tail)
+    """
+
+    def __init__(self, projects: Sequence[ProjectInfo], weights=None):
+        self.projects = list(projects)
+        self._num_projects = len(self.projects)
+        if weights is None:
+            self._sampler = None
+        else:
+            self._sampler = AliasSampler(self.projects, weights)
+
+    def choose(self, rng=random) -> ProjectInfo:
+        if self._sampler is not None:
+            return self._sampler.choose(rng)
+        if self._num_projects == 1:
+            return self.projects[0]
+        return self.projects[floor(rng.random() * self._num_projects)]
+
+
+def create_project_table(
+    num_projects, distribution="uniform", zipf_exponent=1.0
+) -> ProjectTable:
+    config = locust_config()
+
+    use_fake_projects = config["use_fake_projects"]
 
     if use_fake_projects:
-        project_id = project_idx + 1
-        project_key = project_id_to_fake_project_key(project_id)
+        projects = [
+            make_project_info(project_id, project_id_to_fake_project_key(project_id))
+            for project_id in range(1, num_projects + 1)
+        ]
+    else:
+        projects = [
+            make_project_info(project_cfg["id"], project_cfg["key"])
+            for project_cfg in config["projects"][:num_projects]
+        ]
+
+    if distribution == "uniform":
+        weights = None
+    elif distribution == "zipf":
+        weights = [1 / (idx**zipf_exponent) for idx in range(1, len(projects) + 1)]
     else:
-        project_cfg = config["projects"][project_idx]
-        project_id = project_cfg["id"]
-        project_key = project_cfg["key"]
+        raise ValueError("Unknown project distribution", distribution)
+
+    return ProjectTable(projects, weights)
+
 
-    return ProjectInfo(id=project_id, key=project_key)
+@memoize
+def _uniform_project_table(num_projects) -> ProjectTable:
+    return create_project_table(num_projects)
+
+
+def generate_project_info(num_projects) -> ProjectInfo:
+    return _uniform_project_table(num_projects).choose()
 
 
 def project_id_to_fake_project_key(proj_id: int) -> str:
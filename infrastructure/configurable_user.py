@@ -1,9 +1,16 @@
+import itertools
 from collections import abc
 
 from locust.contrib.fasthttp import FastHttpUser
 from yaml import load
 
-from .config import relay_address, generate_project_info, ProjectInfo
+from .config import (
+    relay_address,
+    generate_project_info,
+    create_project_table,
+    ProjectInfo,
+)
+from .seeding import get_random, seed_worker, user_random
 from .util import memoize, load_object
 
 try:
@@ -97,6 +104,11 @@ def create_user_class(
     _tasks = create_tasks(name, locust_info, module_name)
 
     _wait_time = _get_wait_time(locust_info)
+    _project_table = create_project_table(
+        num_projects=locust_info.get("num_projects", 1),
+        distribution=locust_info.get("project_distribution", "uniform"),
+        zipf_exponent=locust_info.get("zipf_exponent", 1.0),
+    )
     if host is None:
         _host = relay_address()
     else:
@@ -112,6 +124,14 @@ def create_user_class(
         weight = _weight
         params = locust_info
         host = _host
+        project_table = _project_table
+        _user_indexes = itertools.count()
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            seed_worker()
+            # the random generator used by the tasks of the user (see infrastructure.seeding)
+            self.rng = user_random(name, next(self._user_indexes))
 
         def get_params(self):
             return self.params
@@ -145,7 +165,12 @@ def get_project_info(user) -> ProjectInfo:
     users:
       SimpleLoadTest:
         num_projects: 10
+        project_distribution: zipf  # optional (uniform by default)
     """
+    project_table = getattr(user, "project_table", None)
+    if project_table is not None:
+        return project_table.choose(get_random(user))
+
     locust_params = user.get_params()
     num_projects = locust_params.get("num_projects", 1)
     return generate_project_info(num_projects)
@@ -0,0 +1,65 @@
+"""
+Canned payloads loaded from files.
+
+A file is read once per process and its content is shared by all the tasks (of all
+user classes) that use the same file, the raw file content is used as the request
+body whenever the payload doesn't need to be modified.
+"""
+import json
+import os
+from typing import Any
+
+from sentry_sdk.envelope import Envelope, Item, PayloadRef
+
+from infrastructure.util import memoize
+
+
+class FilePayload:
+    """
+    The (read only) content of a file, parsed and converted to an envelope only on demand
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            # NOTE: the http client needs a bytes body (memoryview/mmap bodies
+            # are sent as files, which doesn't work with concurrent requests)
+            self.body = f.read()
+        self._json = None
+        self._envelope_body = None
+
+    def json(self) -> Any:
+        """
+        Returns the parsed file content (shared by all users, do NOT modify it)
+        """
+        if self._json is None:
+            self._json = json.loads(self.body)
+        return self._json
+
+    def envelope_body(self) -> bytes:
+        """
+        Returns a serialized envelope containing the file content as an event
+        """
+        if self._envelope_body is None:
+            envelope = Envelope()
+            envelope.add_item(
+                Item(
+                    payload=PayloadRef(bytes=self.body),
+                    type="event",
+                    content_type="application/json",
+                )
+            )
+            self._envelope_body = envelope.serialize()
+        return self._envelope_body
+
+
+@memoize
+def _load_file_payload(real_path: str) -> FilePayload:
+    return FilePayload(real_path)
+
+
+def load_file_payload(file_name: str) -> FilePayload:
+    """
+    Returns the (per process) shared payload for the file
+    """
+    return _load_file_payload(os.path.realpath(file_name))
@@ -13,7 +13,13 @@ _breadcrumb_messages = [
 
 
 def breadcrumb_generator(
-    min=None, max=None, categories=None, levels=None, types=None, messages=None
+    min=None,
+    max=None,
+    categories=None,
+    levels=None,
+    types=None,
+    messages=None,
+    rng=random,
 ):
     min = min if min is not None else 0
     max = max if max is not None else 50
@@ -27,18 +33,20 @@ def breadcrumb_generator(
     )
     types = types if types is not None else ["default", "http", "error"]
     messages = messages if messages is not None else _breadcrumb_messages
-    get_num_crumbs = lambda: random.randrange(min, max + 1)
+    get_num_crumbs = lambda: rng.randrange(min, max + 1)
 
     generator = schema_generator(
+        rng=rng,
         category=categories,
         timestamp=lambda: time.time(),
         level=levels,
         type=types,
-        message=lambda: random.choice(messages),
+        message=lambda: rng.choice(messages),
     )
 
-    def inner():
-        num_crumbs = get_num_crumbs()
+    def inner(num_crumbs=None):
+        if num_crumbs is None:
+            num_crumbs = get_num_crumbs()
         result = [None] * num_crumbs
         for idx in range(num_crumbs):
             result[idx] = generator()
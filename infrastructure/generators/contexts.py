@@ -2,26 +2,26 @@ import time
 import random
 from typing import Sequence
 
-import uuid
-
 from infrastructure.generators.transaction import (
     span_status_generator,
     span_op_generator,
     span_id_generator,
 )
 from infrastructure.generators.util import schema_generator, version_generator
+from infrastructure.util import get_uuid
 
 
-def device_context_generator():
+def device_context_generator(rng=random):
     return schema_generator(
+        rng=rng,
         type="device",
         screen_resolution=[
             None,
-            lambda: f"{int(random.random() * 1000)}x{int(random.random() * 1000)}",
+            lambda: f"{int(rng.random() * 1000)}x{int(rng.random() * 1000)}",
         ],
         orientation=["portrait", "landscape", "garbage data", None],
-        name=[None, lambda: f"Android SDK built for x{random.random()}"],
-        family=[None, lambda: f"Device family {random.random()}"],
+        name=[None, lambda: f"Android SDK built for x{rng.random()}"],
+        family=[None, lambda: f"Device family {rng.random()}"],
         battery_level=range(101),
         screen_dpi=range(1000),
         memory_size=range(10**6),
@@ -41,40 +41,43 @@ def device_context_generator():
         brand=["google", "zoogle", "moodle", "doodle", "tamagotchi"],
         storage_size=range(10**6),
         boot_time=lambda: str(time.time()),
-        arch=lambda: f"x{random.random()}",
+        arch=lambda: f"x{rng.random()}",
         manufacturer=["Google", "Hasbro"],
     )
 
 
-def app_context_generator():
+def app_context_generator(rng=random):
     return schema_generator(
+        rng=rng,
         type="app",
-        app_version=version_generator(3),
+        app_version=version_generator(3, rng=rng),
         app_identifier="io.sentry.sample",
         app_build=range(100),
     )
 
 
-def os_context_generator():
+def os_context_generator(rng=random):
     return schema_generator(
+        rng=rng,
         type="os",
         rooted=[True, False],
         kernel_version="Linux version 3.10.0+ (bjoernj@bjoernj.mtv.corp.google.com) (gcc version 4.9.x 20150123 (prerelease) (GCC) ) #256 SMP PREEMPT Fri May 19 11:58:12 PDT 2017",
-        version=version_generator(3),
+        version=version_generator(3, rng=rng),
         build="sdk_google_phone_x86-userdebug 7.1.1 NYC 5464897 test-keys",
         name=["Android", "NookPhone"],
     )
 
 
-def trace_context_generator(operations=Sequence[str]):
+def trace_context_generator(operations=Sequence[str], rng=random):
     def parent_span_id_generator():
-        random.choice([None, span_id_generator()()])
+        rng.choice([None, span_id_generator()()])
 
     return schema_generator(
-        trace_id=lambda: uuid.uuid4().hex,
+        rng=rng,
+        trace_id=get_uuid,
         span_id=span_id_generator(),
         parent_span_id=parent_span_id_generator,
-        op=span_op_generator(operations=operations),
-        status=span_status_generator(),
+        op=span_op_generator(operations=operations, rng=rng),
+        status=span_status_generator(rng),
         type="trace",
     )
@@ -1,5 +1,4 @@
 import time
-import uuid
 import random
 
 from infrastructure.generators.javascript_frames import javascript_exception_generator
@@ -15,6 +14,8 @@ from infrastructure.generators.contexts import (
 )
 from infrastructure.generators.breadcrumbs import breadcrumb_generator
 from infrastructure.generators.native import native_data_generator
+from infrastructure.generators.size import payload_sizer
+from infrastructure.util import get_uuid
 
 
 def base_event_generator(
@@ -36,44 +37,59 @@ def base_event_generator(
     release=None,
     min_frames=5,
     max_frames=30,
+    target_size=None,
+    rng=random,
     **kwargs,
 ):
+    """
+    Creates a random event generator.
+
+    If `target_size` is set (e.g. `{"p50": "8KB", "p99": "500KB"}`) the number of
+    breadcrumbs is chosen so that the (JSON) event sizes follow the target distribution
+    (`min_breadcrumbs`/`max_breadcrumbs` are ignored).
+    """
+    sizer = payload_sizer(target_size, rng=rng)
+    breadcrumbs = breadcrumb_generator(
+        min=min_breadcrumbs,
+        max=max_breadcrumbs,
+        categories=breadcrumb_categories,
+        levels=breadcrumb_levels,
+        types=breadcrumb_types,
+        messages=breadcrumb_messages,
+        rng=rng,
+    )
+
     event_generator = schema_generator(
-        event_id=(lambda: uuid.uuid4().hex) if with_event_id else None,
+        rng=rng,
+        event_id=get_uuid if with_event_id else None,
         level=["error", "debug"] if with_level else None,
-        fingerprint=lambda: [f"fingerprint{random.randrange(num_event_groups)}"],
+        fingerprint=lambda: [f"fingerprint{rng.randrange(num_event_groups)}"],
         release=(
-            lambda: f"release{random.randrange(num_releases)}"
+            lambda: f"release{rng.randrange(num_releases)}"
             if release is None
             else release
         ),
-        transaction=[None, lambda: f"mytransaction{random.randrange(100)}"],
-        logentry={"formatted": sentence_generator()},
+        transaction=[None, lambda: f"mytransaction{rng.randrange(100)}"],
+        logentry={"formatted": sentence_generator(rng)},
         logger=["foo.bar.baz", "bam.baz.bad", None],
         timestamp=time.time,
         environment=["production", "development", "staging"],
-        user=user_generator(max_users=max_users),
+        user=user_generator(max_users=max_users, rng=rng),
         contexts={
-            "os": [None, os_context_generator()],
-            "device": [None, device_context_generator()],
-            "app": [None, app_context_generator()],
+            "os": [None, os_context_generator(rng)],
+            "device": [None, device_context_generator(rng)],
+            "app": [None, app_context_generator(rng)],
         },
-        breadcrumbs=breadcrumb_generator(
-            min=min_breadcrumbs,
-            max=max_breadcrumbs,
-            categories=breadcrumb_categories,
-            levels=breadcrumb_levels,
-            types=breadcrumb_types,
-            messages=breadcrumb_messages,
-        ),
+        # added last (see below) when the event size is targeted
+        breadcrumbs=breadcrumbs if sizer is None else None,
     )
 
     if with_native_stacktrace:
         native_gen = native_data_generator(
-            num_frames=random.randrange(min_frames, max_frames)
+            num_frames=rng.randrange(min_frames, max_frames), rng=rng
         )
 
-        exc_gen = schema_generator(value=sentence_generator())
+        exc_gen = schema_generator(rng=rng, value=sentence_generator(rng))
 
         def event_generator(base_gen=event_generator):
             event = base_gen()
@@ -89,7 +105,7 @@ def base_event_generator(
 
     elif with_javascript_stacktrace:
         js_gen = javascript_exception_generator(
-            min_frames=min_frames, max_frames=max_frames
+            rng=rng, min_frames=min_frames, max_frames=max_frames
         )
 
         def event_generator(base_gen=event_generator):
@@ -98,4 +114,14 @@ def base_event_generator(
             event["exception"] = js_gen()
             return event
 
+    if sizer is not None:
+
+        def event_generator(base_gen=event_generator):
+            event = base_gen()
+            crumbs = breadcrumbs(sizer.num_units())
+            # (measured before the breadcrumbs are added)
+            sizer.observe(event, "breadcrumbs", crumbs)
+            event["breadcrumbs"] = crumbs
+            return event
+
     return event_generator
@@ -14,21 +14,21 @@ def javascript_frames():
     return frames
 
 
-def javascript_frames_generator(**event_kwargs):
+def javascript_frames_generator(rng=random, **event_kwargs):
     max_frames = event_kwargs.get("max_frames", 50)
     min_frames = event_kwargs.get("min_frames", 0)
     frames = javascript_frames()
 
     def inner():
-        num_frames = random.randrange(min_frames, max_frames)
-        result = [random.choice(frames) for x in range(num_frames)]
+        num_frames = rng.randrange(min_frames, max_frames)
+        result = [rng.choice(frames) for x in range(num_frames)]
         return result
 
     return inner
 
 
-def javascript_exception_generator(**event_kwargs):
-    frames_generator = javascript_frames_generator(**event_kwargs)
+def javascript_exception_generator(rng=random, **event_kwargs):
+    frames_generator = javascript_frames_generator(rng=rng, **event_kwargs)
 
     def inner():
         return {
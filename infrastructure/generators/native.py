@@ -18,7 +18,7 @@ BASE_IMAGES_WITH_FRAMES = [
 ]
 
 
-def native_data_generator(num_frames=20):
+def native_data_generator(num_frames=20, rng=random):
     """
     Generate an event with one native stacktrace + debug_images section. The
     debug images to successfully symbolicate the generated crash are in
@@ -32,7 +32,7 @@ def native_data_generator(num_frames=20):
         for _ in num_frames:
             for image, image_frames in BASE_IMAGES_WITH_FRAMES:
                 image = dict(image)
-                shift = int(random.random() * 2000) - 1000
+                shift = int(rng.random() * 2000) - 1000
 
                 image["image_addr"] = hex(int(image["image_addr"], 16) + shift)
                 images.append(image)
@@ -0,0 +1,119 @@
+import random
+import time
+from typing import Any, Callable, MutableMapping
+
+from infrastructure.ids import new_span_ids
+from infrastructure.util import get_uuid
+
+
+def refresh_event(event: MutableMapping[str, Any], time_shift: float):
+    """
+    Rewrites the volatile fields of a (pooled) event
+    """
+    event["event_id"] = get_uuid()
+    event["timestamp"] = time.time()
+    return event
+
+
+def refresh_normalized_event(event: MutableMapping[str, Any], time_shift: float):
+    """
+    Rewrites the volatile fields of a (pooled) event that was already normalized by relay
+    (the fields that relay derives from them are rewritten as well)
+    """
+    event_id = get_uuid()
+    now = time.time()
+    event["event_id"] = event_id
+    event["timestamp"] = now
+    event["received"] = now
+
+    trace_ctx = event.get("contexts", {}).get("trace")
+    if trace_ctx is not None:
+        trace_ctx["trace_id"] = event_id
+        trace_ctx["span_id"] = event_id[:16]
+    return event
+
+
+def refresh_transaction(transaction: MutableMapping[str, Any], time_shift: float):
+    """
+    Rewrites the volatile fields of a (pooled) transaction.
+
+    The transaction, and all its spans, get new ids (keeping the span tree intact)
+    and all timestamps are moved forward by `time_shift` seconds.
+    """
+    transaction["event_id"] = get_uuid()
+    trace_id = get_uuid()
+
+    spans = transaction.get("spans", ())
+    ids = new_span_ids(len(spans) + 1)
+
+    trace_ctx = transaction["contexts"]["trace"]
+    transaction_id = ids[-1]
+    id_map = {trace_ctx["span_id"]: transaction_id}
+    trace_ctx["trace_id"] = trace_id
+    trace_ctx["span_id"] = transaction_id
+
+    transaction["timestamp"] += time_shift
+    transaction["start_timestamp"] += time_shift
+
+    # parents are always created before their children so a single pass is enough
+    for span, span_id in zip(spans, ids):
+        id_map[span["span_id"]] = span_id
+        span["span_id"] = span_id
+        span["parent_span_id"] = id_map.get(
+            span["parent_span_id"], span["parent_span_id"]
+        )
+        span["trace_id"] = trace_id
+        span["timestamp"] += time_shift
+        span["start_timestamp"] += time_shift
+
+    return transaction
+
+
+def event_pool_generator(
+    generator: Callable[[], MutableMapping[str, Any]],
+    pool_size: int,
+    refresh_rate: float = 0.0,
+    refresh: Callable[[MutableMapping[str, Any], float], Any] = refresh_event,
+    rng=random,
+):
+    """
+    Wraps an event generator with a pool of (at most) `pool_size` events.
+
+    The pool is filled lazily, the first `pool_size` calls return freshly generated
+    events, after that a random event from the pool is returned with only its volatile
+    fields (ids, timestamps) rewritten by `refresh`.
+
+    Pooled events are mutated in place on every call, the returned event should be sent
+    (serialized) before the next call and must not be kept around.
+
+    `refresh_rate` is the probability that a pool slot is replaced by a freshly generated
+    event (0 will reuse the pooled events forever, 1 is equivalent with not using a pool).
+
+    If `pool_size` is 0 (or less) the generator is returned as is.
+    """
+    if pool_size <= 0:
+        return generator
+
+    pool = []
+
+    def inner():
+        now = time.time()
+        if len(pool) < pool_size:
+            event = generator()
+            pool.append([event, now])
+            return event
+
+        slot = pool[rng.randrange(pool_size)]
+
+        if refresh_rate > 0 and rng.random() < refresh_rate:
+            event = generator()
+            slot[0] = event
+            slot[1] = now
+            return event
+
+        event, generated_at = slot
+        slot[1] = now
+        refresh(event, now - generated_at)
+        return event
+
+    return inner
@@ -0,0 +1,149 @@
+"""
+Payload size targeting.
+
+A `SizeDistribution` describes the wanted (JSON serialized) size of the generated
+payloads, a `PayloadSizer` steers the number of variable sized units of a payload
+(breadcrumbs, spans ...) so that the payload sizes follow the distribution.
+
+The sizer doesn't serialize every payload: it keeps running means of the size of
+a payload without its units and of the size of one unit, measured on a sample of the
+generated payloads, and derives the number of units from them.
+"""
+import json
+import math
+import random
+import re
+from typing import Any, Mapping, Optional, Sequence, Union
+
+_SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 * 1024, "GB": 1024**3}
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d*)?)\s*([KMG]?B?)\s*$", re.IGNORECASE)
+
+# the 99th percentile of the standard normal distribution
+_Z_99 = 2.3263478740408408
+
+
+def parse_size(size: Union[str, int, float]) -> int:
+    """
+    Parses a size in bytes (1KB is 1024 bytes)
+
+    >>> parse_size("8KB")
+    8192
+    >>> parse_size("1.5 mb")
+    1572864
+    >>> parse_size(100)
+    100
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = _SIZE_RE.match(size)
+    if match is None:
+        raise ValueError(f"Invalid size: {size!r}")
+    value, unit = match.groups()
+    return int(float(value) * _SIZE_UNITS[unit.upper()])
+
+
+class SizeDistribution:
+    """
+    A log-normal distribution of payload sizes (in bytes) with the given median (p50)
+    and 99th percentile (p99)
+    """
+
+    def __init__(self, p50: int, p99: Optional[int] = None):
+        if p99 is None:
+            p99 = p50
+        if p50 <= 0 or p99 < p50:
+            raise ValueError("Invalid size distribution, expected 0 < p50 <= p99")
+        self.p50 = p50
+        self.p99 = p99
+        self.mu = math.log(p50)
+        self.sigma = (math.log(p99) - self.mu) / _Z_99
+
+    def sample(self, rng=random) -> float:
+        if self.sigma == 0:
+            return float(self.p50)
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    @classmethod
+    def from_config(
+        cls, config: Optional[Mapping[str, Any]]
+    ) -> Optional["SizeDistribution"]:
+        """
+        Creates the distribution from the task configuration, e.g. `{p50: 8KB, p99: 500KB}`
+        (returns None if `config` is empty)
+        """
+        if not config:
+            return None
+        p99 = config.get("p99")
+        return cls(p50=parse_size(config["p50"]), p99=parse_size(p99) if p99 else None)
+
+
+class PayloadSizer:
+    """
+    Chooses the number of units of the payloads so that their sizes follow `target`.
+
+    Usage, for every payload:
+
+        num_units = sizer.num_units()
+        ... generate the payload and its `num_units` units ...
+        sizer.observe(payload, key, units)
+        payload[key] = units
+
+    `observe` measures (serializes) the payload only for the first `warmup` payloads
+    and then for a `sample_rate` fraction of them. The payload (without its units) and
+    the units are serialized separately, every part of a sample is serialized once.
+    """
+
+    def __init__(
+        self,
+        target: SizeDistribution,
+        rng=random,
+        initial_units: int = 10,
+        max_units: int = 10000,
+        warmup: int = 20,
+        sample_rate: float = 0.01,
+    ):
+        self.target = target
+        self.rng = rng
+        self.initial_units = initial_units
+        self.max_units = max_units
+        self.warmup = warmup
+        self.sample_rate = sample_rate
+        self.samples = 0
+        self._base_size = 0.0  # mean size of the payload without the units
+        self._unit_size = 0.0  # mean size of one unit
+        self._unit_samples = 0
+
+    def num_units(self) -> int:
+        if self._unit_samples == 0:
+            return self.initial_units
+        units = (self.target.sample(self.rng) - self._base_size) / self._unit_size
+        return min(self.max_units, max(0, round(units)))
+
+    def observe(self, payload: Mapping[str, Any], key: str, units: Sequence[Any]):
+        """
+        Measures a payload before its `units` are added (as `payload[key]`)
+        """
+        if self.samples >= self.warmup and self.rng.random() >= self.sample_rate:
+            return
+        units_size = len(json.dumps(units)) - 2  # without the brackets
+        # the payload with an empty list of units: `, "<key>": []`
+        base_size = len(json.dumps(payload)) + len(key) + 8
+        self.samples += 1
+        self._base_size += (base_size - self._base_size) / self.samples
+        if len(units) > 0:
+            self._unit_samples += 1
+            self._unit_size += (
+                units_size / len(units) - self._unit_size
+            ) / self._unit_samples
+
+
+def payload_sizer(
+    target_size: Optional[Mapping[str, Any]], rng=random, **kwargs
+) -> Optional[PayloadSizer]:
+    """
+    Returns a sizer for the `target_size` task parameter (None if it is not set)
+    """
+    target = SizeDistribution.from_config(target_size)
+    if target is None:
+        return None
+    return PayloadSizer(target, rng=rng, **kwargs)
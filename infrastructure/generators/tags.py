@@ -3,7 +3,7 @@ import random
 from infrastructure.generators.util import version_generator
 
 
-def tags_generator(min=0, max=100, tag_values_per_tag=100):
+def tags_generator(min=0, max=100, tag_values_per_tag=100, rng=random):
     """
     Generate tags dictionary, at least `min` tags and at most `max`.
 
@@ -16,8 +16,8 @@ def tags_generator(min=0, max=100, tag_values_per_tag=100):
     def inner():
         tags = {}
 
-        for i in range(random.randrange(min, max)):
-            tags[f"mytag{i}"] = f"Tag value {random.randrange(0, tag_values_per_tag)}"
+        for i in range(rng.randrange(min, max)):
+            tags[f"mytag{i}"] = f"Tag value {rng.randrange(0, tag_values_per_tag)}"
 
         return tags
 
@@ -1,7 +1,14 @@
 import random
-import uuid
+from array import array
 from enum import Enum
-from typing import List, Any, Sequence, Callable
+from typing import List, Any, Sequence, Callable, Optional
+
+from infrastructure.ids import new_span_id, new_span_ids
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class SpanStatus(Enum):
@@ -25,41 +32,35 @@ class SpanStatus(Enum):
     data_loss = "data_loss"
 
 
-def span_status_generator():
-    if random.randint(1, 100) < 100:
+def span_status_generator(rng=random):
+    if rng.randint(1, 100) < 100:
         return lambda: SpanStatus.ok.value  # mostly return ok
 
     # return an error once every 101 spans
     values = list(map(lambda x: x.value, SpanStatus))
-    return lambda: random.choice(values)
+    return lambda: rng.choice(values)
 
 
 _new_span_status = span_status_generator()
 
 
-def measurements_generator(measurements: Sequence[str]):
-    pass
-
+def measurements_generator(measurements: Sequence[str], rng=random):
     def inner():
         return {
-            measurement: {"value": random.random() * 10000}
-            for measurement in measurements
+            measurement: {"value": rng.random() * 10000} for measurement in measurements
         }
 
     return inner
 
 
 def span_id_generator():
-    return lambda: uuid.uuid4().hex[:16]
-
+    return new_span_id
 
-_new_span_id = span_id_generator()
 
-
-def span_op_generator(operations: Sequence[str]):
+def span_op_generator(operations: Sequence[str], rng=random):
     values = list(operations)
 
-    return lambda: random.choice(values)
+    return lambda: rng.choice(values)
 
 
 def create_spans(
@@ -70,56 +71,113 @@ def create_spans(
     transaction_start: float,
     timestamp: float,
     operations_generator: Callable[[], str],
+    rng=random,
+    status_generator: Optional[Callable[[], str]] = None,
 ) -> List[Any]:
-    num_spans = random.randint(min_spans, max_spans)
-
-    ret_val = []
-    num_children_left = random.randint(1, 3)
-    current_node_idx = 0
-    time_slice = (timestamp - transaction_start) / num_children_left
-    parent_start = transaction_start
-    parent_id = transaction_id
-    while len(ret_val) < num_spans:
-        if num_children_left > 0:
-            start_timestamp = parent_start + (num_children_left - 1) * time_slice
-            timestamp = parent_start + num_children_left * time_slice
-            operation = operations_generator()
-            ret_val.append(
-                _create_span(
-                    parent_id=parent_id,
-                    trace_id=trace_id,
-                    timestamp=timestamp,
-                    start_timestamp=start_timestamp,
-                    operation=operation,
-                )
-            )
-            num_children_left -= 1
-        else:
-            # decide how many sub spans
-            num_children_left = random.randint(1, 3)
-            # divide the time for each sub-span equally
-            current_node = ret_val[current_node_idx]
-            parent_end = current_node["timestamp"]
-            parent_start = current_node["start_timestamp"]
-            parent_id = current_node["span_id"]
-            time_slice = (parent_end - parent_start) / num_children_left
-            current_node_idx += 1  # go to next span and prepare to add sub-spans to it
-    return ret_val
-
-
-def _create_span(
-    parent_id: str,
-    trace_id: str,
-    start_timestamp: float,
-    timestamp: float,
-    operation: str,
-):
-    return {
-        "timestamp": timestamp,
-        "start_timestamp": start_timestamp,
-        "trace_id": trace_id,
-        "parent_span_id": parent_id,
-        "span_id": _new_span_id(),
-        "op": operation,
-        "status": _new_span_status(),
-    }
+    """
+    Creates a random span tree.
+
+    The spans are created breadth first: the transaction (and then every span, in order)
+    gets 1 to 3 children that split the duration of their parent in equal slices,
+    until there are `num_spans` spans.
+
+    The shape of the tree and the timestamps are computed in bulk (with NumPy for
+    large trees, when available) and the span dicts are only created at the end.
+    The span statuses come from `status_generator` (see `span_status_generator`).
+    """
+    num_spans = rng.randint(min_spans, max_spans)
+    if num_spans <= 0:
+        return []
+    if status_generator is None:
+        status_generator = _new_span_status
+
+    # the number of children of the transaction (index 0) and of every span (index i + 1),
+    # only the first num_spans matter since every parent has at least one child
+    num_children = rng.choices((1, 2, 3), k=num_spans)
+
+    if numpy is not None and num_spans >= _NUMPY_MIN_SPANS:
+        parents, starts, ends = _span_tree_numpy(num_children, num_spans)
+    else:
+        parents, starts, ends = _span_tree(num_children, num_spans)
+
+    ids = new_span_ids(num_spans)
+    duration = timestamp - transaction_start
+    return [
+        {
+            "timestamp": transaction_start + end * duration,
+            "start_timestamp": transaction_start + start * duration,
+            "trace_id": trace_id,
+            "parent_span_id": transaction_id if parent < 0 else ids[parent],
+            "span_id": span_id,
+            "op": operations_generator(),
+            "status": status_generator(),
+        }
+        for span_id, parent, start, end in zip(ids, parents, starts, ends)
+    ]
+
+
+# below this the NumPy overhead is larger than the gain
+_NUMPY_MIN_SPANS = 200
+
+
+def _span_tree(num_children: Sequence[int], num_spans: int):
+    """
+    Returns the parent index (-1 for the transaction) and the start and end of every span
+    (as a fraction of the transaction duration)
+    """
+    parents = array("l")
+    starts = array("d")
+    ends = array("d")
+
+    # the transaction is the parent of the first spans
+    parent = -1
+    parent_start = 0.0
+    parent_end = 1.0
+    for count in num_children:
+        time_slice = (parent_end - parent_start) / count
+        # the first child covers the last slice of its parent (and so on)
+        for slot in range(count - 1, -1, -1):
+            parents.append(parent)
+            starts.append(parent_start + slot * time_slice)
+            ends.append(parent_start + (slot + 1) * time_slice)
+            if len(parents) == num_spans:
+                return parents, starts, ends
+        parent += 1
+        parent_start = starts[parent]
+        parent_end = ends[parent]
+
+    return parents, starts, ends
+
+
+def _span_tree_numpy(num_children: Sequence[int], num_spans: int):
+    """
+    NumPy version of `_span_tree`.
+
+    Breadth first, the children of a generation of spans form the next (contiguous)
+    generation, so the timestamps are computed one generation (tree level) at a time.
+    """
+    counts = numpy.array(num_children, dtype=numpy.int64)
+    # the children of parent j (0 the transaction, i + 1 span i) are [last[j] - counts[j], last[j])
+    last = numpy.cumsum(counts)
+
+    parents = numpy.repeat(numpy.arange(-1, num_spans - 1), counts)[:num_spans]
+    siblings = counts[parents + 1]
+    # the first child covers the last slice of its parent (and so on)
+    slots = siblings - 1 - (numpy.arange(num_spans) - (last - counts)[parents + 1])
+
+    starts = numpy.empty(num_spans)
+    ends = numpy.empty(num_spans)
+
+    begin, end = 0, min(int(last[0]), num_spans)
+    while begin < end:
+        generation = parents[begin:end]
+        is_root = generation < 0
+        parent_starts = numpy.where(is_root, 0.0, starts[generation])
+        parent_ends = numpy.where(is_root, 1.0, ends[generation])
+        time_slices = (parent_ends - parent_starts) / siblings[begin:end]
+        starts[begin:end] = parent_starts + slots[begin:end] * time_slices
+        ends[begin:end] = starts[begin:end] + time_slices
+        # the next generation are the children of this generation
+        begin, end = end, min(int(last[end]), num_spans) if end < num_spans else end
+
+    return parents.tolist(), starts.tolist(), ends.tolist()
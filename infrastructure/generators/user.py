@@ -3,12 +3,13 @@ import random
 from infrastructure.generators.util import schema_generator, version_generator
 
 
-def user_generator(max_users=None):
+def user_generator(max_users=None, rng=random):
     if not max_users:
-        return schema_generator(ip_address=version_generator(4, 255))
+        return schema_generator(rng=rng, ip_address=version_generator(4, 255, rng))
 
     return schema_generator(
-        ip_address=version_generator(4, 255),
-        username=f"Hobgoblin {random.random()}",
-        id=lambda: str(random.randrange(max_users)),
+        rng=rng,
+        ip_address=version_generator(4, 255, rng),
+        username=f"Hobgoblin {rng.random()}",
+        id=lambda: str(rng.randrange(max_users)),
     )
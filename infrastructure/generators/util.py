@@ -1,56 +1,127 @@
 import random
 
 
-def schema_generator(**fields):
+def schema_generator(schema=None, /, *, rng=random, **fields):
     """
     Generate a dictionary instance according to the schema outlined by the
-    provided kwargs. Supports:
+    provided kwargs (and the `schema` dict, for fields named e.g. `rng`). Supports:
 
     * string
     * number
     * callable
     * range object
+    * dict (a nested schema)
     * list of any of the above (random item will be selected)
+
+    The random choices are made with `rng` (a `random.Random` instance or the
+    `random` module).
+
+    The schema is compiled once, when the generator is created, into a flat
+    plan of `(key, value, is_dynamic)` entries so that generating an
+    instance does not need to inspect the schema again.
+
+    >>> gen = schema_generator(a=1, b=None, c=lambda: "x", d={"e": [2]})
+    >>> gen()
+    {'a': 1, 'c': 'x', 'd': {'e': 2}}
+    >>> schema_generator({"rng": 4}, rng=random.Random(1))()
+    {'rng': 4}
     """
+    if schema is not None:
+        fields = {**schema, **fields}
+    plan = []
+    for key, sub_generator in fields.items():
+        value, is_dynamic = _compile_field(sub_generator, rng)
+        if value is None and not is_dynamic:
+            continue  # constant None fields are never emitted
+        plan.append((key, value, is_dynamic))
+    plan = tuple(plan)
 
     def inner():
         rv = {}
-        for k, sub_generator in fields.items():
-            if isinstance(sub_generator, (list, tuple, range)):
-                sub_generator = random.choice(sub_generator)
+        for key, value, is_dynamic in plan:
+            if is_dynamic:
+                value = value()
+            if value is not None:
+                rv[key] = value
+        return rv
 
-            if isinstance(sub_generator, dict):
-                sub_generator = schema_generator(**sub_generator)
+    return inner
 
-            if callable(sub_generator):
-                sub_generator = sub_generator()
 
-            if sub_generator is not None:
-                rv[k] = sub_generator
+def _compile_field(sub_generator, rng):
+    """
+    Compiles a schema field into a `(value, is_dynamic)` pair.
 
-        return rv
+    If `is_dynamic` is True `value` is a callable that produces the field value
+    otherwise `value` is the constant field value.
+    """
+    if isinstance(sub_generator, (list, tuple, range)):
+        return _compile_choice(sub_generator, rng), True
+
+    if isinstance(sub_generator, dict):
+        return schema_generator(sub_generator, rng=rng), True
+
+    if callable(sub_generator):
+        return sub_generator, True
+
+    return sub_generator, False
+
+
+def _compile_choice(options, rng):
+    """
+    Compiles a list of options into a callable that picks (and evaluates) one
+    of the options at random
+    """
+    choice = rng.choice
+
+    if isinstance(options, range):
+        return lambda: choice(options)
+
+    compiled = [_compile_option(option, rng) for option in options]
+
+    if not any(is_dynamic for _, is_dynamic in compiled):
+        # a simple choice table, no need to evaluate the selected option
+        constants = tuple(value for value, _ in compiled)
+        return lambda: choice(constants)
+
+    compiled = tuple(compiled)
+
+    def inner():
+        value, is_dynamic = choice(compiled)
+        return value() if is_dynamic else value
 
     return inner
 
 
-def version_generator(num_segments=3, max_version_segment=10):
+def _compile_option(option, rng):
+    # nested sequences are not flattened, a list option is returned as is
+    if isinstance(option, dict):
+        return schema_generator(option, rng=rng), True
+
+    if callable(option):
+        return option, True
+
+    return option, False
+
+
+def version_generator(num_segments=3, max_version_segment=10, rng=random):
     def inner():
         return ".".join(
-            str(random.randrange(max_version_segment)) for _ in range(num_segments)
+            str(rng.randrange(max_version_segment)) for _ in range(num_segments)
         )
 
     return inner
 
 
-def string_databag_generator(max_length=10000):
+def string_databag_generator(max_length=10000, rng=random):
     """
     Generate a really random string of potentially ludicrous length.
     """
 
     def inner():
         rv = []
-        for _ in range(random.randrange(max_length)):
-            rv.append(chr(random.randrange(0, 256)))
+        for _ in range(rng.randrange(max_length)):
+            rv.append(chr(rng.randrange(0, 256)))
 
         return "".join(rv)
 
@@ -113,28 +184,30 @@ _direct_object = _subject + [
 ]
 
 
-def sentence_generator():
+def sentence_generator(rng=random):
+    choice = rng.choice
+
     def inner():
-        subject = random.choice(_subject)
+        subject = choice(_subject)
 
         while True:
-            direct_object = random.choice(_direct_object)
+            direct_object = choice(_direct_object)
             if direct_object != subject:
                 break
 
         if subject[0] == "a":
-            article1 = random.choice(_articles2)
+            article1 = choice(_articles2)
         else:
-            article1 = random.choice(_articles1)
+            article1 = choice(_articles1)
 
         if _direct_object[0] == "a":
-            article2 = random.choice(_articles2)
+            article2 = choice(_articles2)
         else:
-            article2 = random.choice(_articles1)
+            article2 = choice(_articles1)
 
         article2 = article2.lower()
 
-        predicate = random.choice(_predicate)
+        predicate = choice(_predicate)
 
         return f"{article1} {subject} {predicate} {article2} {direct_object}."
 
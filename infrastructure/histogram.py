@@ -0,0 +1,152 @@
+"""
+Log bucketed (HDR style) latency histograms.
+
+The histograms have a bounded relative error (`precision`) and can be merged
+exactly (bucket by bucket) so histograms recorded in different processes can
+be combined into one histogram.
+"""
+import math
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# values below this are recorded in the first bucket (i.e. 1 microsecond for values in ms)
+_MIN_VALUE = 0.001
+
+# (measurement, ((tag_name, tag_value),...))
+HistogramKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class LatencyHistogram:
+    """
+    A histogram with logarithmic buckets, bucket `i` holds the values in the interval
+    ((1 + precision)**(i-1), (1 + precision)**i]
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._inv_log_base = 1 / math.log1p(precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, value: float):
+        idx = math.ceil(math.log(max(value, _MIN_VALUE)) * self._inv_log_base)
+        buckets = self.buckets
+        buckets[idx] = buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.precision != self.precision:
+            raise ValueError(
+                "Cannot merge histograms with different precision",
+                self.precision,
+                other.precision,
+            )
+        buckets = self.buckets
+        for idx, count in other.buckets.items():
+            buckets[idx] = buckets.get(idx, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Returns the upper bound of the bucket containing the q-th quantile (0 <= q <= 1)
+
+        >>> h = LatencyHistogram(precision=0.01)
+        >>> for v in range(1, 101): h.record(v)
+        >>> 50 <= h.percentile(0.5) <= 50 * 1.01
+        True
+        >>> h.percentile(1)
+        100
+        """
+        if self.count == 0:
+            return None
+        target = max(1, math.ceil(q * self.count))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= target:
+                upper = math.exp(idx / self._inv_log_base)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns a representation that can be sent between processes (msgpack/json)
+        """
+        return {
+            "precision": self.precision,
+            "buckets": [[idx, count] for idx, count in self.buckets.items()],
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "LatencyHistogram":
+        histogram = cls(precision=data["precision"])
+        histogram.buckets = {idx: count for idx, count in data["buckets"]}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class HistogramRegistry:
+    """
+    A collection of histograms, one per measurement and tag set
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self.histograms: Dict[HistogramKey, LatencyHistogram] = {}
+
+    def record(self, measurement: str, value: float, **tags: str):
+        key = (measurement, tuple(sorted(tags.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram(self.precision)
+            self.histograms[key] = histogram
+        histogram.record(value)
+
+    def merge(self, other: "HistogramRegistry"):
+        for key, other_histogram in other.histograms.items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram(self.precision)
+                self.histograms[key] = histogram
+            histogram.merge(other_histogram)
+
+    def __len__(self):
+        return len(self.histograms)
+
+    def to_list(self) -> List[Any]:
+        return [
+            [measurement, [list(tag) for tag in tags], histogram.to_dict()]
+            for (measurement, tags), histogram in self.histograms.items()
+        ]
+
+    @classmethod
+    def from_list(cls, data: List[Any], precision: float) -> "HistogramRegistry":
+        registry = cls(precision)
+        for measurement, tags, histogram in data:
+            key = (measurement, tuple(tuple(tag) for tag in tags))
+            registry.histograms[key] = LatencyHistogram.from_dict(histogram)
+        return registry
@@ -0,0 +1,103 @@
+"""
+Random hex ids (event ids, trace ids, span ids).
+
+`uuid.uuid4()` reads the OS random generator for every id, an `IdSource` reads random
+bytes in large chunks, keeps them hex encoded and hands out ids by slicing the buffer.
+
+The ids are random hex strings, they are not (version 4) UUIDs.
+"""
+import os
+import random
+from typing import Callable, List
+
+_DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class IdSource:
+    """
+    Hands out random hex ids from a buffer refilled (`buffer_size` random bytes at a time)
+    from `os.urandom` or, if `seed` is set, from a pseudo random generator seeded with
+    `seed` (the same seed produces the same ids).
+    """
+
+    def __init__(self, seed=None, buffer_size: int = _DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._random_bytes = (
+            _seeded_random_bytes(seed) if seed is not None else os.urandom
+        )
+        self._buffer = ""
+        self._offset = 0
+
+    def hex_id(self, length: int) -> str:
+        """
+        Returns a random hex string with `length` characters
+        """
+        offset = self._offset
+        end = offset + length
+        if end > len(self._buffer):
+            if length > 2 * self.buffer_size:
+                return self._random_bytes((length + 1) // 2).hex()[:length]
+            self._buffer = self._random_bytes(self.buffer_size).hex()
+            offset = 0
+            end = length
+        self._offset = end
+        return self._buffer[offset:end]
+
+    def uuid(self) -> str:
+        """
+        Returns a 32 characters id (event id, trace id)
+        """
+        return self.hex_id(32)
+
+    def span_id(self) -> str:
+        """
+        Returns a 16 characters id
+        """
+        return self.hex_id(16)
+
+    def span_ids(self, count: int) -> List[str]:
+        """
+        Returns `count` span ids
+        """
+        hex_ids = self.hex_id(16 * count) if count > 0 else ""
+        return [hex_ids[idx : idx + 16] for idx in range(0, 16 * count, 16)]
+
+
+def _seeded_random_bytes(seed) -> Callable[[int], bytes]:
+    rng = random.Random(seed)
+    return lambda size: rng.getrandbits(8 * size).to_bytes(size, "little")
+
+
+_source = IdSource()
+
+
+def seed_ids(seed=None):
+    """
+    Makes the ids returned by the module functions reproducible (`None` goes back to
+    `os.urandom` ids)
+    """
+    global _source
+    _source = IdSource(seed)
+
+
+def _discard_buffer():
+    # a forked process must not hand out the ids left in the buffer of its parent
+    global _source
+    if _source._random_bytes is os.urandom:
+        _source = IdSource()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_discard_buffer)
+
+
+def new_uuid() -> str:
+    return _source.hex_id(32)
+
+
+def new_span_id() -> str:
+    return _source.hex_id(16)
+
+
+def new_span_ids(count: int) -> List[str]:
+    return _source.span_ids(count)
@@ -1,3 +1,5 @@
+import logging
+import queue
 import socket
 import threading
 import time
@@ -7,12 +9,17 @@ from contextlib import contextmanager
 from typing import Optional
 
 import influxdb_client
+from locust import events
+from locust.runners import WorkerRunner
 
+from .histogram import HistogramRegistry
 from .util import memoize, get_value_with_env_override
-from influxdb_client.client.write_api import PointSettings
+from influxdb_client.client.write_api import PointSettings, SYNCHRONOUS
 
 from infrastructure.config import metrics_enabled, get_metrics_config
 
+_log = logging.getLogger(__name__)
+
 
 @contextmanager
 def timed_operation(measurement: str, **tags: str):
@@ -31,20 +38,25 @@ def timed_operation(measurement: str, **tags: str):
     untimed_function()
 
 
+    If histograms are enabled (metrics.histograms.enabled) the durations are aggregated
+    in histograms and only the percentiles are sent periodically.
+
     NOTE: import this from module level (from infrastructure) in order
     to facilitate exchanging this implementation with a different one (e.g. statsd)
     """
     start = None
     enabled = metrics_enabled()
     if enabled:
-        start = int(time.monotonic() * 1000)
+        start = time.monotonic()
     try:
         yield
     finally:
         if enabled:
-            end = int(time.monotonic() * 1000)
-            duration_ms = end - start
-            _log_timed_metric(measurement, duration_ms, **tags)
+            duration_ms = (time.monotonic() - start) * 1000
+            if histograms_enabled():
+                _get_histogram_aggregator().record(measurement, duration_ms, **tags)
+            else:
+                _log_timed_metric(measurement, int(duration_ms), **tags)
 
 
 @memoize
@@ -90,16 +102,281 @@ def get_run_id():
     return os.getenv("TEST_RUN_ID", default="UNKNOWN")
 
 
-def _log_timed_metric(measurement: str, duration_ms, **tags: str):
+class BufferedPointWriter:
+    """
+    Writes points to InfluxDB in batches from a background thread.
+
+    Points are added to a bounded in memory queue (without blocking the caller),
+    the background thread writes them in batches of (at most) `batch_size` points
+    at least once every `flush_interval` seconds.
+    When the queue is full new points are dropped (and counted in `dropped`).
+    """
+
+    def __init__(
+        self,
+        client: influxdb_client.InfluxDBClient,
+        org: str,
+        bucket: str,
+        max_queue_size: int = 10000,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+    ):
+        self.org = org
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.failed = 0
+        self._write_api = client.write_api(
+            write_options=SYNCHRONOUS, point_settings=_get_point_settings()
+        )
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, point: influxdb_client.Point):
+        try:
+            self._queue.put_nowait(point)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Stops the background thread after writing all queued points
+        """
+        self._closed.set()
+        self._thread.join(timeout)
+        if self.dropped > 0 or self.failed > 0:
+            _log.warning(
+                "InfluxDB writer dropped %d points (queue full), failed to write %d points",
+                self.dropped,
+                self.failed,
+            )
+
+    def _run(self):
+        while True:
+            closed = self._closed.is_set()
+            batch = self._next_batch()
+            if len(batch) > 0:
+                self._write(batch)
+            elif closed:
+                return
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._closed.is_set():
+                timeout = 0  # only pick what is already queued
+            else:
+                timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self._write_api.write(self.bucket, self.org, batch)
+        except Exception as err:
+            self.failed += len(batch)
+            _log.error("Failed to write %d points to InfluxDB: %s", len(batch), err)
+
+
+@memoize
+def _get_point_writer() -> Optional[BufferedPointWriter]:
     client = _get_influxdb_client()
-    if client:
-        with client.write_api(point_settings=_get_point_settings()) as write_api:
-            p = influxdb_client.Point(measurement)
-            for k, v in tags.items():
-                p = p.tag(k, v)
-            p = p.field("duration", duration_ms)
-            p.tag("thread_id", threading.get_ident())
-            p.tag("run", get_run_id())
-            p.time(_time_ns(), write_precision="ns")
-            org_name, bucket_name = _get_org_bucket()
-            write_api.write(bucket_name, org_name, p)
+    if client is None:
+        return None
+
+    influxdb_config = get_metrics_config().get("influxdb", {})
+    org_name, bucket_name = _get_org_bucket()
+    writer = BufferedPointWriter(
+        client,
+        org_name,
+        bucket_name,
+        max_queue_size=influxdb_config.get("max_queue_size", 10000),
+        batch_size=influxdb_config.get("batch_size", 1000),
+        flush_interval=influxdb_config.get("flush_interval", 1.0),
+    )
+
+    @events.quitting.add_listener
+    def _flush_on_quit(**kwargs):
+        writer.close()
+
+    return writer
+
+
+def _log_timed_metric(measurement: str, duration_ms, **tags: str):
+    writer = _get_point_writer()
+    if writer:
+        p = influxdb_client.Point(measurement)
+        for k, v in tags.items():
+            p = p.tag(k, v)
+        p = p.field("duration", duration_ms)
+        p.tag("thread_id", threading.get_ident())
+        p.tag("run", get_run_id())
+        p.time(_time_ns(), write_precision="ns")
+        writer.write(p)
+
+
+@memoize
+def _get_histograms_config():
+    return get_metrics_config().get("histograms") or {}
+
+
+@memoize
+def histograms_enabled():
+    return _get_histograms_config().get("enabled", False)
+
+
+_PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+
+class HistogramAggregator:
+    """
+    Aggregates timed operations in histograms (one per measurement and tag set).
+
+    Every `interval` seconds the histograms of the last interval are summarized
+    (count, mean, percentiles) in one InfluxDB point per histogram.
+
+    The histograms are also merged in a histogram covering the whole run and
+    all workers: workers send them to the master (with the regular worker reports)
+    and the master (or the local runner) merges them and logs a report at exit.
+    """
+
+    def __init__(self, precision: float = 0.01, interval: float = 10.0):
+        self.precision = precision
+        self.interval = interval
+        self.current = HistogramRegistry(precision)
+        # histograms not yet sent to the master (only used by workers)
+        self.unreported = HistogramRegistry(precision)
+        # histograms for the whole run (only used by the master or the local runner)
+        self.fleet = HistogramRegistry(precision)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, measurement: str, duration_ms: float, **tags: str):
+        self.current.record(measurement, duration_ms, **tags)
+
+    def rotate(self):
+        """
+        Ends the current interval
+        """
+        interval, self.current = self.current, HistogramRegistry(self.precision)
+        if len(interval) == 0:
+            return
+
+        writer = _get_point_writer()
+        if writer:
+            now = _time_ns()
+            for (measurement, tags), histogram in interval.histograms.items():
+                p = influxdb_client.Point(measurement)
+                for k, v in tags:
+                    p = p.tag(k, v)
+                p.tag("run", get_run_id())
+                p.field("count", histogram.count)
+                p.field("mean", histogram.mean())
+                p.field("min", histogram.min)
+                p.field("max", histogram.max)
+                for name, q in _PERCENTILES.items():
+                    p.field(name, histogram.percentile(q))
+                p.time(now, write_precision="ns")
+                writer.write(p)
+
+        if isinstance(_get_runner(), WorkerRunner):
+            self.unreported.merge(interval)
+        else:
+            self.fleet.merge(interval)
+
+    def take_unreported(self) -> HistogramRegistry:
+        unreported, self.unreported = self.unreported, HistogramRegistry(self.precision)
+        return unreported
+
+    def report(self) -> str:
+        lines = [
+            "Latency histograms (ms) for the whole run:",
+            "{:<40} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+                "measurement", "count", "p50", "p99", "p999", "max"
+            ),
+        ]
+        for (measurement, tags), histogram in sorted(self.fleet.histograms.items()):
+            name = measurement
+            if len(tags) > 0:
+                name += " " + ",".join(f"{k}={v}" for k, v in tags)
+            lines.append(
+                "{:<40} {:>10} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    name,
+                    histogram.count,
+                    histogram.percentile(0.5),
+                    histogram.percentile(0.99),
+                    histogram.percentile(0.999),
+                    histogram.max,
+                )
+            )
+        return "\n".join(lines)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.rotate()
+
+
+@memoize
+def _get_histogram_aggregator() -> HistogramAggregator:
+    histograms_config = _get_histograms_config()
+    return HistogramAggregator(
+        precision=histograms_config.get("precision", 0.01),
+        interval=histograms_config.get("interval", 10.0),
+    )
+
+
+_environment = None
+
+
+def _get_runner():
+    return getattr(_environment, "runner", None)
+
+
+@events.init.add_listener
+def _on_init(environment, **kwargs):
+    global _environment
+    _environment = environment
+
+
+@events.report_to_master.add_listener
+def _on_report_to_master(client_id, data, **kwargs):
+    if metrics_enabled() and histograms_enabled():
+        unreported = _get_histogram_aggregator().take_unreported()
+        if len(unreported) > 0:
+            data["latency_histograms"] = unreported.to_list()
+
+
+@events.worker_report.add_listener
+def _on_worker_report(client_id, data, **kwargs):
+    histograms = data.get("latency_histograms")
+    if histograms:
+        aggregator = _get_histogram_aggregator()
+        aggregator.fleet.merge(
+            HistogramRegistry.from_list(histograms, aggregator.precision)
+        )
+
+
+@events.test_stop.add_listener
+def _on_test_stop(**kwargs):
+    if metrics_enabled() and histograms_enabled():
+        _get_histogram_aggregator().rotate()
+
+
+@events.quitting.add_listener
+def _on_quitting(**kwargs):
+    if metrics_enabled() and histograms_enabled():
+        aggregator = _get_histogram_aggregator()
+        aggregator.rotate()
+        if not isinstance(_get_runner(), WorkerRunner):
+            _log.info(aggregator.report())
@@ -1,5 +1,9 @@
 import json
+import logging
+import threading
 import time
+import weakref
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
 
 import msgpack
 from enum import IntEnum, Enum
@@ -7,10 +11,13 @@ from datetime import datetime
 
 from infrastructure.config import kafka_config
 from confluent_kafka import Producer
+from locust import events
 
-from infrastructure.util import get_uuid
+from infrastructure.util import get_uuid, memoize
 from infrastructure.relay_util import normalize_event
 
+_log = logging.getLogger(__name__)
+
 
 class Outcome(IntEnum):
     ACCEPTED = 0
@@ -40,15 +47,236 @@ class Topic(Enum):
     Sessions = {"config_name": "sessions", "default": "ingest-sessions"}
 
 
+class ManagedProducer:
+    """
+    A confluent_kafka Producer that:
+
+    * is polled for delivery reports from a background thread
+    * tracks the produced messages (in flight, delivered, failed, dropped) and reports
+      every delivery (with the latency from produce to delivery ack) as a Locust
+      request (request_type "kafka", name = topic) so it shows up in the Locust stats
+    * applies backpressure when the local producer queue is full, it either waits
+      (at most `max_wait` seconds) for the queue to drain or drops the message
+      (`backpressure` is "wait" or "drop"), dropped messages are reported as failed requests
+
+    NOTE: the producer is polled without blocking (poll(0)) since a blocking poll
+    would block all the (gevent) greenlets of the process.
+    """
+
+    def __init__(
+        self,
+        config: Mapping[str, Any],
+        backpressure: str = "wait",
+        max_wait: float = 1.0,
+        poll_interval: float = 0.01,
+    ):
+        if backpressure not in ("wait", "drop"):
+            raise ValueError("Invalid producer backpressure", backpressure)
+        self.producer = Producer(dict(config))
+        self.backpressure = backpressure
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def in_flight(self) -> int:
+        return self.produced - self.delivered - self.failed
+
+    def produce(self, topic: str, value, key=None) -> bool:
+        """
+        Produces a message, returns False if the message was dropped
+        """
+        start = time.monotonic()
+        deadline = None
+
+        def on_delivery(err, msg):
+            self._on_delivery(err, topic, len(value), start)
+
+        while True:
+            try:
+                self.producer.produce(topic, value, key=key, on_delivery=on_delivery)
+                self.produced += 1
+                return True
+            except BufferError as err:
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.max_wait
+                if self.backpressure == "drop" or now >= deadline:
+                    self.dropped += 1
+                    self._report(topic, len(value), (now - start) * 1000, err)
+                    return False
+                # serve the delivery reports (to free the queue) and let the other greenlets run
+                self.producer.poll(0)
+                time.sleep(self.poll_interval)
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """
+        Waits (without blocking other greenlets) until all messages are delivered,
+        returns the number of messages still in the queue (if timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.producer.poll(0)
+            remaining = len(self.producer)
+            if remaining == 0:
+                return 0
+            if deadline is not None and time.monotonic() >= deadline:
+                return remaining
+            time.sleep(self.poll_interval)
+
+    def close(self, timeout: Optional[float] = None):
+        remaining = self.flush(timeout)
+        self._closed.set()
+        _log.info(
+            "Kafka producer closed, produced:%d delivered:%d failed:%d dropped:%d undelivered:%d",
+            self.produced,
+            self.delivered,
+            self.failed,
+            self.dropped,
+            remaining,
+        )
+
+    def _poll_loop(self):
+        while not self._closed.is_set():
+            self.producer.poll(0)
+            time.sleep(self.poll_interval)
+
+    def _on_delivery(self, err, topic, length, start):
+        if err is None:
+            self.delivered += 1
+        else:
+            self.failed += 1
+        self._report(topic, length, (time.monotonic() - start) * 1000, err)
+
+    @staticmethod
+    def _report(topic, length, latency_ms, err):
+        events.request.fire(
+            request_type="kafka",
+            name=topic,
+            response_time=latency_ms,
+            response_length=length,
+            exception=err,
+            context={},
+        )
+
+
+# producers shared by all the users of a process: key -> [producer, reference count]
+_producers = {}
+_producers_lock = threading.Lock()
+
+
+def acquire_producer(
+    config: Mapping[str, Any], backpressure: str = "wait", max_wait: float = 1.0
+) -> ManagedProducer:
+    """
+    Returns the (process wide) producer for the configuration, creating it if needed.
+
+    All the users with the same configuration share one producer (and its broker
+    connections and threads), call `release_producer` when done with it.
+    """
+    key = (
+        tuple(sorted((name, str(value)) for name, value in config.items())),
+        backpressure,
+        max_wait,
+    )
+    with _producers_lock:
+        entry = _producers.get(key)
+        if entry is not None:
+            entry[1] += 1
+            return entry[0]
+
+    # created outside of the lock: a garbage collection during the creation can run
+    # the finalizer of a discarded user (see `KafkaProducerMixin`)
+    producer = ManagedProducer(config, backpressure=backpressure, max_wait=max_wait)
+    with _producers_lock:
+        entry = _producers.get(key)
+        if entry is None:
+            entry = [producer, 0]
+            _producers[key] = entry
+        entry[1] += 1
+        shared = entry[0]
+
+    if shared is not producer:
+        # another user created the producer meanwhile
+        threading.Thread(target=producer.close, daemon=True).start()
+    return shared
+
+
+def release_producer(producer: ManagedProducer, timeout: float = 10.0):
+    """
+    Releases a producer obtained with `acquire_producer`, the last release
+    flushes and closes the producer (in the background)
+    """
+    with _producers_lock:
+        for key, entry in _producers.items():
+            if entry[0] is producer:
+                entry[1] -= 1
+                if entry[1] > 0:
+                    return
+                del _producers[key]
+                break
+        else:
+            return  # not a registered producer (or already closed)
+
+    # may be called from a finalizer, don't wait for the flush here
+    threading.Thread(target=producer.close, args=(timeout,), daemon=True).start()
+
+
+def _release_later(producer: ManagedProducer):
+    # called by the garbage collector, possibly while `_producers_lock` is held by the
+    # same thread (greenlet), release the producer from another thread (greenlet)
+    threading.Thread(target=release_producer, args=(producer,), daemon=True).start()
+
+
+@events.quitting.add_listener
+def _close_producers(**kwargs):
+    with _producers_lock:
+        producers = [producer for producer, _ in _producers.values()]
+        _producers.clear()
+    for producer in producers:
+        producer.close(timeout=10.0)
+
+
 class KafkaProducerMixin:
     """
     A mixin to be used by Locusts that need to send kafka messages
+
+    All the users (in a process) with the same producer configuration share one producer.
+
+    The producer is configured from the kafka.broker settings (locust.config.yml)
+    which can be extended/overridden per user with a `producer` section in the user
+    configuration, e.g.:
+
+    users:
+      Events:
+        producer:
+          config:  # librdkafka settings
+            linger.ms: 5
+          backpressure: wait  # or drop
+          max_wait: 1.0
     """
 
     def __init__(self):
         self.config = kafka_config()
-        broker_config = self.config.get("broker", {})
-        self.producer = Producer(broker_config)
+        get_params = getattr(self, "get_params", None)
+        producer_params = (get_params() if get_params else {}).get("producer") or {}
+        broker_config = {
+            **self.config.get("broker", {}),
+            **(producer_params.get("config") or {}),
+        }
+        self.producer = acquire_producer(
+            broker_config,
+            backpressure=producer_params.get("backpressure", "wait"),
+            max_wait=producer_params.get("max_wait", 1.0),
+        )
+        # give the producer back when the user is discarded
+        weakref.finalize(self, _release_later, self.producer)
 
     def topic_name(self, topic: Topic):
         topics = self.config.get("topics", {})
@@ -75,6 +303,64 @@ def kafka_send_outcome(
     key_id=None,
     remote_addr=None,
 ):
+    message = encode_outcome(
+        project_id,
+        outcome,
+        event_id=event_id,
+        org_id=org_id,
+        reason=reason,
+        key_id=key_id,
+        remote_addr=remote_addr,
+    )
+
+    kafka_mixin = _get_producer_mixin(task_set)
+    kafka_mixin.producer.produce(kafka_mixin.topic_name(Topic.Outcomes), message)
+
+
+def kafka_send_outcomes(task_set, outcomes: Iterable[Tuple[Any, Outcome, Any]]):
+    """
+    Sends a batch of outcomes, `outcomes` contains (project_id, outcome, event_id) tuples
+    (the reason of each outcome is the default reason for the outcome type)
+    """
+    kafka_mixin = _get_producer_mixin(task_set)
+    produce = kafka_mixin.producer.produce
+    topic_name = kafka_mixin.topic_name(Topic.Outcomes)
+    for project_id, outcome, event_id in outcomes:
+        produce(
+            topic_name,
+            encode_outcome(project_id, outcome, event_id, reason=outcome.reason()),
+        )
+
+
+def encode_outcome(
+    project_id,
+    outcome: Outcome,
+    event_id=None,
+    org_id=None,
+    reason=None,
+    key_id=None,
+    remote_addr=None,
+) -> bytes:
+    """
+    Encodes an outcome message (JSON).
+
+    The common case (no org_id, key_id or remote_addr) is assembled from a pre-encoded
+    fragment per (project_id, outcome, reason) and a timestamp cached per second.
+
+    >>> json.loads(encode_outcome(1, Outcome.FILTERED, "abc", reason="filtered"))["reason"]
+    'filtered'
+    """
+    if org_id is None and key_id is None and remote_addr is None:
+        if event_id is None:
+            event_id = b"null"
+        else:
+            event_id = b'"%s"' % event_id.encode()
+        return b'%s,"timestamp":%s,"event_id":%s}' % (
+            _outcome_prefix(project_id, outcome, reason),
+            _outcome_timestamp(),
+            event_id,
+        )
+
     message = {
         "project_id": project_id,
         "timestamp": datetime.utcnow().isoformat(),
@@ -82,9 +368,6 @@ def kafka_send_outcome(
         "event_id": event_id,
     }
 
-    if event_id is not None:
-        message["event_id"] = event_id
-
     if org_id is not None:
         message["org_id"] = org_id
 
@@ -97,20 +380,74 @@ def kafka_send_outcome(
     if remote_addr is not None:
         message["remote_addr"] = remote_addr
 
+    return json.dumps(message).encode()
+
+
+@memoize(maxsize=100000)
+def _outcome_prefix(project_id, outcome: Outcome, reason) -> bytes:
+    """
+    The start of an outcome message (without the closing brace)
+    """
+    fragment = {"project_id": project_id, "outcome": int(outcome)}
+    if reason is not None:
+        fragment["reason"] = reason
+    return json.dumps(fragment, separators=(",", ":"))[:-1].encode()
+
+
+# (second, encoded timestamp)
+_timestamp_cache = (None, None)
+
+
+def _outcome_timestamp() -> bytes:
+    global _timestamp_cache
+    now = int(time.time())
+    second, timestamp = _timestamp_cache
+    if second != now:
+        timestamp = b'"%s"' % datetime.utcfromtimestamp(now).isoformat().encode()
+        _timestamp_cache = (now, timestamp)
+    return timestamp
+
+
+def kafka_send_event(task_set, event, project_id, remote_addr=None, normalize=True):
+    """
+    Sends the event to the events topic.
+
+    Events must be normalized before being sent, pass `normalize=False` only for events
+    that are already normalized (e.g. with `refresh_normalized_event`).
+
+    Returns the size of the message.
+    """
+    _event_id, value = encode_event(event, project_id, remote_addr, normalize)
+    kafka_send_encoded_event(task_set, value)
+    return len(value)
+
+
+def kafka_send_encoded_event(task_set, value: bytes):
+    """
+    Sends an event encoded with `encode_event` to the events topic
+    """
     kafka_mixin = _get_producer_mixin(task_set)
-    kafka_mixin.producer.produce(
-        kafka_mixin.topic_name(Topic.Outcomes), json.dumps(message)
-    )
+    kafka_mixin.producer.produce(kafka_mixin.topic_name(Topic.Events), value)
 
 
-def kafka_send_event(task_set, event, project_id, remote_addr=None):
+def encode_event(
+    event, project_id, remote_addr=None, normalize=True, attachments=()
+) -> Tuple[str, bytes]:
+    """
+    Returns the event id and the message (as sent to the events, transactions or
+    attachments topic) for the event.
+
+    `attachments` are the descriptions (see `chunked_attachment`) of the attachments
+    sent (as chunks) before the event.
+    """
     event_id = event.get("event_id")
     if event_id is None:
         event_id = get_uuid()
         event["event_id"] = event_id
 
     # kafka events should be normalized prior to sending them
-    event = normalize_event(event, project_id)
+    if normalize:
+        event = normalize_event(event, project_id)
 
     wrapped_event = {
         "type": "event",
@@ -118,15 +455,168 @@ def kafka_send_event(task_set, event, project_id, remote_addr=None):
         "start_time": time.time(),
         "event_id": event_id,
         "project_id": int(project_id),
-        "attachments": [],
+        "attachments": list(attachments),
     }
 
     if remote_addr is not None:
         wrapped_event["remote_addr"] = remote_addr
 
+    return event_id, msgpack.packb(wrapped_event)
+
+
+def kafka_send_transaction(task_set, transaction, project_id, normalize=True):
+    """
+    Sends the transaction to the transactions topic (transactions are sent in the same
+    format as events), returns the size of the message
+    """
+    _event_id, value = encode_event(transaction, project_id, normalize=normalize)
+    kafka_mixin = _get_producer_mixin(task_set)
+    kafka_mixin.producer.produce(kafka_mixin.topic_name(Topic.Transactions), value)
+    return len(value)
+
+
+def kafka_send_session(task_set, session: Mapping[str, Any]):
+    """
+    Sends a session update (as produced by relay, see `session_message`)
+    to the sessions topic
+    """
+    kafka_mixin = _get_producer_mixin(task_set)
+    kafka_mixin.producer.produce(
+        kafka_mixin.topic_name(Topic.Sessions),
+        json.dumps(session, separators=(",", ":")).encode(),
+    )
+
+
+def session_message(
+    project_id,
+    session_id,
+    distinct_id,
+    status,
+    started,
+    release,
+    environment=None,
+    duration=None,
+    errors=0,
+    seq=0,
+    org_id=1,
+    retention_days=90,
+    quantity=1,
+    sdk=None,
+) -> Dict[str, Any]:
+    """
+    Creates a session message in the format expected by the sessions consumer,
+    `started` is a unix timestamp, `session_id` and `distinct_id` are UUID strings
+    """
+    return {
+        "org_id": org_id,
+        "project_id": int(project_id),
+        "session_id": session_id,
+        "distinct_id": distinct_id,
+        "quantity": quantity,
+        "seq": seq,
+        "received": time.time(),
+        "started": started,
+        "duration": duration,
+        "status": status,
+        "errors": errors,
+        "release": release,
+        "environment": environment,
+        "sdk": sdk,
+        "retention_days": retention_days,
+    }
+
+
+def chunked_attachment(
+    attachment_id,
+    name,
+    size,
+    chunks,
+    content_type="application/octet-stream",
+    attachment_type="event.attachment",
+) -> Dict[str, Any]:
+    """
+    The description of an attachment sent in `chunks` chunks (see `kafka_send_attachment`)
+    """
+    return {
+        "id": attachment_id,
+        "name": name,
+        "content_type": content_type,
+        "attachment_type": attachment_type,
+        "chunks": chunks,
+        "size": size,
+        "rate_limited": False,
+    }
+
+
+def kafka_send_attachment(
+    task_set,
+    project_id,
+    event_id,
+    name,
+    data: bytes,
+    chunk_size: int,
+    content_type="application/octet-stream",
+    standalone=True,
+) -> Dict[str, Any]:
+    """
+    Sends the attachment data, in chunks of (at most) `chunk_size` bytes, to the
+    attachments topic and returns the description of the attachment.
+
+    A `standalone` attachment is followed by an attachment message, otherwise the
+    returned description should be sent with the event (see `kafka_send_event_with_attachments`).
+
+    All the messages of an event are keyed by the event id (so that they end up,
+    in order, in the same partition).
+    """
+    kafka_mixin = _get_producer_mixin(task_set)
+    produce = kafka_mixin.producer.produce
+    topic_name = kafka_mixin.topic_name(Topic.Attachments)
+    project_id = int(project_id)
+    attachment_id = get_uuid()
+
+    # an empty attachment is sent as one empty chunk
+    offsets = range(0, max(len(data), 1), chunk_size)
+    for chunk_index, offset in enumerate(offsets):
+        chunk = {
+            "type": "attachment_chunk",
+            "payload": data[offset : offset + chunk_size],
+            "event_id": event_id,
+            "project_id": project_id,
+            "id": attachment_id,
+            "chunk_index": chunk_index,
+        }
+        # the payload must be packed as binary (not as a string)
+        produce(topic_name, msgpack.packb(chunk, use_bin_type=True), key=event_id)
+
+    attachment = chunked_attachment(
+        attachment_id, name, len(data), len(offsets), content_type
+    )
+
+    if standalone:
+        message = {
+            "type": "attachment",
+            "event_id": event_id,
+            "project_id": project_id,
+            "attachment": attachment,
+        }
+        produce(topic_name, msgpack.packb(message), key=event_id)
+
+    return attachment
+
+
+def kafka_send_event_with_attachments(
+    task_set, event, project_id, attachments, normalize=True
+):
+    """
+    Sends an event to the attachments topic (events with attachments are sent to the
+    attachments topic, after the chunks of their attachments)
+    """
+    event_id, value = encode_event(
+        event, project_id, normalize=normalize, attachments=attachments
+    )
     kafka_mixin = _get_producer_mixin(task_set)
     kafka_mixin.producer.produce(
-        kafka_mixin.topic_name(Topic.Events), msgpack.packb(wrapped_event)
+        kafka_mixin.topic_name(Topic.Attachments), value, key=event_id
     )
 
 
@@ -0,0 +1,95 @@
+"""
+Sizes of the generated payloads.
+
+The tasks that generate payloads record the size (in bytes) of every payload they send
+with `record_payload_size`, the sizes are aggregated in histograms (one per user class
+and task) and summarized in a report logged at exit.
+
+Workers send their histograms to the master (with the regular worker reports) and the
+master (or the local runner) merges them and logs the report for the whole run.
+"""
+import logging
+
+from locust import events
+from locust.runners import WorkerRunner
+
+from infrastructure.histogram import HistogramRegistry
+
+_log = logging.getLogger(__name__)
+
+_PRECISION = 0.01
+_MEASUREMENT = "payload_size"
+
+# sizes not yet merged in the whole run (workers: not yet sent to the master)
+_current = HistogramRegistry(_PRECISION)
+# sizes for the whole run (only used by the master or the local runner)
+_fleet = HistogramRegistry(_PRECISION)
+_environment = None
+
+
+def record_payload_size(user, task: str, size: int):
+    """
+    Records the size of a payload sent by `task` (the task name) of the user
+    """
+    _current.record(_MEASUREMENT, size, user=user.__class__.__name__, task=task)
+
+
+def _take_current() -> HistogramRegistry:
+    global _current
+    current, _current = _current, HistogramRegistry(_PRECISION)
+    return current
+
+
+def report() -> str:
+    lines = [
+        "Payload sizes (bytes) for the whole run:",
+        "{:<60} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "task", "count", "mean", "p50", "p99", "max"
+        ),
+    ]
+    for (_measurement, tags), histogram in sorted(_fleet.histograms.items()):
+        tags = dict(tags)
+        lines.append(
+            "{:<60} {:>10} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f}".format(
+                f"{tags['user']}.{tags['task']}",
+                histogram.count,
+                histogram.mean(),
+                histogram.percentile(0.5),
+                histogram.percentile(0.99),
+                histogram.max,
+            )
+        )
+    return "\n".join(lines)
+
+
+def _is_worker() -> bool:
+    return isinstance(getattr(_environment, "runner", None), WorkerRunner)
+
+
+@events.init.add_listener
+def _on_init(environment, **kwargs):
+    global _environment
+    _environment = environment
+
+
+@events.report_to_master.add_listener
+def _on_report_to_master(client_id, data, **kwargs):
+    current = _take_current()
+    if len(current) > 0:
+        data["payload_sizes"] = current.to_list()
+
+
+@events.worker_report.add_listener
+def _on_worker_report(client_id, data, **kwargs):
+    sizes = data.get("payload_sizes")
+    if sizes:
+        _fleet.merge(HistogramRegistry.from_list(sizes, _PRECISION))
+
+
+@events.quitting.add_listener
+def _on_quitting(**kwargs):
+    if _is_worker():
+        return
+    _fleet.merge(_take_current())
+    if len(_fleet) > 0:
+        _log.info(report())
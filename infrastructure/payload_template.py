@@ -0,0 +1,112 @@
+"""
+Pre-serialized payloads with fixed width fields that are patched in place on every send.
+
+Serializing a (large) canned event on every request is expensive, a `PayloadTemplate`
+serializes the payload once and on every render only overwrites the bytes of the fields
+that need to change (event_id, timestamp, sent_at).
+"""
+import json
+import time
+from datetime import datetime
+from typing import Any, Callable, Mapping, NamedTuple
+
+from sentry_sdk.envelope import Envelope
+
+from infrastructure.util import get_uuid
+
+
+class VolatileField(NamedTuple):
+    # a string that is serialized into exactly as many bytes as `render()` returns
+    placeholder: str
+    # returns the serialized (JSON) value of the field
+    render: Callable[[], bytes]
+
+
+def _placeholder(name: str, width: int) -> str:
+    # a JSON string token is two chars (the quotes) longer than the string
+    return f"@@{name}".ljust(width - 2, "@")
+
+
+def _render_event_id() -> bytes:
+    return b'"%s"' % get_uuid().encode()
+
+
+def _render_timestamp() -> bytes:
+    # 17 chars, good until year 2286
+    return b"%.6f" % time.time()
+
+
+def _render_sent_at() -> bytes:
+    return b'"%s"' % datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ").encode()
+
+
+EVENT_ID = VolatileField(_placeholder("event_id", 34), _render_event_id)
+TIMESTAMP = VolatileField(_placeholder("timestamp", 17), _render_timestamp)
+SENT_AT = VolatileField(_placeholder("sent_at", 29), _render_sent_at)
+
+
+class PayloadTemplate:
+    """
+    A serialized payload containing placeholders for volatile fields.
+
+    The offsets of the placeholders are computed once, rendering the template
+    overwrites the placeholders in a preallocated buffer with freshly rendered
+    values and returns a copy of the buffer.
+    """
+
+    def __init__(self, payload: bytes, fields: Mapping[str, VolatileField]):
+        self._buffer = bytearray(payload)
+        self._fields = []
+
+        for name, field in fields.items():
+            placeholder = json.dumps(field.placeholder).encode()
+            offsets = []
+            offset = payload.find(placeholder)
+            while offset != -1:
+                offsets.append(offset)
+                offset = payload.find(placeholder, offset + len(placeholder))
+            if len(offsets) == 0:
+                raise ValueError("Field not found in payload template", name)
+            self._fields.append((field.render, len(placeholder), tuple(offsets)))
+
+    def render(self) -> bytes:
+        buffer = self._buffer
+        for render, width, offsets in self._fields:
+            value = render()
+            if len(value) != width:
+                raise ValueError("Invalid rendered field width", value)
+            for offset in offsets:
+                buffer[offset : offset + width] = value
+        return bytes(buffer)
+
+
+def event_template(event: Mapping[str, Any]) -> PayloadTemplate:
+    """
+    Creates a template for sending the event to the store endpoint
+    """
+    event = {
+        **event,
+        "event_id": EVENT_ID.placeholder,
+        "timestamp": TIMESTAMP.placeholder,
+    }
+    payload = json.dumps(event).encode()
+    return PayloadTemplate(payload, {"event_id": EVENT_ID, "timestamp": TIMESTAMP})
+
+
+def envelope_event_template(event: Mapping[str, Any]) -> PayloadTemplate:
+    """
+    Creates a template for sending the event, in an envelope, to the envelope endpoint
+    """
+    event = {
+        **event,
+        "event_id": EVENT_ID.placeholder,
+        "timestamp": TIMESTAMP.placeholder,
+    }
+    envelope = Envelope(
+        headers={"event_id": EVENT_ID.placeholder, "sent_at": SENT_AT.placeholder}
+    )
+    envelope.add_event(event)
+    return PayloadTemplate(
+        envelope.serialize(),
+        {"event_id": EVENT_ID, "timestamp": TIMESTAMP, "sent_at": SENT_AT},
+    )
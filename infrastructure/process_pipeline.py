@@ -0,0 +1,128 @@
+"""
+Generates payloads in separate processes.
+
+Locust users run as greenlets in a single process, a CPU bound task (e.g. generating and
+normalizing an event) blocks all the other users of the worker. A `ProcessPipeline` moves
+that work into a pool of worker processes which continuously fill a bounded queue with
+ready to send payloads, the users only take payloads from the queue.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Sequence
+
+from locust import events
+
+_log = logging.getLogger(__name__)
+
+
+class ProcessPipeline:
+    """
+    Calls `produce_batch()` in a pool of `processes` worker processes and buffers the
+    produced items (at most `queue_size` of them, the workers wait while the queue is full).
+
+    `produce_batch` (and `initializer`) are called in the worker processes so they (and
+    `initargs`) must be picklable, i.e. module level functions.
+
+    Items are returned in the order the batches are completed (not submitted).
+    """
+
+    def __init__(
+        self,
+        produce_batch: Callable[[], List[Any]],
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Sequence[Any] = (),
+        processes: Optional[int] = None,
+        queue_size: int = 10000,
+        batch_size: int = 100,
+        start_method: str = "spawn",
+    ):
+        if processes is None or processes <= 0:
+            processes = os.cpu_count() or 1
+        self.processes = processes
+        self._produce_batch = produce_batch
+        # the queue holds batches, `batch_size` is only used to size it
+        self._batches = queue.Queue(maxsize=max(1, queue_size // max(1, batch_size)))
+        self._current = deque()
+        self._stopped = False
+        self.produced = 0
+        self.failed = 0
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            # NOTE: forking a process with running (kafka, gevent) threads is not safe
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=initializer,
+            initargs=tuple(initargs),
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="process-pipeline", daemon=True
+        )
+        self._thread.start()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Returns the next item, waits (at most `timeout` seconds) for the workers
+        if there is no item ready (raises queue.Empty on timeout)
+        """
+        if not self._current:
+            self._current.extend(self._batches.get(timeout=timeout))
+        return self._current.popleft()
+
+    def close(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._executor.shutdown(wait=False)
+        _log.info(
+            "Process pipeline closed: produced=%d failed=%d", self.produced, self.failed
+        )
+
+    def _run(self):
+        # keep all workers busy while a completed batch is waiting to be queued
+        in_flight = {
+            self._executor.submit(self._produce_batch)
+            for _ in range(2 * self.processes)
+        }
+        while in_flight and not self._stopped:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    batch = future.result()
+                except BrokenProcessPool:
+                    _log.exception("Process pipeline workers died, stopping")
+                    self._stopped = True
+                    return
+                except Exception:
+                    _log.exception("Process pipeline batch failed")
+                    self.failed += 1
+                else:
+                    if not self._put(batch):
+                        return
+                    self.produced += len(batch)
+
+                if not self._stopped:
+                    in_flight.add(self._executor.submit(self._produce_batch))
+
+    def _put(self, batch) -> bool:
+        while not self._stopped:
+            try:
+                self._batches.put(batch, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+def start_process_pipeline(*args, **kwargs) -> ProcessPipeline:
+    """
+    Creates a `ProcessPipeline` that is closed when locust quits
+    """
+    pipeline = ProcessPipeline(*args, **kwargs)
+    events.quitting.add_listener(lambda **_kwargs: pipeline.close())
+    return pipeline
@@ -1,46 +1,129 @@
+import json
+
 from sentry_relay.processing import StoreNormalizer
 
+from infrastructure.config import ProjectInfo, make_project_info
 from infrastructure.influxdb_metric_sink import timed_operation
-from infrastructure.util import _auth_header
+from infrastructure.util import memoize
 
 
-def send_message(client, project_id, project_key, msg_body, headers=None):
-    url = "/api/{}/store/".format(project_id)
-    headers = {
-        "X-Sentry-Auth": _auth_header(project_key),
-        "Content-Type": "application/json; charset=UTF-8",
-        **(headers or {}),
-    }
-    return client.post(url, headers=headers, json=msg_body)
+class RelayEndpoint:
+    """
+    The urls and headers used to send requests for one project.
 
+    Built once per project (from the urls and auth header precomputed in the
+    `ProjectInfo`) and reused for all requests.
+    """
 
-def send_envelope(client, project_id, project_key, envelope, headers=None):
-    url = "/api/{}/envelope/".format(project_id)
+    __slots__ = (
+        "project_id",
+        "store_url",
+        "envelope_url",
+        "store_headers",
+        "envelope_headers",
+        "session_headers",
+    )
+
+    def __init__(self, project_info: ProjectInfo):
+        if project_info.auth_header is None:
+            project_info = make_project_info(project_info.id, project_info.key)
 
-    headers = {
-        "X-Sentry-Auth": _auth_header(project_key),
-        "Content-Type": "application/x-sentry-envelope",
-        **(headers or {}),
+        self.project_id = project_info.id
+        self.store_url = project_info.store_url
+        self.envelope_url = project_info.envelope_url
+        self.store_headers = _headers(
+            project_info.auth_header, "application/json; charset=UTF-8"
+        )
+        self.envelope_headers = _headers(
+            project_info.auth_header, "application/x-sentry-envelope"
+        )
+        self.session_headers = _headers(
+            project_info.auth_header, "text/plain; charset=UTF-8"
+        )
+
+    def send_message(self, client, msg_body, headers=None):
+        """
+        Sends an event to the store endpoint, `msg_body` is either the event or
+        the already serialized event (bytes)
+        """
+        if not isinstance(msg_body, bytes):
+            msg_body = json.dumps(msg_body)
+        return client.post(
+            self.store_url,
+            headers=_merge_headers(self.store_headers, headers),
+            data=msg_body,
+        )
+
+    def send_envelope(self, client, envelope, headers=None):
+        """
+        Sends an envelope to the envelope endpoint, `envelope` is either an Envelope
+        or an already serialized envelope (bytes)
+        """
+        if isinstance(envelope, bytes):
+            data = envelope
+        else:
+            data = envelope.serialize()
+        return client.post(
+            self.envelope_url,
+            headers=_merge_headers(self.envelope_headers, headers),
+            data=data,
+        )
+
+    def send_session(self, client, session_data, headers=None):
+        with timed_operation("session_request"):
+            return client.post(
+                self.envelope_url,
+                headers=_merge_headers(self.session_headers, headers),
+                data=session_data,
+            )
+
+
+def _headers(auth_header, content_type):
+    return {
+        "X-Sentry-Auth": auth_header,
+        "Content-Type": content_type,
+        # set here so that the http client doesn't need to add it
+        "Accept-Encoding": "gzip, deflate",
     }
 
-    data = envelope.serialize()
-    return client.post(url, headers=headers, data=data)
+
+def _merge_headers(endpoint_headers, headers):
+    # the endpoint headers are passed as is (the http client only adds the
+    # Authorization header of its host url, the same for all the requests)
+    if not headers:
+        return endpoint_headers
+    return {**endpoint_headers, **headers}
+
+
+@memoize(maxsize=100000)
+def get_endpoint(project_info: ProjectInfo) -> RelayEndpoint:
+    """
+    Returns the endpoint of a project (the ProjectInfo chosen by the user), e.g.
+    `get_endpoint(project_info).send_envelope(client, envelope)`
+    """
+    return RelayEndpoint(project_info)
+
+
+def send_message(client, project_id, project_key, msg_body, headers=None):
+    endpoint = get_endpoint(make_project_info(project_id, project_key))
+    return endpoint.send_message(client, msg_body, headers)
+
+
+def send_envelope(client, project_id, project_key, envelope, headers=None):
+    endpoint = get_endpoint(make_project_info(project_id, project_key))
+    return endpoint.send_envelope(client, envelope, headers)
 
 
 def send_session(client, project_id, project_key, session_data, headers=None):
-    url = "/api/{}/envelope/".format(project_id)
+    endpoint = get_endpoint(make_project_info(project_id, project_key))
+    return endpoint.send_session(client, session_data, headers)
 
-    headers = {
-        "X-Sentry-Auth": _auth_header(project_key),
-        "Content-Type": "text/plain; charset=UTF-8",
-        **(headers or {}),
-    }
-    with timed_operation("session_request"):
-        return client.post(url, headers=headers, data=session_data)
+
+@memoize(maxsize=10000)
+def _get_normalizer(project_id):
+    # normalizers are expensive to create but reusable, keep one per project
+    return StoreNormalizer(project_id=project_id)
 
 
 def normalize_event(event, project_id):
-    normalizer = StoreNormalizer(
-        project_id=project_id,
-    )
-    return normalizer.normalize_event(event)
+    return _get_normalizer(project_id).normalize_event(event)
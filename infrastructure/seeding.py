@@ -0,0 +1,93 @@
+"""
+Reproducible (seeded) load tests.
+
+When `random_seed` is set in `locust.config.yml` every user gets its own random generator
+(`user.rng`) seeded from the run seed, the worker index, the user class and the index of
+the user (in its class, in the worker), so two runs with the same configuration (and the
+same number of workers and users) generate the same payloads, without the users (or
+the workers) sharing random state.
+
+The worker index is read from the LOCUST_WORKER_INDEX environment variable (0 if not set),
+each worker of a distributed run should be started with a different index.
+
+The generators are created per user (see `per_user`) only in seeded runs, otherwise
+all the users of a task share the generators (and the global `random` module).
+"""
+import os
+import random
+import weakref
+from typing import Any, Callable
+
+from infrastructure.config import locust_config
+from infrastructure.ids import seed_ids
+from infrastructure.util import memoize
+
+WORKER_INDEX_ENV = "LOCUST_WORKER_INDEX"
+
+
+@memoize
+def random_seed():
+    """
+    The run seed (None if the run is not seeded)
+    """
+    return locust_config().get("random_seed")
+
+
+def worker_index() -> int:
+    return int(os.environ.get(WORKER_INDEX_ENV, 0))
+
+
+@memoize
+def seed_worker():
+    """
+    Seeds the generators shared by all the users of the worker (the global `random`
+    module and the ids)
+    """
+    seed = random_seed()
+    if seed is None:
+        return
+    worker_seed = f"{seed}/{worker_index()}"
+    random.seed(worker_seed)
+    seed_ids(worker_seed)
+
+
+def user_random(user_class_name: str, user_index: int):
+    """
+    Returns the random generator of a user (the `random` module if the run is not seeded)
+    """
+    seed = random_seed()
+    if seed is None:
+        return random
+    # str seeds are hashed with sha512, they don't depend on PYTHONHASHSEED
+    return random.Random(f"{seed}/{worker_index()}/{user_class_name}/{user_index}")
+
+
+def get_random(user):
+    """
+    Returns the random generator of the user
+    """
+    return getattr(user, "rng", random)
+
+
+def per_user(factory: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """
+    Returns a function that maps a user to `factory(rng)`, called (once per user)
+    with the random generator of the user.
+
+    In runs that are not seeded the factory is called only once (with the `random`
+    module) and its result is shared by all the users.
+    """
+    if random_seed() is None:
+        shared = factory(random)
+        return lambda user: shared
+
+    values = weakref.WeakKeyDictionary()
+
+    def inner(user):
+        value = values.get(user)
+        if value is None:
+            value = factory(get_random(user))
+            values[user] = value
+        return value
+
+    return inner
@@ -1,11 +1,13 @@
 import functools
 import os
+import random
 import re
 
 from datetime import timedelta
 from importlib import import_module
-from typing import Optional
-from uuid import uuid4
+from typing import Any, Optional, Sequence
+
+from infrastructure.ids import new_uuid
 
 
 def full_path_from_module_relative_path(module_name, *args):
@@ -17,24 +19,101 @@ def _auth_header(project_key):
     return "Sentry sentry_key={},sentry_version=7".format(project_key)
 
 
-def get_uuid() -> hex:
-    return uuid4().hex
+def get_uuid() -> str:
+    return new_uuid()
+
+
+_memoized_functions = []
 
 
-def memoize(f):
-    memo = {}
+def memoize(f=None, *, maxsize: Optional[int] = None):
+    """
+    Caches the results of a function by its (hashable) arguments.
+
+    Can be used as `@memoize` (unbounded cache) or as `@memoize(maxsize=N)`
+    (at most N results are kept, the least recently used results are evicted first).
 
-    @functools.wraps(f)
-    def wrapper(*args):
-        key_pattern = "{}_" * len(args)
-        key = key_pattern.format(*args)
-        if key not in memo:
-            memo[key] = f(*args)
-        return memo[key]
+    Arguments are compared by value and type (`f(1)` and `f(1.0)` are cached separately).
+    Zero argument functions (and unbounded caches) skip the LRU bookkeeping.
 
+    The cache statistics (hits, misses, size) are available via `f.cache_info()`
+    (see also `memoize_info()`) and the cache can be reset with `f.cache_clear()`.
+
+    >>> @memoize(maxsize=2)
+    ... def square(x):
+    ...     return x * x
+    >>> square(2), square(2), square(3)
+    (4, 4, 9)
+    >>> square.cache_info()
+    CacheInfo(hits=1, misses=2, maxsize=2, currsize=2)
+    """
+    if f is None:
+        return functools.partial(memoize, maxsize=maxsize)
+
+    wrapper = functools.lru_cache(maxsize=maxsize, typed=True)(f)
+    _memoized_functions.append(wrapper)
     return wrapper
 
 
+def memoize_info():
+    """
+    Returns the cache statistics of all memoized functions (for diagnostics)
+    """
+    return {
+        f"{f.__module__}.{f.__qualname__}": f.cache_info() for f in _memoized_functions
+    }
+
+
+class AliasSampler:
+    """
+    Samples items with given (relative) weights in O(1) per sample
+    (Walker's alias method, the tables are built once in O(n)).
+
+    >>> sampler = AliasSampler(["a", "b"], [0, 1])
+    >>> sampler.choose()
+    'b'
+    """
+
+    def __init__(self, items: Sequence[Any], weights: Optional[Sequence[float]] = None):
+        if len(items) == 0:
+            raise ValueError("AliasSampler needs at least one item")
+        if weights is None:
+            weights = [1] * len(items)
+        if len(weights) != len(items):
+            raise ValueError("AliasSampler items and weights lengths differ")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("AliasSampler needs at least one positive weight")
+
+        n = len(items)
+        self.items = list(items)
+        self._n = n
+        prob = [w * n / total for w in weights]
+        alias = list(range(n))
+        small = [idx for idx, p in enumerate(prob) if p < 1]
+        large = [idx for idx, p in enumerate(prob) if p >= 1]
+        while small and large:
+            small_idx = small.pop()
+            large_idx = large.pop()
+            alias[small_idx] = large_idx
+            prob[large_idx] = prob[large_idx] + prob[small_idx] - 1
+            if prob[large_idx] < 1:
+                small.append(large_idx)
+            else:
+                large.append(large_idx)
+        # whatever is left is (within rounding errors) 1
+        for idx in small + large:
+            prob[idx] = 1
+        self._prob = prob
+        self._alias = alias
+
+    def choose(self, rng=random):
+        idx = int(rng.random() * self._n)
+        if rng.random() < self._prob[idx]:
+            return self.items[idx]
+        return self.items[self._alias[idx]]
+
+
 def get_at_path(obj, path, default=None):
     """
     >>> x= {'a': {'b': {'c': 1, 'd': {'x': 1}, 'e': [1, 2, 3], 'f': 'hello'}}}
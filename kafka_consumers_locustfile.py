@@ -13,6 +13,9 @@ from tasks.kafka_tasks import (
     kafka_random_outcome_task,
     kafka_configurable_outcome_task_factory,
     random_kafka_event_task_factory,
+    kafka_transaction_task_factory,
+    kafka_session_task_factory,
+    kafka_attachment_task_factory,
 )
 
 accepted_outcome = kafka_outcome_task(Outcome.ACCEPTED)
@@ -20,6 +23,9 @@ rate_limited_outcome = kafka_outcome_task(Outcome.RATE_LIMITED)
 random_outcome = kafka_random_outcome_task
 kafka_configurable_outcome_factory = kafka_configurable_outcome_task_factory
 random_kafka_event_task_factory = random_kafka_event_task_factory
+kafka_transaction_task_factory = kafka_transaction_task_factory
+kafka_session_task_factory = kafka_session_task_factory
+kafka_attachment_task_factory = kafka_attachment_task_factory
 
 _config_path = full_path_from_module_relative_path(
     __file__, "config/kafka_consumers.test.yml"
@@ -30,3 +36,12 @@ Outcomes = create_user_class(
 Events = create_user_class(
     "Events", _config_path, __name__, base_classes=(User, KafkaProducerMixin)
 )
+Transactions = create_user_class(
+    "Transactions", _config_path, __name__, base_classes=(User, KafkaProducerMixin)
+)
+Sessions = create_user_class(
+    "Sessions", _config_path, __name__, base_classes=(User, KafkaProducerMixin)
+)
+Attachments = create_user_class(
+    "Attachments", _config_path, __name__, base_classes=(User, KafkaProducerMixin)
+)
@@ -7,7 +7,7 @@ resource.setrlimit(resource.RLIMIT_NOFILE, (new_limit, new_limit))
 
 ###
 from infrastructure import full_path_from_module_relative_path, create_user_class
-from tasks import event_tasks
+from tasks import event_tasks, replay_tasks
 
 
 # do NOT just import the functions in the module (you will get a warning that the function is not used,
@@ -18,8 +18,10 @@ file_event_task_factory = event_tasks.file_event_task_factory
 file_envelope_event_task_factory = event_tasks.file_envelope_event_task_factory
 session_event_task_factory = event_tasks.session_event_task_factory
 transaction_event_task_factory = event_tasks.transaction_event_task_factory
+replay_task_factory = replay_tasks.replay_task_factory
 
 _config_path = full_path_from_module_relative_path(__file__, "config/simple.test.yml")
 SimpleLoadTest = create_user_class("SimpleLoadTest", _config_path, __name__)
 RandomEvents = create_user_class("RandomEvents", _config_path, __name__)
 TransactionEvents = create_user_class("TransactionEvents", _config_path, __name__)
+ReplayTraffic = create_user_class("ReplayTraffic", _config_path, __name__)
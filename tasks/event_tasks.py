@@ -11,9 +11,8 @@ from typing import Tuple, Callable, Any, Mapping, Optional, Sequence
 from sentry_sdk.envelope import Envelope
 
 from infrastructure import (
-    send_message,
-    send_envelope,
-    send_session,
+    get_endpoint,
+    record_payload_size,
 )
 from infrastructure.configurable_user import get_project_info
 from infrastructure.generators.breadcrumbs import breadcrumb_generator
@@ -24,21 +23,30 @@ from infrastructure.generators.contexts import (
     trace_context_generator,
 )
 from infrastructure.generators.event import base_event_generator
+from infrastructure.generators.size import payload_sizer
+from infrastructure.generators.pool import event_pool_generator, refresh_transaction
 from infrastructure.generators.transaction import (
     create_spans,
     measurements_generator,
     span_op_generator,
+    span_status_generator,
 )
 from infrastructure.generators.user import user_generator
+from infrastructure.file_payload import load_file_payload
+from infrastructure.payload_template import event_template, envelope_event_template
+from infrastructure.seeding import get_random, per_user
 from infrastructure.generators.util import schema_generator
-from infrastructure.util import parse_timedelta
+from infrastructure.util import get_uuid, parse_timedelta
 
 
 def file_event_task_factory(task_params=None):
     filename = task_params.pop("filename")
+    use_template = task_params.pop("payload_template", False)
 
-    with open(filename) as f:
-        event = json.load(f)
+    payload = load_file_payload(filename)
+
+    if use_template:
+        template = event_template(payload.json())
 
     def inner(user):
         """
@@ -47,23 +55,34 @@ def file_event_task_factory(task_params=None):
         """
         project_info = get_project_info(user)
 
-        return send_message(user.client, project_info.id, project_info.key, event)
+        if use_template:
+            body = template.render()
+        else:
+            body = payload.body
+        return get_endpoint(project_info).send_message(user.client, body)
 
     return inner
 
 
 def file_envelope_event_task_factory(task_params=None):
     filename = task_params.pop("filename")
+    use_template = task_params.pop("payload_template", False)
+
+    payload = load_file_payload(filename)
 
-    with open(filename) as f:
-        event = json.load(f)
+    if use_template:
+        template = envelope_event_template(payload.json())
+    else:
+        envelope_body = payload.envelope_body()
 
     def inner(user):
         project_info = get_project_info(user)
 
-        envelope = Envelope()
-        envelope.add_event(event)
-        return send_envelope(user.client, project_info.id, project_info.key, envelope)
+        if use_template:
+            envelope = template.render()
+        else:
+            envelope = envelope_body
+        return get_endpoint(project_info).send_envelope(user.client, envelope)
 
     return inner
 
@@ -138,6 +157,62 @@ def _convert_params(
     return ret_val
 
 
+def random_session(params, rng=random) -> Mapping[str, Any]:
+    """
+    Generates the attributes of a random session update (`params` are the converted
+    parameters returned by `get_session_event_params`)
+    """
+    # get maximum deviation in seconds of duration
+    max_duration_deviation = int(params["duration_range"].total_seconds())
+    # get maximum deviation in seconds of start time
+    max_start_deviation = int(params["started_range"].total_seconds())
+    now = datetime.utcnow()
+    # set the base in the past enough for max_start_spread + max_duration_spread to end up before now
+    base_start = now - timedelta(seconds=max_start_deviation + max_duration_deviation)
+    started = base_start + timedelta(seconds=rng.randint(0, max_start_deviation))
+    duration = rng.randint(0, max_duration_deviation)
+    rel = rng.randint(1, params["num_releases"])
+    env = rng.randint(1, params["num_environments"])
+
+    ok = params["ok_weight"]
+    exited = params["exited_weight"]
+    errored = params["errored_weight"]
+    crashed = params["crashed_weight"]
+    abnormal = params["abnormal_weight"]
+    status = rng.choices(
+        ["ok", "exited", "errored", "crashed", "abnormal"],
+        weights=[ok, exited, errored, crashed, abnormal],
+    )[0]
+
+    if status == "ok":
+        init = True
+        seq = 0
+    else:
+        init = False
+        seq = rng.randint(1, 5)
+
+    if status == "errored":
+        errors = rng.randint(1, 20)
+    else:
+        errors = 0
+
+    usr = rng.randint(1, params["num_users"])
+
+    return {
+        "timestamp": now,
+        "started": started,
+        "init": init,
+        "status": status,
+        "errors": errors,
+        "duration": duration,
+        "session_id": uuid.UUID(get_uuid()),
+        "user_id": f"u-{usr}",
+        "seq": seq,
+        "release": f"r-1.0.{rel}",
+        "environment": f"environment-{env}",
+    }
+
+
 def session_event_task_factory(task_params=None):
     params = get_session_event_params(task_params)
 
@@ -151,85 +226,56 @@ def session_event_task_factory(task_params=None):
 
     def inner(user):
         project_info = get_project_info(user)
-        # get maximum deviation in seconds of duration
-        max_duration_deviation = int(params["duration_range"].total_seconds())
-        # get maximum deviation in seconds of start time
-        max_start_deviation = int(params["started_range"].total_seconds())
-        now = datetime.utcnow()
-        # set the base in the past enough for max_start_spread + max_duration_spread to end up before now
-        base_start = now - timedelta(
-            seconds=max_start_deviation + max_duration_deviation
-        )
-        started_time = base_start + timedelta(
-            seconds=random.randint(0, max_start_deviation)
-        )
-        duration = random.randint(0, max_duration_deviation)
-        started = started_time.isoformat()[:23] + "Z"  # date with milliseconds
-        timestamp = now.isoformat()[:23] + "Z"
-        rel = random.randint(1, params["num_releases"])
-        release = f"r-1.0.{rel}"
-        env = random.randint(1, params["num_environments"])
-        environment = f"environment-{env}"
-
-        ok = params["ok_weight"]
-        exited = params["exited_weight"]
-        errored = params["errored_weight"]
-        crashed = params["crashed_weight"]
-        abnormal = params["abnormal_weight"]
-        status = random.choices(
-            ["ok", "exited", "errored", "crashed", "abnormal"],
-            weights=[ok, exited, errored, crashed, abnormal],
-        )[0]
-
-        if status == "ok":
-            init = "true"
-            seq = 0
-        else:
-            init = "false"
-            seq = random.randint(1, 5)
-
-        if status == "errored":
-            errors = random.randint(1, 20)
-        else:
-            errors = 0
-
-        usr = random.randint(1, params["num_users"])
-        user_id = f"u-{usr}"
-
-        session = uuid.uuid4()
+        session = random_session(params, get_random(user))
 
         session_data = session_data_tmpl.format(
-            started=started,
-            init=init,
-            status=status,
-            errors=errors,
-            duration=duration,
-            session=session,
-            user=user_id,
-            seq=seq,
-            timestamp=timestamp,
-            release=release,
-            environment=environment,
+            started=session["started"].isoformat()[:23] + "Z",  # date with milliseconds
+            init="true" if session["init"] else "false",
+            status=session["status"],
+            errors=session["errors"],
+            duration=session["duration"],
+            session=session["session_id"],
+            user=session["user_id"],
+            seq=session["seq"],
+            timestamp=session["timestamp"].isoformat()[:23] + "Z",
+            release=session["release"],
+            environment=session["environment"],
         )
 
-        return send_session(
-            user.client, project_info.id, project_info.key, session_data
-        )
+        return get_endpoint(project_info).send_session(user.client, session_data)
 
     return inner
 
 
+def get_event_pool_params(task_params):
+    params_converter = {
+        "event_pool_size": (0, lambda x: int(x)),
+        "event_pool_refresh_rate": (0.0, lambda x: float(x)),
+    }
+    params = _convert_params(params_converter, task_params)
+    return {
+        "pool_size": params["event_pool_size"],
+        "refresh_rate": params["event_pool_refresh_rate"],
+    }
+
+
 def random_event_task_factory(task_params=None):
     if task_params is None:
         task_params = {}
 
-    event_generator = base_event_generator(**task_params)
+    pool_params = get_event_pool_params(task_params)
+    event_generators = per_user(
+        lambda rng: event_pool_generator(
+            base_event_generator(rng=rng, **task_params), rng=rng, **pool_params
+        )
+    )
 
     def inner(user):
-        event = event_generator()
+        event = event_generators(user)()
         project_info = get_project_info(user)
-
-        return send_message(user.client, project_info.id, project_info.key, event)
+        body = json.dumps(event).encode()
+        record_payload_size(user, "random_event", len(body))
+        return get_endpoint(project_info).send_message(user.client, body)
 
     return inner
 
@@ -237,29 +283,47 @@ def random_event_task_factory(task_params=None):
 def random_envelope_event_task_factory(task_params=None):
     if task_params is None:
         task_params = {}
-    event_generator = base_event_generator(**task_params)
+
+    pool_params = get_event_pool_params(task_params)
+    event_generators = per_user(
+        lambda rng: event_pool_generator(
+            base_event_generator(rng=rng, **task_params), rng=rng, **pool_params
+        )
+    )
 
     def inner(user):
-        event = event_generator()
+        event = event_generators(user)()
         project_info = get_project_info(user)
         envelope = Envelope()
         envelope.add_event(event)
-        return send_envelope(user.client, project_info.id, project_info.key, envelope)
+        body = envelope.serialize()
+        record_payload_size(user, "random_envelope_event", len(body))
+        return get_endpoint(project_info).send_envelope(user.client, body)
 
     return inner
 
 
 def transaction_event_task_factory(task_params=None):
-    task_params = _get_transaction_event_params(task_params)
-
-    generator = transaction_generator(**task_params)
+    pool_params = get_event_pool_params(task_params or {})
+    task_params = get_transaction_event_params(task_params)
+
+    generators = per_user(
+        lambda rng: event_pool_generator(
+            transaction_generator(rng=rng, **task_params),
+            refresh=refresh_transaction,
+            rng=rng,
+            **pool_params,
+        )
+    )
 
     def inner(user):
-        transaction_data = generator()
+        transaction_data = generators(user)()
         project_info = get_project_info(user)
         envelope = Envelope()
         envelope.add_transaction(transaction_data)
-        return send_envelope(user.client, project_info.id, project_info.key, envelope)
+        body = envelope.serialize()
+        record_payload_size(user, "transaction_event", len(body))
+        return get_endpoint(project_info).send_envelope(user.client, body)
 
     return inner
 
@@ -280,24 +344,36 @@ def transaction_generator(
     breadcrumb_messages,
     measurements: Sequence[str],
     operations: Sequence[str],
+    target_size: Optional[Mapping[str, Any]] = None,
+    rng=random,
     **kwargs,  # additional ignored params
 ):
+    """
+    Creates a random transaction generator.
+
+    If `target_size` is set (e.g. `{"p50": "8KB", "p99": "500KB"}`) the number of spans
+    is chosen so that the (JSON) transaction sizes follow the target distribution
+    (`min_spans`/`max_spans` are ignored).
+    """
+    sizer = payload_sizer(target_size, rng=rng)
+    status_generator = span_status_generator(rng)
     basic_generator = schema_generator(
-        event_id=lambda: uuid.uuid4().hex,
+        rng=rng,
+        event_id=get_uuid,
         release=(
-            lambda: f"release{random.randrange(num_releases)}"
+            lambda: f"release{rng.randrange(num_releases)}"
             if num_releases is not None
             else None
         ),
-        transaction=[None, lambda: f"mytransaction{random.randrange(100)}"],
+        transaction=[None, lambda: f"mytransaction{rng.randrange(100)}"],
         logger=["foo.bar.baz", "bam.baz.bad", None],
         environment=["production", "development", "staging"],
-        user=user_generator(max_users=max_users),
+        user=user_generator(max_users=max_users, rng=rng),
         contexts={
-            "os": [None, os_context_generator()],
-            "device": [None, device_context_generator()],
-            "app": [None, app_context_generator()],
-            "trace": trace_context_generator(operations=operations),
+            "os": [None, os_context_generator(rng)],
+            "device": [None, device_context_generator(rng)],
+            "app": [None, app_context_generator(rng)],
+            "trace": trace_context_generator(operations=operations, rng=rng),
         },
         breadcrumbs=breadcrumb_generator(
             min=min_breadcrumbs,
@@ -306,8 +382,9 @@ def transaction_generator(
             levels=breadcrumb_levels,
             types=breadcrumb_types,
             messages=breadcrumb_messages,
+            rng=rng,
         ),
-        measurements=measurements_generator(measurements=measurements),
+        measurements=measurements_generator(measurements=measurements, rng=rng),
     )
 
     def inner():
@@ -322,35 +399,47 @@ def transaction_generator(
         duration_max_sec = transaction_duration_max.total_seconds()
         range_seconds = duration_max_sec - duration_min_sec
         transaction_duration = timedelta(
-            seconds=range_seconds * random.random() + duration_min_sec
+            seconds=range_seconds * rng.random() + duration_min_sec
         )
         transaction_delta = timedelta(
-            seconds=transaction_timestamp_spread.total_seconds() * random.random()
+            seconds=transaction_timestamp_spread.total_seconds() * rng.random()
         )
 
         timestamp = now - transaction_delta.total_seconds()
         transaction_start = timestamp - transaction_duration.total_seconds()
 
+        if sizer is not None:
+            num_spans = sizer.num_units()
+            span_range = (num_spans, num_spans)
+        else:
+            span_range = (min_spans, max_spans)
+
         spans = create_spans(
-            min_spans=min_spans,
-            max_spans=max_spans,
+            min_spans=span_range[0],
+            max_spans=span_range[1],
             transaction_id=transaction_id,
             trace_id=trace_id,
             transaction_start=transaction_start,
             timestamp=timestamp,
-            operations_generator=span_op_generator(operations),
+            operations_generator=span_op_generator(operations, rng),
+            rng=rng,
+            status_generator=status_generator,
         )
 
-        transaction_data["spans"] = spans
         transaction_data["timestamp"] = timestamp
         transaction_data["start_timestamp"] = transaction_start
 
+        if sizer is not None:
+            # (measured before the spans are added)
+            sizer.observe(transaction_data, "spans", spans)
+        transaction_data["spans"] = spans
+
         return transaction_data
 
     return inner
 
 
-def _get_transaction_event_params(task_params):
+def get_transaction_event_params(task_params):
     if task_params is None:
         task_params = {}
 
@@ -370,5 +459,6 @@ def _get_transaction_event_params(task_params):
         "breadcrumb_messages": (None, None),
         "measurements": ([], None),
         "operations": (["pageload"], None),
+        "target_size": (None, None),
     }
     return _convert_params(params_converter=conv, task_params=task_params)
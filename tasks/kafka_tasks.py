@@ -1,14 +1,51 @@
 """
 Tasks and task helpers to be used to generate kafka events and outcomes
 """
+import functools
+import os
 import time
+import uuid
+from datetime import timezone
 
+from infrastructure.config import create_project_table
 from infrastructure.configurable_user import get_project_info
 from infrastructure.generators.event import base_event_generator
-from infrastructure.kafka import Outcome, kafka_send_outcome, kafka_send_event
+from infrastructure.generators.pool import (
+    event_pool_generator,
+    refresh_event,
+    refresh_normalized_event,
+    refresh_transaction,
+)
+from infrastructure.kafka import (
+    Outcome,
+    kafka_send_outcome,
+    kafka_send_outcomes,
+    kafka_send_event,
+    kafka_send_encoded_event,
+    kafka_send_transaction,
+    kafka_send_session,
+    kafka_send_attachment,
+    kafka_send_event_with_attachments,
+    encode_event,
+    session_message,
+)
+from infrastructure.payload_sizes import record_payload_size
+from infrastructure.process_pipeline import start_process_pipeline
+from infrastructure.relay_util import normalize_event
+from infrastructure.seeding import get_random, per_user
 import random
 
-from infrastructure.util import get_uuid
+from infrastructure.util import get_uuid, AliasSampler
+from tasks.event_tasks import (
+    get_event_pool_params,
+    get_session_event_params,
+    get_transaction_event_params,
+    random_session,
+    transaction_generator,
+)
+
+# the project the pooled events are normalized with (the project is set on every send)
+_PRENORMALIZE_PROJECT_ID = 1
 
 
 def kafka_outcome_task(outcome: Outcome):
@@ -29,7 +66,7 @@ def kafka_random_outcome_task(user):
     """
     A task that creates random outcomes
     """
-    outcome = _id_to_outcome[random.randint(0, 4)]
+    outcome = _id_to_outcome[get_random(user).randint(0, 4)]
     _kafka_send_outcome(user, outcome)
 
 
@@ -48,42 +85,279 @@ def kafka_configurable_outcome_task_factory(task_params):
         kafka_configurable_outcome_task:
             accepted: 1
             filtered: 1
+            batch_size: 10  # optional, outcomes sent per task invocation (default 1)
 
     """
     outcome_names = {outcome.name.lower(): outcome for outcome in Outcome}
+    outcomes = []
     frequencies = []
-    total_freq = 0
     for name, val in task_params.items():
         if name in outcome_names and val != 0:
-            total_freq += val
-            frequencies.append([outcome_names[name], total_freq])
-    if total_freq == 0:
-        ValueError("kafka_configurable_outcome_task has no configured outcomes")
+            outcomes.append(outcome_names[name])
+            frequencies.append(val)
+    if len(outcomes) == 0:
+        raise ValueError("kafka_configurable_outcome_task has no configured outcomes")
+
+    sampler = AliasSampler(outcomes, frequencies)
+    batch_size = task_params.get("batch_size", 1)
 
     def task(user):
-        outcome_idx = random.randint(1, total_freq)
-        for outcome, acc_freq in frequencies:
-            if acc_freq >= outcome_idx:
-                break
-        else:
-            raise ValueError(
-                "kafka_configurable_outcome_task bug, invalid math, we should never get here"
-            )
-        _kafka_send_outcome(user, outcome)
+        rng = get_random(user)
+        kafka_send_outcomes(
+            user,
+            (
+                (get_project_info(user).id, sampler.choose(rng), get_uuid())
+                for _ in range(batch_size)
+            ),
+        )
 
     return task
 
 
 def random_kafka_event_task_factory(task_params=None):
+    """
+    Sends random events (see `base_event_generator`) to the events topic.
+
+    Besides the event generator parameters it accepts:
+    * send_outcome: also send an accepted outcome for every event (default true)
+    * event_pool_size, event_pool_refresh_rate: see `event_pool_generator`
+    * prenormalize: normalize the pooled events only once, when they are generated,
+      and only rewrite their ids and timestamps afterwards (default false, only used
+      together with `event_pool_size`)
+    * encoder_processes: generate, normalize and encode the events in this many separate
+      processes (see `ProcessPipeline`), the users only send the encoded events.
+      0 (the default) encodes the events in the user, -1 uses one process per CPU
+    * encoder_queue_size: how many encoded events are kept ready (default 10000)
+    * encoder_batch_size: events encoded per call to a process (default 100)
+    """
     if task_params is None:
         task_params = {}
 
-    event_generator = base_event_generator(**task_params)
+    send_outcome = task_params.get("send_outcome", True)
+    encoder_processes = int(task_params.get("encoder_processes", 0))
+    if encoder_processes != 0:
+        return _pipelined_kafka_event_task(task_params, encoder_processes, send_outcome)
+
+    prenormalize = _prenormalize(task_params)
+    event_generators = per_user(lambda rng: _kafka_event_generator(task_params, rng)[0])
 
     def inner(user):
-        event = event_generator()
-        send_outcome = task_params.get("send_outcome", True)
-        return _kafka_send_event(user, event, send_outcome)
+        event = event_generators(user)()
+        return _kafka_send_event(user, event, send_outcome, normalize=not prenormalize)
+
+    return inner
+
+
+def _prenormalize(task_params) -> bool:
+    pool_params = get_event_pool_params(task_params)
+    return task_params.get("prenormalize", False) and pool_params["pool_size"] > 0
+
+
+def _kafka_event_generator(task_params, rng=random):
+    """
+    Returns the event generator configured by the task params and whether
+    the generated events are already normalized
+    """
+    event_generator = base_event_generator(rng=rng, **task_params)
+    pool_params = get_event_pool_params(task_params)
+    prenormalize = _prenormalize(task_params)
+
+    if prenormalize:
+        raw_event_generator = event_generator
+
+        def event_generator():
+            event = raw_event_generator()
+            event["timestamp"] = time.time()
+            return normalize_event(event, _PRENORMALIZE_PROJECT_ID)
+
+        refresh = refresh_normalized_event
+    else:
+        refresh = refresh_event
+
+    event_generator = event_pool_generator(
+        event_generator, refresh=refresh, rng=rng, **pool_params
+    )
+    return event_generator, prenormalize
+
+
+def _pipelined_kafka_event_task(task_params, processes, send_outcome):
+    batch_size = int(task_params.get("encoder_batch_size", 100))
+    queue_size = int(task_params.get("encoder_queue_size", 10000))
+    pipeline = None
+
+    def inner(user):
+        nonlocal pipeline
+        if pipeline is None:
+            # the projects are only known once there is a user
+            pipeline = start_process_pipeline(
+                functools.partial(_encode_event_batch, batch_size),
+                initializer=_init_event_encoder,
+                initargs=(task_params, _get_project_table(user)),
+                processes=processes,
+                queue_size=queue_size,
+                batch_size=batch_size,
+            )
+
+        project_id, event_id, value = pipeline.get()
+        kafka_send_encoded_event(user, value)
+        record_payload_size(user, "random_kafka_event", len(value))
+
+        if send_outcome:
+            kafka_send_outcome(user, project_id, Outcome.ACCEPTED, event_id)
+
+    return inner
+
+
+def _get_project_table(user):
+    project_table = getattr(user, "project_table", None)
+    if project_table is None:
+        project_table = create_project_table(user.get_params().get("num_projects", 1))
+    return project_table
+
+
+# (event generator, prenormalize, project table) in an event encoder process
+_encoder = None
+
+
+def _init_event_encoder(task_params, project_table):
+    global _encoder
+    event_generator, prenormalize = _kafka_event_generator(task_params)
+    _encoder = (event_generator, prenormalize, project_table)
+
+
+def _encode_event_batch(batch_size):
+    """
+    Runs in an event encoder process, returns a list of (project id, event id, message)
+    """
+    event_generator, prenormalize, project_table = _encoder
+    normalize = not prenormalize
+    batch = []
+    for _ in range(batch_size):
+        project_id = project_table.choose().id
+        event = _prepare_event(event_generator(), project_id, normalize)
+        event_id, value = encode_event(event, project_id, normalize=normalize)
+        batch.append((project_id, event_id, value))
+    return batch
+
+
+def kafka_transaction_task_factory(task_params=None):
+    """
+    Sends transactions to the transactions topic.
+
+    Accepts the same parameters as `transaction_event_task_factory` (including the event
+    pool parameters).
+    """
+    if task_params is None:
+        task_params = {}
+
+    transaction_params = get_transaction_event_params(task_params)
+    pool_params = get_event_pool_params(task_params)
+    generators = per_user(
+        lambda rng: event_pool_generator(
+            transaction_generator(rng=rng, **transaction_params),
+            refresh=refresh_transaction,
+            rng=rng,
+            **pool_params,
+        )
+    )
+
+    def inner(user):
+        project_info = get_project_info(user)
+        transaction = generators(user)()
+        transaction["type"] = "transaction"
+        transaction["project"] = project_info.id
+        size = kafka_send_transaction(user, transaction, project_info.id)
+        record_payload_size(user, "kafka_transaction", size)
+
+    return inner
+
+
+def kafka_session_task_factory(task_params=None):
+    """
+    Sends session updates (as produced by relay) to the sessions topic.
+
+    Accepts the same parameters as `session_event_task_factory` and
+    * org_id: the organization of the projects (default 1)
+    """
+    if task_params is None:
+        task_params = {}
+
+    params = get_session_event_params(task_params)
+    org_id = task_params.get("org_id", 1)
+
+    def inner(user):
+        project_info = get_project_info(user)
+        session = random_session(params, get_random(user))
+        kafka_send_session(
+            user,
+            session_message(
+                project_id=project_info.id,
+                session_id=str(session["session_id"]),
+                # relay converts distinct ids that are not UUIDs into (v5) UUIDs
+                distinct_id=str(uuid.uuid5(uuid.NAMESPACE_OID, session["user_id"])),
+                status=session["status"],
+                started=session["started"].replace(tzinfo=timezone.utc).timestamp(),
+                release=session["release"],
+                environment=session["environment"],
+                duration=session["duration"],
+                errors=session["errors"],
+                seq=session["seq"],
+                org_id=org_id,
+            ),
+        )
+
+    return inner
+
+
+def kafka_attachment_task_factory(task_params=None):
+    """
+    Sends events with attachments to the attachments topic, the attachments are sent in
+    chunks followed by the event.
+
+    Accepts the parameters of `base_event_generator` and
+    * num_attachments: attachments per event (default 1)
+    * min_attachment_size, max_attachment_size: the size (in bytes) of an attachment is
+      chosen uniformly in this range (default 10000 for both)
+    * chunk_size: maximum size of an attachment chunk (default 1MB, as relay)
+    * standalone: send only the attachments (as standalone attachment messages)
+      without the event (default false)
+    """
+    if task_params is None:
+        task_params = {}
+
+    num_attachments = int(task_params.get("num_attachments", 1))
+    min_size = int(task_params.get("min_attachment_size", 10000))
+    max_size = int(task_params.get("max_attachment_size", min_size))
+    chunk_size = int(task_params.get("chunk_size", 1024 * 1024))
+    standalone = task_params.get("standalone", False)
+
+    # attachments are (prefixes of) the same random data, generated once
+    data = os.urandom(max_size)
+    event_generators = per_user(
+        lambda rng: base_event_generator(rng=rng, **task_params)
+    )
+
+    def inner(user):
+        rng = get_random(user)
+        project_info = get_project_info(user)
+        event = _prepare_event(event_generators(user)(), project_info.id)
+        event_id = event["event_id"]
+
+        attachments = [
+            kafka_send_attachment(
+                user,
+                project_info.id,
+                event_id,
+                f"attachment-{idx}.bin",
+                data[: rng.randint(min_size, max_size)],
+                chunk_size,
+                standalone=standalone,
+            )
+            for idx in range(num_attachments)
+        ]
+
+        if not standalone:
+            kafka_send_event_with_attachments(user, event, project_info.id, attachments)
 
     return inner
 
@@ -96,16 +370,23 @@ def _kafka_send_outcome(user, outcome: Outcome):
     )
 
 
-def _kafka_send_event(user, event, send_outcome=True):
-    project_info = get_project_info(user)
-    event_id = get_uuid()
-    event["event_id"] = event_id
+def _prepare_event(event, project_id, normalize=True):
+    if normalize:
+        event["event_id"] = get_uuid()
+        event["timestamp"] = time.time()
+    # else ids and timestamps of normalized events are already refreshed by the pool
 
     # set required attributes for processing in a central place
-    event["project"] = project_info.id
-    event["timestamp"] = time.time()
+    event["project"] = project_id
+    return event
+
+
+def _kafka_send_event(user, event, send_outcome=True, normalize=True):
+    project_info = get_project_info(user)
+    event = _prepare_event(event, project_info.id, normalize)
 
-    kafka_send_event(user, event, project_info.id)
+    size = kafka_send_event(user, event, project_info.id, normalize=normalize)
+    record_payload_size(user, "random_kafka_event", size)
 
     if send_outcome:
-        kafka_send_outcome(user, project_info.id, Outcome.ACCEPTED, event_id)
+        kafka_send_outcome(user, project_info.id, Outcome.ACCEPTED, event["event_id"])
@@ -0,0 +1,223 @@
+"""
+Tasks that replay recorded SDK traffic
+
+The recorded traffic is a JSONL file (optionally gzipped, detected by the .gz extension)
+with one request per line, something like:
+
+    {"timestamp": 1634567890.123, "method": "POST", "path": "/api/42/envelope/",
+     "headers": {"X-Sentry-Auth": "Sentry sentry_key=abc,sentry_version=7", ...},
+     "body": "..."}
+
+* `timestamp` (optional) the time (in seconds) the request was recorded, used to
+  reproduce the original inter-arrival times
+* `method` (optional, default POST)
+* `path` the request path (including the query string)
+* `headers` (optional)
+* `body` the request body as a (utf-8) string or `body_base64` for binary bodies
+"""
+import base64
+import gzip
+import json
+import re
+import time
+from typing import Any, Callable, Iterator, Mapping, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from locust.exception import StopUser
+
+from infrastructure.configurable_user import get_project_info
+
+_PROJECT_ID_IN_PATH = re.compile(r"^/api/\d+/")
+_SENTRY_KEY = re.compile(r"sentry_key=[^,&\s]+")
+# headers set by the http client
+_SKIPPED_HEADERS = {"content-length", "host", "connection", "transfer-encoding"}
+
+
+class RecordedRequest(NamedTuple):
+    timestamp: Optional[float]
+    method: str
+    path: str
+    headers: Mapping[str, str]
+    body: bytes
+
+
+def read_lines(filename: str) -> Iterator[str]:
+    if filename.endswith(".gz"):
+        f = gzip.open(filename, "rt", encoding="utf-8")
+    else:
+        f = open(filename, "rt", encoding="utf-8")
+    with f:
+        yield from f
+
+
+def parse_requests(lines: Iterator[str]) -> Iterator[RecordedRequest]:
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        yield _parse_request(json.loads(line))
+
+
+def _parse_request(record: Mapping[str, Any]) -> RecordedRequest:
+    if "body_base64" in record:
+        body = base64.b64decode(record["body_base64"])
+    else:
+        body = (record.get("body") or "").encode("utf-8")
+
+    headers = {
+        name: value
+        for name, value in (record.get("headers") or {}).items()
+        if name.lower() not in _SKIPPED_HEADERS
+    }
+
+    return RecordedRequest(
+        timestamp=record.get("timestamp"),
+        method=record.get("method", "POST").upper(),
+        path=record["path"],
+        headers=headers,
+        body=body,
+    )
+
+
+def recorded_requests(
+    filename: str, loop: bool = True, on_restart: Optional[Callable[[], None]] = None
+) -> Iterator[RecordedRequest]:
+    """
+    Lazily streams the recorded requests from the file (restarting at the end of the
+    file, after calling `on_restart`, when `loop` is set).
+
+    Raises ValueError if the file has no request (instead of reopening it forever).
+    """
+    while True:
+        count = 0
+        for request in parse_requests(read_lines(filename)):
+            count += 1
+            yield request
+        if count == 0:
+            raise ValueError(f"No recorded requests in {filename}")
+        if not loop:
+            return
+        if on_restart is not None:
+            on_restart()
+
+
+def retarget_request(request: RecordedRequest, project_id, project_key):
+    """
+    Returns the path, headers and body of the recorded request changed to target the
+    project (the `dsn` of the envelope header is changed too, unless the body is
+    compressed)
+    """
+    path = _PROJECT_ID_IN_PATH.sub(f"/api/{project_id}/", request.path, count=1)
+    path = _SENTRY_KEY.sub(f"sentry_key={project_key}", path)
+
+    headers = dict(request.headers)
+    compressed = False
+    for name, value in headers.items():
+        lower_name = name.lower()
+        if lower_name == "x-sentry-auth":
+            headers[name] = _SENTRY_KEY.sub(f"sentry_key={project_key}", value)
+        elif lower_name == "content-encoding":
+            compressed = value.strip().lower() not in ("", "identity")
+
+    body = request.body
+    if not compressed and "/envelope/" in path:
+        body = _retarget_envelope(body, project_id, project_key)
+
+    return path, headers, body
+
+
+def _retarget_envelope(body: bytes, project_id, project_key) -> bytes:
+    """
+    Changes the `dsn` of the envelope header
+
+    >>> _retarget_envelope(b'{"dsn":"https://abc@o1.sentry.io/42"}\\n{}', 7, "def")
+    b'{"dsn": "https://def@o1.sentry.io/7"}\\n{}'
+    """
+    header, newline, items = body.partition(b"\n")
+    if b'"dsn"' not in header:
+        return body
+    try:
+        envelope_header = json.loads(header)
+        dsn = urlsplit(envelope_header["dsn"])
+    except (ValueError, KeyError, TypeError):
+        return body  # not an envelope header with a dsn, sent as recorded
+    host = dsn.netloc.rpartition("@")[2]
+    dsn_path = dsn.path.rstrip("/").rpartition("/")[0]
+    envelope_header["dsn"] = urlunsplit(
+        (dsn.scheme, f"{project_key}@{host}", f"{dsn_path}/{project_id}", "", "")
+    )
+    return json.dumps(envelope_header).encode("utf-8") + newline + items
+
+
+class _ReplayClock:
+    """
+    Maps the recorded timestamps on the current time (compressed/expanded by `speed`)
+    """
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self._start = None
+        self._first_timestamp = None
+
+    def restart(self):
+        """
+        The recording restarted, the next timestamp is mapped on the current time
+        """
+        self._start = None
+
+    def wait(self, timestamp: Optional[float]):
+        if self.speed <= 0 or timestamp is None:
+            return  # as fast as possible
+
+        if self._start is None:
+            self._start = time.monotonic()
+            self._first_timestamp = timestamp
+            return
+
+        # (a request recorded out of order is sent right away)
+        due = self._start + (timestamp - self._first_timestamp) / self.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def replay_task_factory(task_params=None):
+    """
+    Replays the recorded requests from a (optionally gzipped) JSONL file.
+
+    The project id and key of every request are replaced with a project chosen
+    by the user (see `num_projects`).
+
+    Parameters:
+    * filename: the recorded requests
+    * speed: 1 replays the requests at the recorded rate, 2 twice as fast ...
+      0 replays the requests as fast as possible (default 1)
+    * loop: restart from the beginning at the end of the file (default true)
+
+    NOTE: the recording is shared by all the users of the task (in a process), each task
+    invocation sends the next request (after waiting for its recorded time)
+    """
+    filename = task_params.pop("filename")
+    speed = float(task_params.pop("speed", 1.0))
+    loop = task_params.pop("loop", True)
+
+    if next(parse_requests(read_lines(filename)), None) is None:
+        raise ValueError(f"No recorded requests in {filename}")
+
+    clock = _ReplayClock(speed)
+    requests = recorded_requests(filename, loop=loop, on_restart=clock.restart)
+
+    def inner(user):
+        request = next(requests, None)
+        if request is None:
+            raise StopUser()  # nothing left to replay
+
+        clock.wait(request.timestamp)
+
+        project_info = get_project_info(user)
+        path, headers, body = retarget_request(
+            request, project_info.id, project_info.key
+        )
+        return user.client.request(request.method, path, headers=headers, data=body)
+
+    return inner